@@ -7,14 +7,23 @@ from dotenv import load_dotenv
 import requests
 from datetime import datetime
 from openai import OpenAI
-from binance.client import Client
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import asyncio
 import json
+import re
+import sqlite3
+import hmac
+import hashlib
+from urllib.parse import urlencode
+import aiohttp
+import math
 import websockets
 import time
-from collections import defaultdict
+import numpy as np
+from collections import defaultdict, deque
+from array import array
+from typing import NamedTuple
 
 # 🌍 Завантаження змінних середовища
 load_dotenv()
@@ -31,6 +40,8 @@ CONFIG = {
 
     # Кластери
     "CLUSTER_BUCKET_SIZE": 10,
+    "FOOTPRINT_BUCKET_SIZES": [5, 10, 25, 50],  # роздільності footprint (USDT)
+    "SESSION_PROFILE_BUCKET": 5,                 # бакет сесійного профілю (POC / value area)
     "CLUSTER_INTERVAL": 10,
     "BOOST_THRESHOLD": 65,
     "SUPER_BOOST_RATIO": 90,
@@ -52,7 +63,94 @@ CONFIG = {
     },
     "PARTIAL_CLOSE_AT": 0.9,
     "PARTIAL_CLOSE_SIZE": 0.8,
-    "BREAKEVEN_SL_OFFSET": 0.005
+    "BREAKEVEN_SL_OFFSET": 0.005,
+
+    # Приймання ринкових даних
+    "AGGTRADE_QUEUE_SIZE": 20000,
+    "MARKET_FEEDS": int(os.getenv("MARKET_FEEDS", 1)),  # >1 — hot-standby фіди з дедуплікацією
+    "INGEST_OVERFLOW_POLICY": "drop_oldest",
+
+    # Heartbeat і свіжість даних
+    "WS_PING_INTERVAL": 20,
+    "WS_PING_TIMEOUT": 20,
+    "STREAM_STALE_SECONDS": {  # тиша в потоці довше порогу → перепідключення (None — не стежимо)
+        "aggTrade": 30,
+        "depth": 10,
+        "markPrice": 10,
+        "bookTicker": 10,
+        "kline": 90,
+        "forceOrder": None,
+        "default": 60
+    },
+    "STATE_MAX_AGE_SECONDS": {  # старші значення шлях рішень не використовує
+        "trades": 30,
+        "walls": 5,
+        "delta": 10,
+        "book": 5
+    },
+
+    # Локальний стакан
+    "WALL_SEARCH_BPS": 25,  # пошук стін у межах ±0.25% від mid
+
+    # Трекер стін / спуфінг
+    "WALL_MIN_QTY": 15,             # BTC — менші рівні стіною не вважаються
+    "WALL_MAX_DISTANCE_BPS": 50,    # нові стіни далі ±0.5% від mid ігноруються
+    "SPOOF_DECAY_SECONDS": 300,     # згасання історії знятих/виконаних стін
+    "SPOOF_SHORT_LIFE_SECONDS": 10, # знята стіна, що прожила менше — повна вага
+    "SPOOF_SCORE_SKIP": 0.7,        # поріг спуф-скору для пропуску сигналу
+
+    # CVD (ковзна дельта обʼєму)
+    "CVD_BUCKET_MS": 100,
+    "CVD_HORIZON_SECONDS": 600,
+    "DELTA_WINDOW_SECONDS": 3,      # вікно для Buy/Sell Ratio у промпті GPT
+
+    # Свічки в памʼяті
+    "KLINE_INTERVALS": ["1m", "5m"],
+    "KLINE_CAPACITY": 500,
+
+    # Індикатори (рахуються інкрементально на кожну подію свічки)
+    "EMA_PERIOD": 20,               # EMA тренду на 5m
+    "VWAP_WINDOW": 20,              # ковзний VWAP по останніх 20 свічках 1m
+    "ATR_PERIOD": 14,
+
+    # Ціна з потоків markPrice@1s / bookTicker
+    "PRICE_MAX_AGE_SECONDS": 5,     # старіша ціна не використовується
+    "CONTINUATION_PCT": 0.05,       # мінімальний рух після кластера, %
+    "CONTINUATION_WINDOW_SECONDS": 5,
+
+    # User data stream
+    "LISTEN_KEY_KEEPALIVE_SECONDS": 1800,  # listenKey живе 60 хв — продовжуємо кожні 30
+
+    # Журнал угод
+    "LEDGER_PATH": os.getenv("LEDGER_PATH", "trade_ledger.jsonl"),
+    "LEDGER_BACKFILL_HOURS": 24,    # глибина userTrades для порожнього журналу
+
+    # REST Binance: бюджет ваги і пріоритети
+    "REST_WORKERS": 8,              # одночасних запитів (= зʼєднань у пулі)
+    "REST_TIMEOUT_SECONDS": 10,
+    "REST_RECV_WINDOW_MS": 5000,
+    "REST_WEIGHT_LIMIT": 2400,      # ліміт ваги за хвилину на IP
+    "REST_WEIGHT_SHARE": {          # частка ліміту, до якої пускається кожен пріоритет
+        "order": 0.95,
+        "account": 0.85,
+        "market": 0.7
+    },
+    "REST_ORDER_LIMIT_10S": 280,    # біржовий ліміт 300 ордерів / 10 с із запасом
+
+    # Локальний журнал угод і реплікація в Google Sheets
+    "JOURNAL_PATH": os.getenv("JOURNAL_PATH", "journal.db"),
+    "JOURNAL_FLUSH_SECONDS": 30,       # максимальний інтервал між реплікаціями
+    "JOURNAL_BATCH_DELAY_SECONDS": 1,  # скільки чекати інші записи для спільної пачки
+    "JOURNAL_RETRY_SECONDS": 30,       # пауза після помилки Sheets
+
+    # Статистика угод у памʼяті
+    "STATS_WINDOW": 20,                # ковзне вікно winrate по типу
+    "STATS_RECENT_CAPACITY": 50,       # скільки останніх результатів тримати для контексту GPT
+
+    # Збір контексту сигналу
+    "CONTEXT_DEADLINE_SECONDS": 2.0,   # загальний дедлайн рішення
+    "CONTEXT_SOURCE_DEADLINES": {"news": 1.5, "candles": 0.2, "walls": 0.2},
+    "NEWS_TIMEOUT_SECONDS": 10         # HTTP-таймаут CryptoPanic (запит дозавершується у фоні)
 }
 # 🔐 Змінні середовища
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -68,8 +166,226 @@ DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
 current_stake_usd: float = CONFIG["TRADE_AMOUNT_USD"]
 win_streak: int = 0
 
+# 🌐 Асинхронний REST-клієнт Binance Futures: спільна keep-alive сесія, пріоритети, бюджет ваги
+class BinanceRestError(Exception):
+    def __init__(self, status: int, code, message: str):
+        self.status = status
+        self.code = code
+        super().__init__(f"APIError(status={status}, code={code}): {message}")
+
+
+class BinanceRest:
+    """
+    Усі запити проходять через одну чергу з пріоритетами: ордери → рахунок → ринкові дані.
+    Перед відправкою перевіряється бюджет ваги (X-MBX-USED-WEIGHT-1M) і лічильник ордерів
+    (X-MBX-ORDER-COUNT-10S); нижчий пріоритет зупиняється раніше, тож під навантаженням
+    ордери проходять, а 429/418 не настає. Запит, якому бракує бюджету, відкладається
+    до нового вікна і не займає зʼєднання. Якщо бан все ж прийшов — чекаємо Retry-After.
+    Назви методів збігаються з python-binance.
+    """
+
+    BASE_URL = "https://fapi.binance.com"
+    PRIORITY_ORDER, PRIORITY_ACCOUNT, PRIORITY_MARKET = 0, 1, 2
+    PRIORITY_NAMES = {0: "order", 1: "account", 2: "market"}
+
+    def __init__(self, api_key: str, api_secret: str, workers: int = 8):
+        self.api_key = api_key or ""
+        self.api_secret = (api_secret or "").encode()
+        self.workers = workers
+        self.session = None
+        self.queue = None
+        self.slots = None
+        self.seq = 0
+        self.used_weight = 0
+        self.weight_window = 0
+        self.order_count_10s = 0
+        self.order_window = 0
+        self.banned_until = 0.0
+        self.requests = defaultdict(int)
+        self.waits = defaultdict(int)
+        self.errors = 0
+
+    async def start(self):
+        if self.session is not None:
+            return
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.workers, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=CONFIG["REST_TIMEOUT_SECONDS"])
+        )
+        self.queue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(self.workers)
+        asyncio.create_task(self._dispatch())
+
+    async def request(self, method: str, path: str, params: dict = None, signed: bool = False,
+                      priority: int = PRIORITY_MARKET, weight: int = 1, timing: dict = None):
+        """
+        timing — якщо передано, отримує wire_ms: момент після підпису, перед записом HTTP-запиту.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        await self.queue.put((priority, self.seq, method, path, params or {}, signed, weight, future, timing))
+        return await future
+
+    async def _dispatch(self):
+        while True:
+            job = await self.queue.get()
+            priority, _, _, _, _, _, weight, future, _ = job
+            if future.done():
+                continue
+            delay = self._budget_delay(priority, weight)
+            if delay > 0:
+                self.waits[self.PRIORITY_NAMES[priority]] += 1
+                asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+                continue
+            await self.slots.acquire()
+            asyncio.create_task(self._run(job))
+
+    async def _run(self, job: tuple):
+        priority, _, method, path, params, signed, _, future, timing = job
+        try:
+            self.requests[self.PRIORITY_NAMES[priority]] += 1
+            result = await self._send(method, path, params, signed, timing)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            self.errors += 1
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def _roll_windows(self, now: float):
+        if int(now // 60) != self.weight_window:
+            self.weight_window = int(now // 60)
+            self.used_weight = 0
+        if int(now // 10) != self.order_window:
+            self.order_window = int(now // 10)
+            self.order_count_10s = 0
+
+    def _budget_delay(self, priority: int, weight: int) -> float:
+        """
+        0 — запит можна відправляти (вага резервується); інакше — скільки секунд почекати.
+        """
+        now = time.time()
+        if now < self.banned_until:
+            return self.banned_until - now
+        self._roll_windows(now)
+        weight_budget = CONFIG["REST_WEIGHT_LIMIT"] * CONFIG["REST_WEIGHT_SHARE"][self.PRIORITY_NAMES[priority]]
+        if self.used_weight + weight > weight_budget:
+            return 60 - now % 60 + 0.05
+        if priority == self.PRIORITY_ORDER and self.order_count_10s >= CONFIG["REST_ORDER_LIMIT_10S"]:
+            return 10 - now % 10 + 0.05
+        self.used_weight += weight  # оцінка наперед; заголовок відповіді уточнить
+        return 0
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, separators=(",", ":"))
+        return value
+
+    async def _send(self, method: str, path: str, params: dict, signed: bool, timing: dict = None):
+        params = {key: self._encode(value) for key, value in params.items() if value is not None}
+        if signed:
+            params["timestamp"] = int(time.time() * 1000)
+            params["recvWindow"] = CONFIG["REST_RECV_WINDOW_MS"]
+        query = urlencode(params)
+        if signed:
+            query += "&signature=" + hmac.new(self.api_secret, query.encode(), hashlib.sha256).hexdigest()
+        url = f"{self.BASE_URL}{path}" + (f"?{query}" if query else "")
+        if timing is not None:
+            timing["wire_ms"] = time.time() * 1000
+
+        async with self.session.request(method, url, headers={"X-MBX-APIKEY": self.api_key}) as response:
+            self._update_limits(response.headers)
+            if response.status in (418, 429):
+                retry_after = int(response.headers.get("Retry-After", 60))
+                self.banned_until = time.time() + retry_after
+                send_message(f"🚫 Binance REST {response.status}: пауза запитів на {retry_after} сек")
+                raise BinanceRestError(response.status, None, "rate limit")
+            data = await response.json(content_type=None)
+            if response.status >= 400:
+                raise BinanceRestError(response.status, data.get("code"), data.get("msg"))
+            return data
+
+    def _update_limits(self, headers):
+        now = time.time()
+        self._roll_windows(now)
+        used_weight = headers.get("X-MBX-USED-WEIGHT-1M")
+        if used_weight is not None:
+            self.used_weight = int(used_weight)
+        order_count = headers.get("X-MBX-ORDER-COUNT-10S")
+        if order_count is not None:
+            self.order_count_10s = int(order_count)
+
+    def stats(self) -> dict:
+        return {
+            "used_weight_1m": self.used_weight,
+            "weight_limit": CONFIG["REST_WEIGHT_LIMIT"],
+            "order_count_10s": self.order_count_10s,
+            "banned_for_seconds": max(0.0, round(self.banned_until - time.time(), 1)),
+            "queued": self.queue.qsize() if self.queue else 0,
+            "requests": dict(self.requests),
+            "budget_waits": dict(self.waits),
+            "errors": self.errors,
+        }
+
+    # --- Ринкові дані ---
+    @staticmethod
+    def _depth_weight(limit: int) -> int:
+        return 2 if limit <= 50 else 5 if limit <= 100 else 10 if limit <= 500 else 20
+
+    @staticmethod
+    def _klines_weight(limit: int) -> int:
+        return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+
+    async def futures_exchange_info(self):
+        return await self.request("GET", "/fapi/v1/exchangeInfo", weight=1)
+
+    async def futures_order_book(self, **params):
+        return await self.request("GET", "/fapi/v1/depth", params, weight=self._depth_weight(params.get("limit", 500)))
+
+    async def futures_aggregate_trades(self, **params):
+        return await self.request("GET", "/fapi/v1/aggTrades", params, weight=20)
+
+    async def futures_klines(self, **params):
+        return await self.request("GET", "/fapi/v1/klines", params, weight=self._klines_weight(params.get("limit", 500)))
+
+    async def futures_open_interest(self, **params):
+        return await self.request("GET", "/fapi/v1/openInterest", params, weight=1)
+
+    # --- Рахунок ---
+    async def futures_position_information(self, **params):
+        return await self.request("GET", "/fapi/v2/positionRisk", params, signed=True, priority=self.PRIORITY_ACCOUNT, weight=5)
+
+    async def futures_get_open_orders(self, **params):
+        return await self.request("GET", "/fapi/v1/openOrders", params, signed=True, priority=self.PRIORITY_ACCOUNT, weight=1)
+
+    async def futures_account_trades(self, **params):
+        return await self.request("GET", "/fapi/v1/userTrades", params, signed=True, priority=self.PRIORITY_ACCOUNT, weight=5)
+
+    async def futures_stream_get_listen_key(self):
+        return (await self.request("POST", "/fapi/v1/listenKey", priority=self.PRIORITY_ACCOUNT))["listenKey"]
+
+    async def futures_stream_keepalive(self, **params):
+        return await self.request("PUT", "/fapi/v1/listenKey", params, priority=self.PRIORITY_ACCOUNT)
+
+    # --- Ордери ---
+    async def futures_create_order(self, **params):
+        return await self.request("POST", "/fapi/v1/order", params, signed=True, priority=self.PRIORITY_ORDER)
+
+    async def futures_place_batch_order(self, timing: dict = None, **params):
+        return await self.request("POST", "/fapi/v1/batchOrders", params, signed=True, priority=self.PRIORITY_ORDER,
+                                  weight=5, timing=timing)
+
+    async def futures_cancel_orders(self, **params):
+        return await self.request("DELETE", "/fapi/v1/batchOrders", params, signed=True, priority=self.PRIORITY_ORDER)
+
+
 # 🔌 Ініціалізація клієнтів
-binance_client = Client(api_key=BINANCE_API_KEY, api_secret=BINANCE_SECRET_KEY)
+binance_client = BinanceRest(BINANCE_API_KEY, BINANCE_SECRET_KEY, CONFIG["REST_WORKERS"])
 client = OpenAI(api_key=OPENAI_API_KEY)
 # 🔍 Перевірка наявності важливих ENV-змінних
 def check_env_variables():
@@ -84,12 +400,18 @@ def check_env_variables():
 # 🔄 Скидання runtime-змінних (на випадок перезапуску)
 def init_runtime_state():
     global last_trade_time, cached_oi, cached_volume, cached_vwap, last_open_interest
-    global trailing_stops, cluster_data, cluster_last_reset, cluster_is_processing
+    global trailing_stops, footprint, cluster_last_reset, cluster_is_processing
     global last_ws_restart_time, open_position_lock
+    global market_hub, aggtrade_queue, delta_trade_queue
+    global cvd_engine, latest_cluster_window, cluster_window_ready, cluster_windows_skipped
+    global state_updated_at, last_stale_alert_time, depth_diff_queue, local_book
+    global kline_stores, kline_queues, indicator_engines
+    global price_cache, mark_price_queue, book_ticker_queue, account_mirror, trade_ledger, order_executor
+    global trade_journal, trade_stats, gpt_context, context_gatherer
+    global last_impulse, last_skip_message_time
 
     # 🔍 Глобальні змінні для orderbook-фільтра
-    global last_bid_wall, last_ask_wall, fake_wall_counter, last_fake_wall_time, fake_wall_detected
-    global current_buy_wall, current_sell_wall
+    global current_buy_wall, current_sell_wall, wall_tracker, wall_trade_queue
 
     # 🔐 Лок на відкриття позицій
     open_position_lock = asyncio.Lock()
@@ -103,134 +425,676 @@ def init_runtime_state():
 
     # 📊 Стани кластерного монітора
     trailing_stops = {"LONG": None, "SHORT": None}
-    cluster_data = defaultdict(lambda: {"buy": 0, "sell": 0})
+    footprint = FootprintEngine(
+        sorted({CONFIG["CLUSTER_BUCKET_SIZE"], *CONFIG["FOOTPRINT_BUCKET_SIZES"]}),
+        CONFIG["SESSION_PROFILE_BUCKET"]
+    )
     cluster_last_reset = time.time()
     cluster_is_processing = False
+    cvd_engine = CVDEngine(CONFIG["CVD_BUCKET_MS"], CONFIG["CVD_HORIZON_SECONDS"])
+    latest_cluster_window = None
+    cluster_window_ready = asyncio.Event()
+    cluster_windows_skipped = 0
+    last_impulse = {"side": None, "volume": 0, "timestamp": 0}
+    last_skip_message_time = 0
 
     # 🔁 Перезапуск WebSocket контролю
     last_ws_restart_time = 0
 
+    # 🧊 Час останнього оновлення похідних станів
+    state_updated_at = {}
+    last_stale_alert_time = 0.0
+
+    # 🔀 Одне комбіноване зʼєднання на всі ринкові потоки + черги споживачів
+    symbol = CONFIG["SYMBOL"].lower()
+    market_hub = MarketStreamHub(CONFIG["MARKET_FEEDS"])
+    aggtrade_queue = market_hub.subscribe(f"{symbol}@aggTrade", "cluster", CONFIG["AGGTRADE_QUEUE_SIZE"], CONFIG["INGEST_OVERFLOW_POLICY"])
+    delta_trade_queue = market_hub.subscribe(f"{symbol}@aggTrade", "delta", CONFIG["AGGTRADE_QUEUE_SIZE"], CONFIG["INGEST_OVERFLOW_POLICY"])
+    depth_diff_queue = market_hub.subscribe(f"{symbol}@depth@100ms", "local_book", 5000)
+    local_book = None
+
+    # 👤 Дзеркало позицій і ордерів з user data stream
+    account_mirror = AccountMirror(CONFIG["SYMBOL"])
+    trade_ledger = TradeLedger(CONFIG["LEDGER_PATH"])
+    account_mirror.ledger = trade_ledger
+
+    # ⚡ Виконання ордерів пачками
+    order_executor = OrderExecutor(CONFIG["SYMBOL"])
+
+    # 🗃️ Журнал угод (SQLite) з фоновою реплікацією в Sheets
+    trade_journal = TradeJournal(CONFIG["JOURNAL_PATH"])
+    trade_ledger.journal = trade_journal
+    trade_stats = TradeStats(CONFIG["STATS_WINDOW"], CONFIG["STATS_RECENT_CAPACITY"])
+    trade_stats.rebuild(trade_journal.closed_results())
+    trade_journal.aggregator = trade_stats
+
+    # 💲 Остання ціна з потоків замість futures_mark_price
+    price_cache = PriceCache(CONFIG["PRICE_MAX_AGE_SECONDS"])
+    price_cache.executor = order_executor  # готові ордери переозброюються на кожному тіку
+    price_cache.tick_handler = supervise_positions  # трейлінг / беззбиток / часткове закриття
+    mark_price_queue = market_hub.subscribe(f"{symbol}@markPrice@1s", "price_cache", 100)
+    book_ticker_queue = market_hub.subscribe(f"{symbol}@bookTicker", "price_cache", 1000)
+
+    # 🕯️ Свічки в памʼяті: 1m і 5m з потоків @kline
+    kline_stores = {}
+    kline_queues = {}
+    indicator_engines = {}
+    for interval in CONFIG["KLINE_INTERVALS"]:
+        kline_stores[(CONFIG["SYMBOL"], interval)] = KlineStore(CONFIG["SYMBOL"], interval, CONFIG["KLINE_CAPACITY"])
+        indicator_engines[(CONFIG["SYMBOL"], interval)] = IndicatorEngine(
+            CONFIG["EMA_PERIOD"], CONFIG["VWAP_WINDOW"], CONFIG["ATR_PERIOD"]
+        )
+        kline_queues[(CONFIG["SYMBOL"], interval)] = market_hub.subscribe(f"{symbol}@kline_{interval}", "kline_store", 1000)
+
+    # 🧭 Джерела контексту сигналу з власними дедлайнами
+    context_gatherer = ContextGatherer(CONFIG["CONTEXT_DEADLINE_SECONDS"])
+    deadlines = CONFIG["CONTEXT_SOURCE_DEADLINES"]
+    context_gatherer.register("news", fetch_news, deadlines["news"], "⚠️ Новини тимчасово недоступні.")
+    context_gatherer.register("candles", lambda: get_candle_summary(CONFIG["SYMBOL"]), deadlines["candles"], "⚠️ Дані свічок недоступні")
+    context_gatherer.register("walls", lambda: get_orderbook_snapshot(CONFIG["SYMBOL"]), deadlines["walls"], "⚠️ Дані про стіни недоступні")
+
+    # 🧠 Контекст GPT — інвалідація подіями журналу
+    gpt_context = GptContext()
+    trade_journal.context = gpt_context
+
     # 📡 Стан orderbook
-    last_bid_wall = 0.0
-    last_ask_wall = 0.0
-    fake_wall_counter = 0
-    last_fake_wall_time = 0.0
-    fake_wall_detected = False
     current_buy_wall = 0.0
     current_sell_wall = 0.0
 
+    # 🕵️ Трекер стін (спуфінг) — рівні з diff-стакану + угоди
+    wall_tracker = WallTracker(
+        CONFIG["WALL_MIN_QTY"],
+        CONFIG["WALL_MAX_DISTANCE_BPS"],
+        CONFIG["SPOOF_DECAY_SECONDS"],
+        CONFIG["SPOOF_SHORT_LIFE_SECONDS"]
+    )
+    wall_trade_queue = market_hub.subscribe(f"{symbol}@aggTrade", "walls", CONFIG["AGGTRADE_QUEUE_SIZE"], CONFIG["INGEST_OVERFLOW_POLICY"])
 
 
-# 📬 Відправка повідомлення у Telegram
-def send_message(text: str):
-    try:
+
+# 📬 Асинхронний Telegram-нотифікатор (черга + пакетування + 429)
+class TelegramNotifier:
+    """
+    Неблокуюча відправка повідомлень у Telegram.
+    send_message лише кладе текст у обмежену чергу, а фоновий воркер збирає пачку,
+    склеює її в одне багаторядкове повідомлення і шле через одну keep-alive сесію.
+    """
+
+    MAX_MESSAGE_LEN = 4000  # ліміт Telegram 4096, лишаємо запас
+
+    def __init__(self, maxsize: int = 500, batch_window: float = 0.5, max_retries: int = 5):
+        self.maxsize = maxsize
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.queue: asyncio.Queue | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.dropped = 0
+        self.sent = 0
+
+    def start(self) -> asyncio.Task:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        return asyncio.create_task(self.run())
+
+    def notify(self, text: str):
+        # До старту циклу (скрипти, імпорт) — синхронна відправка з таймаутом
+        if self.queue is None:
+            self._post_sync(text)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._enqueue(text)
+        else:
+            # Виклик з потоку (asyncio.to_thread) — передаємо в цикл безпечно
+            self.loop.call_soon_threadsafe(self._enqueue, text)
+
+    def _enqueue(self, text: str):
+        # Переповнення: викидаємо найстаріше повідомлення, нове важливіше
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(str(text))
+
+    async def run(self):
+        while True:
+            first = await self.queue.get()
+            batch = [first]
+            size = len(first)
+            deadline = self.loop.time() + self.batch_window
+
+            # 🧺 Збираємо сплеск повідомлень в одну пачку
+            while size < self.MAX_MESSAGE_LEN:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    text = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(text)
+                size += len(text) + 1
+
+            if self.dropped:
+                batch.append(f"⚠️ Пропущено {self.dropped} повідомлень (черга переповнена)")
+                self.dropped = 0
+
+            for chunk in self._split(batch):
+                await self._send(chunk)
+
+    def _split(self, batch: list[str]) -> list[str]:
+        chunks, current = [], ""
+        for text in batch:
+            text = text[:self.MAX_MESSAGE_LEN]
+            if current and len(current) + len(text) + 1 > self.MAX_MESSAGE_LEN:
+                chunks.append(current)
+                current = text
+            else:
+                current = f"{current}\n{text}" if current else text
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _send(self, text: str):
         url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
         data = {"chat_id": CHAT_ID, "text": text}
-        requests.post(url, data=data)
+        for attempt in range(self.max_retries):
+            try:
+                r = await asyncio.to_thread(self.session.post, url, data=data, timeout=10)
+                if r.status_code == 429:
+                    # ⏳ Telegram просить зачекати — поважаємо retry_after
+                    retry_after = r.json().get("parameters", {}).get("retry_after", 1)
+                    await asyncio.sleep(float(retry_after))
+                    continue
+                if r.ok:
+                    self.sent += 1
+                else:
+                    print(f"Telegram error: {r.status_code} {r.text[:200]}")
+                return
+            except Exception as e:
+                print(f"Telegram error: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        print(f"Telegram: повідомлення відкинуто після {self.max_retries} спроб")
+
+    def _post_sync(self, text: str):
+        try:
+            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+            self.session.post(url, data={"chat_id": CHAT_ID, "text": text}, timeout=10)
+        except Exception as e:
+            print(f"Telegram error: {e}")
+
+
+notifier = TelegramNotifier()
+
+# 📬 Відправка повідомлення у Telegram (не блокує event loop)
+def send_message(text: str):
+    try:
+        notifier.notify(text)
     except Exception as e:
         print(f"Telegram error: {e}")
 
-# 📊 Логування угоди в Google Sheets
-def log_to_sheet(type_, entry, tp, sl, qty, result=None, comment=""):
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name("/etc/secrets/credentials.json", scope)
-        gclient = gspread.authorize(creds)
-        sheet = gclient.open_by_key(GOOGLE_SHEET_ID).worksheets()[0]
+# 🗃️ Локальний журнал угод (SQLite WAL) — джерело правди; Google Sheets — дзеркало
+class TradeJournal:
+    """
+    Угоди, результати і записи Learning Log пишуться в SQLite за мікросекунди.
+    Прапорці synced / result_synced позначають, що ще не відправлено в Sheets;
+    replicate_journal() дозаписує це пачками у фоні. Відкриті угоди тримаються
+    в індексі id → рядок таблиці і закриваються за orderId входу з раунд-трипу
+    журналу виконань, тож закриття не залежить від довжини історії.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT, type TEXT, entry REAL, tp REAL, sl REAL, qty REAL,
+        result TEXT DEFAULT '', pnl TEXT DEFAULT '', comment TEXT DEFAULT '',
+        sheet_row INTEGER, synced INTEGER DEFAULT 0, result_synced INTEGER DEFAULT 1,
+        order_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS learning (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT, type TEXT, result TEXT, pnl TEXT, reason TEXT, synced INTEGER DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS trades_pending ON trades (id) WHERE synced = 0;
+    CREATE INDEX IF NOT EXISTS trades_result_pending ON trades (id) WHERE result_synced = 0;
+    CREATE INDEX IF NOT EXISTS learning_pending ON learning (id) WHERE synced = 0;
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(trades)")}
+        if "order_id" not in columns:
+            self.db.execute("ALTER TABLE trades ADD COLUMN order_id INTEGER")  # журнали до orderId
+        self.aggregator = None  # TradeStats — отримує кожен записаний результат
+        self.context = None     # GptContext — інвалідація після результатів і Learning Log
+        self.wakeup = asyncio.Event()
+        self.open_trades: dict = {}                # id → sheet_row (None, поки рядок не дописано)
+        self.open_by_type = defaultdict(list)     # type → id відкритих угод, найновіша в кінці
+        self.open_by_order: dict = {}              # orderId входу → id угоди
+        for trade_id, type_, sheet_row, order_id in self.db.execute(
+            "SELECT id, type, sheet_row, order_id FROM trades WHERE result = '' ORDER BY id"
+        ):
+            self._open(trade_id, type_, sheet_row, order_id)
+
+    def _open(self, trade_id: int, type_: str, sheet_row=None, order_id=None):
+        self.open_trades[trade_id] = sheet_row
+        self.open_by_type[type_].append(trade_id)
+        if order_id is not None:
+            self.open_by_order[order_id] = trade_id
+
+    def _changed(self):
+        self.db.commit()
+        self.wakeup.set()
+
+    def is_empty(self) -> bool:
+        return self.db.execute("SELECT COUNT(*) FROM trades").fetchone()[0] == 0
+
+    # --- Запис ---
+    def log_trade(self, type_, entry, tp, sl, qty, result=None, comment="", order_id=None):
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        cursor = self.db.execute(
+            "INSERT INTO trades (time, type, entry, tp, sl, qty, result, comment, order_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (now, type_, entry, tp, sl, qty, result or "", comment, order_id)
+        )
+        if not result:
+            self._open(cursor.lastrowid, type_, order_id=order_id)
+        self._changed()
+
+    def _find_open(self, type_, order_ids) -> int:
+        """
+        Угода, відкрита одним з order_ids; без order_ids — остання незакрита цього типу.
+        Раунд-трип без рядка в журналі (наприклад, вхід, закритий після відмови TP/SL)
+        не знаходить нічого і не чіпає старші угоди.
+        """
+        if order_ids is not None:
+            return next((self.open_by_order[o] for o in order_ids if o in self.open_by_order), None)
+        open_ids = self.open_by_type.get(type_)
+        return open_ids[-1] if open_ids else None
+
+    def set_result(self, type_, result, pnl=None, order_ids=None) -> bool:
+        trade_id = self._find_open(type_, order_ids)
+        if trade_id is None:
+            return False
+        self.open_trades.pop(trade_id, None)
+        self.open_by_type[type_].remove(trade_id)
+        for order_id in [o for o, t in self.open_by_order.items() if t == trade_id]:
+            del self.open_by_order[order_id]
+        self.db.execute(
+            "UPDATE trades SET result = ?, pnl = ?, result_synced = 0 WHERE id = ?",
+            (result, f"{pnl} USDT" if pnl is not None else "", trade_id)
+        )
+        self._changed()
+        if self.aggregator is not None:
+            self.aggregator.add(type_, result, pnl)
+        if self.context is not None:
+            self.context.invalidate("trades", "stats")
+        return True
+
+    def log_learning(self, trade_type, result, reason, pnl=None):
         now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        row = [now, type_, entry, tp, sl, qty, result or "", comment]
+        self.db.execute(
+            "INSERT INTO learning (time, type, result, pnl, reason) VALUES (?, ?, ?, ?, ?)",
+            (now, trade_type, result, str(pnl or ""), reason)
+        )
+        self._changed()
+        if self.context is not None:
+            self.context.invalidate("mistakes")
+
+    # --- Читання ---
+    def recent_mistakes(self, limit: int) -> list:
+        return [r[0] for r in self.db.execute(
+            "SELECT reason FROM learning WHERE UPPER(result) = 'LOSS' AND TRIM(reason) != '' ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )]
+
+    def closed_results(self) -> list:
+        return self.db.execute("SELECT type, result, pnl FROM trades WHERE result != '' ORDER BY id").fetchall()
+
+    # --- Для реплікатора ---
+    @staticmethod
+    def sheet_row(trade: tuple) -> list:
+        _, time_, type_, entry, tp, sl, qty, result, pnl, comment = trade
+        return [time_, type_, entry, tp, sl, qty, result, pnl or comment]
+
+    def pending_trades(self) -> list:
+        return self.db.execute(
+            "SELECT id, time, type, entry, tp, sl, qty, result, pnl, comment FROM trades WHERE synced = 0 ORDER BY id"
+        ).fetchall()
+
+    def pending_results(self) -> list:
+        return self.db.execute(
+            "SELECT id, sheet_row, result, pnl FROM trades WHERE synced = 1 AND result_synced = 0 AND sheet_row IS NOT NULL"
+        ).fetchall()
+
+    def pending_learning(self) -> list:
+        return self.db.execute(
+            "SELECT id, time, type, result, pnl, reason FROM learning WHERE synced = 0 ORDER BY id"
+        ).fetchall()
+
+    def mark_trades_synced(self, synced: list):
+        """
+        synced: (id, sheet_row, result на момент відправки). Результат, що змінився
+        під час відправки, лишається несинхронізованим.
+        """
+        self.db.executemany(
+            "UPDATE trades SET synced = 1, sheet_row = ?, result_synced = CASE WHEN result = ? THEN 1 ELSE 0 END WHERE id = ?",
+            [(sheet_row, result, trade_id) for trade_id, sheet_row, result in synced]
+        )
+        self.db.commit()
+        for trade_id, sheet_row, _ in synced:
+            if trade_id in self.open_trades:
+                self.open_trades[trade_id] = sheet_row
+
+    def mark_results_synced(self, synced: list):
+        self.db.executemany(
+            "UPDATE trades SET result_synced = 1 WHERE id = ? AND result = ?",
+            synced
+        )
+        self.db.commit()
+
+    def mark_learning_synced(self, ids: list):
+        self.db.executemany("UPDATE learning SET synced = 1 WHERE id = ?", [(i,) for i in ids])
+        self.db.commit()
+
+    def import_rows(self, trade_rows: list, learning_rows: list):
+        """
+        Разове наповнення порожнього журналу з наявних аркушів (рядки вже є в Sheets).
+        """
+        for index, row in enumerate(trade_rows):
+            if len(row) < 2 or index == 0:
+                continue  # заголовок
+            row = row + [""] * (8 - len(row))
+            pnl = row[7] if row[7].endswith("USDT") else ""
+            if row[6] and self.aggregator is not None:
+                self.aggregator.add(row[1], row[6], pnl)
+            cursor = self.db.execute(
+                "INSERT INTO trades (time, type, entry, tp, sl, qty, result, pnl, comment, sheet_row, synced) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                (row[0], row[1], row[2], row[3], row[4], row[5], row[6], pnl, "" if pnl else row[7], index + 1)
+            )
+            if not row[6]:
+                self._open(cursor.lastrowid, row[1], index + 1)
+        for row in learning_rows[1:]:
+            row = row + [""] * (5 - len(row))
+            self.db.execute(
+                "INSERT INTO learning (time, type, result, pnl, reason, synced) VALUES (?, ?, ?, ?, ?, 1)",
+                tuple(row[:5])
+            )
+        self.db.commit()
+        if self.context is not None:
+            self.context.invalidate("trades", "stats", "mistakes")
 
-        # Додаємо retry логіку
-        retries = 3
-        for attempt in range(retries):
-            try:
-                sheet.append_row(row, value_input_option='RAW')
-                break  # Якщо успішно, виходимо
-            except Exception as e:
-                if attempt < retries - 1:
-                    time.sleep(2)  # Затримка перед наступною спробою
-                else:
-                    raise e  # Якщо остання спроба - кидаємо помилку
+    def stats(self) -> dict:
+        return {
+            "trades": self.db.execute("SELECT COUNT(*) FROM trades").fetchone()[0],
+            "open_trades": len(self.open_trades),
+            "pending_trades": self.db.execute("SELECT COUNT(*) FROM trades WHERE synced = 0").fetchone()[0],
+            "pending_results": self.db.execute("SELECT COUNT(*) FROM trades WHERE result_synced = 0").fetchone()[0],
+            "pending_learning": self.db.execute("SELECT COUNT(*) FROM learning WHERE synced = 0").fetchone()[0],
+        }
+
+
+# 📊 Статистика угод у памʼяті: O(1) на кожну закриту угоду, без читання таблиць
+def parse_pnl(pnl) -> float:
+    try:
+        return float(str(pnl).split()[0])
+    except (ValueError, IndexError):
+        return 0.0
 
-    except Exception as e:
-        send_message(f"❌ Sheets error: {e}")
 
+class TradeStats:
+    """
+    Лічильники по типах сигналу (WIN/LOSS, серії, PnL, ковзне вікно) і загальна
+    стрічка останніх результатів. version зростає з кожною зміною — реплікатор
+    переписує вкладку Stats лише коли version відрізняється від записаної.
+    """
 
-# 📈 Оновлення результату угоди у Google Sheets
-def update_result_in_sheet(type_, result, pnl=None):
+    def __init__(self, window: int, recent_capacity: int):
+        self.window = window
+        self.types: dict = {}
+        self.recent = deque(maxlen=recent_capacity)  # (type, result), найновіші праворуч
+        self.win_streak = 0
+        self.version = 0
+
+    def _type(self, type_: str) -> dict:
+        if type_ not in self.types:
+            self.types[type_] = {
+                "WIN": 0, "LOSS": 0, "streak": 0, "max_streak": 0, "pnl": 0.0,
+                "window": deque(maxlen=self.window), "window_wins": 0,
+            }
+        return self.types[type_]
+
+    def add(self, type_: str, result: str, pnl=None):
+        result = result.strip().upper()
+        if result not in ("WIN", "LOSS"):
+            return
+        t = self._type(type_)
+        t[result] += 1
+        t["pnl"] += parse_pnl(pnl)
+        if result == "WIN":
+            t["streak"] += 1
+            t["max_streak"] = max(t["max_streak"], t["streak"])
+        else:
+            t["streak"] = 0
+
+        window = t["window"]
+        if len(window) == window.maxlen and window[0] == "WIN":
+            t["window_wins"] -= 1
+        window.append(result)
+        if result == "WIN":
+            t["window_wins"] += 1
+
+        self.recent.append((type_, result))
+        self.win_streak = self.win_streak + 1 if result == "WIN" else 0
+        self.version += 1
+
+    def rebuild(self, results: list):
+        """
+        results: (type, result, pnl) у хронологічному порядку (журнал при старті).
+        """
+        self.types.clear()
+        self.recent.clear()
+        self.win_streak = 0
+        for type_, result, pnl in results:
+            self.add(type_, result, pnl)
+
+    def winrate(self, type_: str) -> float:
+        t = self.types.get(type_)
+        total = t["WIN"] + t["LOSS"] if t else 0
+        return round(t["WIN"] / total * 100, 2) if total else 0.0
+
+    def window_rate(self, type_: str) -> float:
+        t = self.types.get(type_)
+        return round(t["window_wins"] / len(t["window"]) * 100, 2) if t and t["window"] else 0.0
+
+    def recent_results(self, limit: int) -> list:
+        """
+        Найновіші першими.
+        """
+        return list(reversed(self.recent))[:limit]
+
+    def rows(self) -> list:
+        stat_rows = [["Type", "WIN", "LOSS", "Total", "Winrate %", "Max Streak",
+                      "Current Streak", "PnL USDT", f"Winrate {self.window} %"]]
+        for k, t in self.types.items():
+            stat_rows.append([
+                k, t["WIN"], t["LOSS"], t["WIN"] + t["LOSS"], self.winrate(k), t["max_streak"],
+                t["streak"], round(t["pnl"], 2), self.window_rate(k),
+            ])
+        return stat_rows
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "win_streak": self.win_streak,
+            "types": {k: {"winrate": self.winrate(k), "window_rate": self.window_rate(k),
+                          "pnl": round(t["pnl"], 2)} for k, t in self.types.items()},
+        }
+
+
+# 🔁 Фонова реплікація журналу в Google Sheets (append_rows / batch_update пачками)
+def get_or_create_worksheet(title: str, header: list, rows: str = "1000", cols: str = "10"):
+    """
+    Аркуш кешується разом із клієнтом (скидається в reset_spreadsheet).
+    """
+    key = f"worksheet:{title}"
+    if key not in gspread_cache:
+        sh = get_spreadsheet()
+        try:
+            gspread_cache[key] = sh.worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = sh.add_worksheet(title=title, rows=rows, cols=cols)
+            if header:
+                sheet.append_row(header)
+            gspread_cache[key] = sheet
+    return gspread_cache[key]
+
+
+def get_trades_worksheet():
+    """
+    Перший аркуш (угоди) — теж із кешу, без запиту метаданих на кожну реплікацію.
+    """
+    if "worksheet:0" not in gspread_cache:
+        gspread_cache["worksheet:0"] = get_spreadsheet().get_worksheet(0)
+    return gspread_cache["worksheet:0"]
+
+
+def push_trade_rows(trades: list) -> list:
+    """
+    Блокуючі виклики Sheets (через asyncio.to_thread). Повертає номери доданих рядків.
+    """
+    sheet = get_trades_worksheet()
+    response = sheet.append_rows([TradeJournal.sheet_row(t) for t in trades], value_input_option="RAW")
+    first_row = int(re.search(r"![A-Z]+(\d+)", response["updates"]["updatedRange"]).group(1))
+    return [first_row + i for i in range(len(trades))]
+
+
+def push_result_cells(results: list):
+    # Без PnL пишемо лише G, щоб не затерти коментар у H
+    get_trades_worksheet().batch_update([
+        {"range": f"G{sheet_row}:H{sheet_row}", "values": [[result, pnl]]} if pnl else
+        {"range": f"G{sheet_row}", "values": [[result]]}
+        for _, sheet_row, result, pnl in results
+    ])
+
+
+def push_learning_rows(learning: list):
+    sheet = get_or_create_worksheet("Learning Log", ["Time", "Type", "Result", "PnL", "GPT Analysis"])
+    sheet.append_rows([list(row[1:]) for row in learning])
+
+
+def push_stats_rows(stats_rows: list):
+    """
+    Одна операція запису: таблиця доповнюється порожніми рядками до розміру аркуша,
+    тож старі рядки затираються без clear() і вкладка не буває порожньою.
+    """
+    stat_sheet = get_or_create_worksheet("Stats", None, rows="20", cols="10")
+    width = len(stats_rows[0])
+    if stat_sheet.col_count < width or stat_sheet.row_count < len(stats_rows):
+        stat_sheet.resize(rows=max(stat_sheet.row_count, len(stats_rows)), cols=max(stat_sheet.col_count, width))
+    padded = stats_rows + [[""] * width for _ in range(stat_sheet.row_count - len(stats_rows))]
+    stat_sheet.update(f"A1:{chr(ord('A') + width - 1)}{len(padded)}", padded)
+
+
+async def replicate_journal():
+    outage_since = None
+    stats_version = -1  # версія TradeStats, уже записана у вкладку Stats
+    while True:
+        try:
+            await asyncio.wait_for(trade_journal.wakeup.wait(), CONFIG["JOURNAL_FLUSH_SECONDS"])
+        except asyncio.TimeoutError:
+            pass
+        trade_journal.wakeup.clear()
+        await asyncio.sleep(CONFIG["JOURNAL_BATCH_DELAY_SECONDS"])  # збираємо пачку
+
+        trades = trade_journal.pending_trades()
+        results = trade_journal.pending_results()
+        learning = trade_journal.pending_learning()
+        version = trade_stats.version
+        if not (trades or results or learning or version != stats_version):
+            continue
+
+        try:
+            # Кожен крок позначається одразу, щоб після збою не дублювати вже записане
+            if trades:
+                trade_rows = await asyncio.to_thread(push_trade_rows, trades)
+                trade_journal.mark_trades_synced([(t[0], row, t[7]) for t, row in zip(trades, trade_rows)])
+            if results:
+                await asyncio.to_thread(push_result_cells, results)
+                trade_journal.mark_results_synced([(r[0], r[2]) for r in results])
+            if learning:
+                await asyncio.to_thread(push_learning_rows, learning)
+                trade_journal.mark_learning_synced([row[0] for row in learning])
+            if version != stats_version:
+                await asyncio.to_thread(push_stats_rows, trade_stats.rows())
+                stats_version = version
+            if outage_since is not None:
+                send_message(f"✅ Google Sheets знову доступний, журнал синхронізовано ({round(time.time() - outage_since)} сек)")
+                outage_since = None
+        except Exception as e:
+            reset_spreadsheet()
+            if outage_since is None:
+                outage_since = time.time()
+                send_message(f"⚠️ Google Sheets недоступний, записи чекають у журналі: {e}")
+            await asyncio.sleep(CONFIG["JOURNAL_RETRY_SECONDS"])
+
+
+async def seed_journal_from_sheets():
+    """
+    Порожній журнал (перший запуск) наповнюється історією з таблиці.
+    """
+    if not trade_journal.is_empty():
+        return
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name("/etc/secrets/credentials.json", scope)
-        gclient = gspread.authorize(creds)
-        sheet = gclient.open_by_key(GOOGLE_SHEET_ID).worksheets()[0]
-        data = sheet.get_all_values()
-        for i in reversed(range(len(data))):
-            if len(data[i]) >= 7 and data[i][1] == type_ and data[i][6] == "":
-                sheet.update_cell(i + 1, 7, result)
-                if pnl is not None:
-                    sheet.update_cell(i + 1, 8, f"{pnl} USDT")
-                break
+        def read_sheets():
+            sh = get_spreadsheet()
+            trade_rows = get_trades_worksheet().get_all_values()
+            try:
+                learning_rows = sh.worksheet("Learning Log").get_all_values()
+            except gspread.exceptions.WorksheetNotFound:
+                learning_rows = []
+            return trade_rows, learning_rows
+
+        trade_rows, learning_rows = await asyncio.to_thread(read_sheets)
+        trade_journal.import_rows(trade_rows, learning_rows)
     except Exception as e:
-        send_message(f"❌ Update result error: {e}")
+        send_message(f"⚠️ Не вдалося імпортувати історію з Sheets у журнал: {e}")
 
-# 📊 Оновлення вкладки "Stats" у Google Sheets
-def update_stats_sheet():
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name("/etc/secrets/credentials.json", scope)
-        gclient = gspread.authorize(creds)
-        sh = gclient.open_by_key(GOOGLE_SHEET_ID)
-        data = sh.worksheets()[0].get_all_values()
-        rows = data[1:]
-
-        stats = {}
-        streaks = {}
-
-        for row in rows:
-            if len(row) < 7:
-                continue
-            gpt_type = row[1]
-            result = row[6].strip().upper()
-            if gpt_type not in stats:
-                stats[gpt_type] = {"WIN": 0, "LOSS": 0}
-                streaks[gpt_type] = {"current": 0, "max": 0}
 
-            if result == "WIN":
-                stats[gpt_type]["WIN"] += 1
-                streaks[gpt_type]["current"] += 1
-                if streaks[gpt_type]["current"] > streaks[gpt_type]["max"]:
-                    streaks[gpt_type]["max"] = streaks[gpt_type]["current"]
-            elif result == "LOSS":
-                stats[gpt_type]["LOSS"] += 1
-                streaks[gpt_type]["current"] = 0
-
-        stat_rows = [["Type", "WIN", "LOSS", "Total", "Winrate %", "Max Streak"]]
-        for k, v in stats.items():
-            total = v["WIN"] + v["LOSS"]
-            winrate = round(v["WIN"] / total * 100, 2) if total > 0 else 0
-            max_streak = streaks[k]["max"]
-            stat_rows.append([k, v["WIN"], v["LOSS"], total, winrate, max_streak])
+# 📊 Логування угоди (журнал → Google Sheets у фоні)
+def log_to_sheet(type_, entry, tp, sl, qty, result=None, comment="", order_id=None):
+    try:
+        trade_journal.log_trade(type_, entry, tp, sl, qty, result, comment, order_id)
+    except Exception as e:
+        send_message(f"❌ Journal error: {e}")
 
-        try:
-            stat_sheet = sh.worksheet("Stats")
-            stat_sheet.clear()
-        except:
-            stat_sheet = sh.add_worksheet(title="Stats", rows="20", cols="6")
 
-        stat_sheet.update("A1", stat_rows)
+# 📈 Оновлення результату угоди
+def update_result_in_sheet(type_, result, pnl=None, order_ids=None):
+    try:
+        if not trade_journal.set_result(type_, result, pnl, order_ids):
+            send_message(f"⚠️ {type_} {result}: угоду в журналі не знайдено (ордери {order_ids})")
     except Exception as e:
-        send_message(f"❌ Stats error: {e}")
+        send_message(f"❌ Update result error: {e}")
+
+# 📊 Оновлення вкладки "Stats" — реплікатор запише її, лише якщо статистика змінилась
+def update_stats_sheet():
+    trade_journal.wakeup.set()
 
 # 📜 Отримання останніх угод
 def get_last_trades(limit=10):
     try:
-        gclient = get_gspread_client()
-        sheet = gclient.open_by_key(GOOGLE_SHEET_ID).worksheets()[0]
-        data = sheet.get_all_values()[1:]
-        data.reverse()
-        gpt_logs = [row for row in data if len(row) >= 7 and row[1] in ["LONG", "SHORT", "BOOSTED_LONG", "BOOSTED_SHORT"] and row[6]]
-        recent = gpt_logs[:limit]
-        return "\n".join(f"{i+1}. {row[1]} → {row[6]}" for i, row in enumerate(recent))
+        recent = trade_stats.recent_results(limit)
+        return "\n".join(f"{i+1}. {type_} → {result}" for i, (type_, result) in enumerate(recent))
     except Exception as e:
         send_message(f"❌ Last trades error: {e}")
         return ""
@@ -238,10 +1102,7 @@ def get_last_trades(limit=10):
 # 📈 Отримання статистики по winrate
 def get_stats_summary():
     try:
-        gclient = get_gspread_client()
-        sheet = gclient.open_by_key(GOOGLE_SHEET_ID).worksheet("Stats")
-        data = sheet.get_all_values()[1:]
-        lines = [f"{row[0]}: {row[4]}%" for row in data if len(row) >= 5]
+        lines = [f"{type_}: {trade_stats.winrate(type_)}%" for type_ in trade_stats.types]
         return "\n".join(lines)
     except Exception as e:
         send_message(f"❌ Stats summary error: {e}")
@@ -250,53 +1111,82 @@ def get_stats_summary():
 # 🧠 Отримання останніх помилок GPT
 def get_recent_mistakes(limit=5):
     try:
-        gclient = get_gspread_client()
-        sh = gclient.open_by_key(GOOGLE_SHEET_ID)
-        try:
-            sheet = sh.worksheet("Learning Log")
-        except:
-            sheet = sh.add_worksheet(title="Learning Log", rows="1000", cols="10")
-            sheet.append_row(["Time", "Type", "Result", "PnL", "GPT Analysis"])
-            return "❕ Помилки ще не зафіксовані."
-
-        data = sheet.get_all_values()[1:]
-        mistakes = [row for row in reversed(data) if len(row) >= 5 and row[2].strip().upper() == "LOSS" and row[4].strip()]
-        return "\n".join(f"- {row[4]}" for row in mistakes[:limit]) or "❕ Немає нещодавніх помилок."
+        mistakes = trade_journal.recent_mistakes(limit)
+        return "\n".join(f"- {reason}" for reason in mistakes) or "❕ Немає нещодавніх помилок."
     except Exception as e:
         send_message(f"❌ Mistakes fallback error: {e}")
         return "❕ GPT тимчасово без памʼяті."
-        # 📊 Отримання Winrate по кожному типу з вкладки Stats
+        # 📊 Отримання Winrate по кожному типу
 def get_global_stats() -> dict:
     """
-    Зчитує Winrate по кожному типу з Google Sheets → вкладка 'Stats'
+    Winrate по кожному типу з TradeStats (ті самі дані, що й у вкладці 'Stats')
     Повертає словник {"LONG": 68.0, "SHORT": 43.5, ...}
     """
     try:
-        sh = get_gspread_client().open_by_key(GOOGLE_SHEET_ID)
-        sheet = sh.worksheet("Stats")
-        rows = sheet.get_all_values()[1:]  # пропускаємо заголовок
-
-        result: dict = {}
-        for row in rows:
-            type_: str = row[0].strip().upper()
-            winrate: float = float(row[4]) if row[4] else 0.0
-            result[type_] = winrate
-        return result
+        return {type_.strip().upper(): trade_stats.winrate(type_) for type_ in trade_stats.types}
     except Exception as e:
         send_message(f"❌ Не вдалося зчитати Stats: {e}")
         return {}
 
+# 🧠 Контекст для GPT у памʼяті: секції з журналу перебудовуються лише за подіями
+class GptContext:
+    """
+    trades / stats — після результату угоди; mistakes — після запису в Learning Log.
+    Тренд читається наживо з IndicatorEngine (з поточною свічкою, як і фільтр у handle_signal).
+    """
+
+    SECTIONS = ("trades", "stats", "mistakes")
+
+    def __init__(self):
+        self.values: dict = {}
+        self.dirty = set(self.SECTIONS)
+        self.version = 0
+        self.builds = 0
+
+    def invalidate(self, *sections):
+        for section in sections or self.SECTIONS:
+            self.values.update(self._build(section))
+            self.dirty.discard(section)
+        self.version += 1
+
+    def _build(self, section: str) -> dict:
+        self.builds += 1
+        if section == "trades":
+            recent_trades, win_streak = get_recent_trades_and_streak()
+            return {"recent_trades": recent_trades, "win_streak": win_streak}
+        if section == "stats":
+            global_stats = get_global_stats()
+            return {
+                "stats_summary": get_stats_summary(),
+                "long_wr": global_stats.get("LONG", 0.0),
+                "short_wr": global_stats.get("SHORT", 0.0),
+            }
+        return {"mistakes": get_recent_mistakes()}
+
+    def snapshot(self) -> dict:
+        if self.dirty:
+            self.invalidate(*self.dirty)
+        return {**self.values, "trend": get_ema_trend(CONFIG["SYMBOL"]), "version": self.version}
+
+    def stats(self) -> dict:
+        return {"version": self.version, "builds": self.builds, "dirty": sorted(self.dirty)}
+
+
 # 🧠 Запит до GPT на базі повного контексту
 async def ask_gpt_trade_with_all_context(type_, news, oi, delta, volume):
     try:
-        trend = get_ema_trend(CONFIG["SYMBOL"])
-        recent_trades, win_streak = get_recent_trades_and_streak()
-        stats_summary = get_stats_summary()
-        mistakes = get_recent_mistakes()
-        # 📊 Winrate по типах з таблиці Stats
-        global_stats = get_global_stats()
-        long_wr = global_stats.get("LONG", 0.0)
-        short_wr = global_stats.get("SHORT", 0.0)
+        # 🧊 Стіни і дельта в промпті мають бути свіжими
+        if refuse_stale_inputs("walls", "delta"):
+            return "SKIP"
+
+        # 🧠 Тренд (наживо), історія угод, winrate і помилки — знімок без I/O
+        context = gpt_context.snapshot()
+        trend = context["trend"]
+        recent_trades, win_streak = context["recent_trades"], context["win_streak"]
+        stats_summary = context["stats_summary"]
+        mistakes = context["mistakes"]
+        long_wr = context["long_wr"]
+        short_wr = context["short_wr"]
 
         # 🧱 Дані по стінах ордербука
         buy_wall = round(current_buy_wall, 1) if current_buy_wall else "немає"
@@ -388,68 +1278,41 @@ SHORT: {short_wr}%
 # 🧠 Підрахунок останніх угод і серії перемог
 def get_recent_trades_and_streak(limit=10):
     try:
-        gclient = get_gspread_client()
-        sheet = gclient.open_by_key(GOOGLE_SHEET_ID).worksheets()[0]
-        data = sheet.get_all_values()[1:]
-        data.reverse()
-        trades = [row for row in data if len(row) >= 7 and row[1] in ["LONG", "SHORT", "BOOSTED_LONG", "BOOSTED_SHORT"] and row[6]]
-        recent = trades[:limit]
-        formatted = [f"{i+1}. {row[1]} → {row[6]}" for i, row in enumerate(recent)]
-        streak = 0
-        for row in trades:
-            if row[6].strip().upper() == "WIN":
-                streak += 1
-            else:
-                break
-        return "\n".join(formatted), streak
+        recent = trade_stats.recent_results(limit)
+        formatted = [f"{i+1}. {type_} → {result}" for i, (type_, result) in enumerate(recent)]
+        return "\n".join(formatted), trade_stats.win_streak
     except Exception as e:
         send_message(f"❌ Streak error: {e}")
         return "", 0
 # 📈 Отримання Open Interest
-def get_open_interest(symbol="BTCUSDT"):
+async def get_open_interest(symbol="BTCUSDT"):
     try:
-        r = requests.get("https://fapi.binance.com/fapi/v1/openInterest", params={"symbol": symbol})
-        return float(r.json()["openInterest"]) if r.ok else None
+        data = await binance_client.futures_open_interest(symbol=symbol)
+        return float(data["openInterest"])
     except Exception as e:
         send_message(f"❌ OI error: {e}")
         return None
-# 📰 Отримання останніх новин з CryptoPanic
+# 📰 Отримання останніх новин з CryptoPanic (помилка — виняток: ContextGatherer підставить кеш)
 def get_latest_news():
-    try:
-        url = f"https://cryptopanic.com/api/v1/posts/?auth_token={NEWS_API_KEY}&filter=important"
-        r = requests.get(url)
-        news = r.json()
-        return "\n".join([item["title"] for item in news.get("results", [])[:3]])
-    except Exception as e:
-        send_message(f"❌ News error: {e}")
-        return "⚠️ Новини не вдалося завантажити."
+    url = f"https://cryptopanic.com/api/v1/posts/?auth_token={NEWS_API_KEY}&filter=important"
+    r = requests.get(url, timeout=CONFIG["NEWS_TIMEOUT_SECONDS"])
+    r.raise_for_status()
+    news = r.json()
+    return "\n".join([item["title"] for item in news.get("results", [])[:3]])
 
 # 📊 Отримання обʼєму торгів за хвилину
 def get_volume(symbol="BTCUSDT"):
     try:
-        data = binance_client.futures_klines(symbol=symbol, interval="1m", limit=1)
-        return float(data[-1][7])
+        candles = get_kline_store(symbol, "1m").last(1)
+        return float(candles["quote_volume"][-1])
     except Exception as e:
         send_message(f"❌ Volume error: {e}")
         return None
 
-# 📏 Розрахунок VWAP з обробкою помилок
-def calculate_vwap(symbol="BTCUSDT", interval="1m", limit=20):
+# 📏 VWAP з інкрементального рушія індикаторів
+def calculate_vwap(symbol="BTCUSDT", interval="1m"):
     try:
-        candles = binance_client.futures_klines(symbol=symbol, interval=interval, limit=limit)
-        total_volume = 0
-        total_price_volume = 0
-
-        for candle in candles:
-            high = float(candle[2])
-            low = float(candle[3])
-            close = float(candle[4])
-            volume = float(candle[5])
-            typical_price = (high + low + close) / 3
-            total_volume += volume
-            total_price_volume += typical_price * volume
-
-        return total_price_volume / total_volume if total_volume > 0 else None
+        return get_indicators(symbol, interval).vwap
 
     except Exception as e:
         send_message(f"❌ VWAP error: {e}")
@@ -459,7 +1322,7 @@ def calculate_vwap(symbol="BTCUSDT", interval="1m", limit=20):
 # 💤 Визначення флет-зони (чи рух занадто слабкий)
 def is_flat_zone(symbol="BTCUSDT"):
     try:
-        price = float(binance_client.futures_mark_price(symbol=symbol)["markPrice"])
+        price = price_cache.last_price()
         vwap = calculate_vwap(symbol)
         if not vwap:
             return False
@@ -480,7 +1343,7 @@ async def monitor_market_cache():
         try:
             new_vwap = calculate_vwap("BTCUSDT")
             new_volume = get_volume("BTCUSDT")
-            new_oi = get_open_interest("BTCUSDT")
+            new_oi = await get_open_interest("BTCUSDT")
 
             # Перевірка на None
             if new_vwap is not None and new_volume is not None and new_oi is not None:
@@ -495,59 +1358,27 @@ async def monitor_market_cache():
 
         await asyncio.sleep(10)
 
-        # 🕯️ Отримання короткого опису останніх 5 свічок
+        # 🕯️ Отримання короткого опису останніх 5 свічок (помилка — виняток для ContextGatherer)
 def get_candle_summary(symbol="BTCUSDT", interval="1m", limit=5):
-    try:
-        candles = binance_client.futures_klines(symbol=symbol, interval=interval, limit=limit)
-        summary = []
-        for c in candles:
-            open_, high, low, close = map(float, [c[1], c[2], c[3], c[4]])
-            direction = "🟢" if close > open_ else "🔴"
-            body = abs(close - open_)
-            wick = (high - low) - body
-            if wick > body * 1.5:
-                shape = "🐍 хвіст"
-            elif body > wick * 2:
-                shape = "🚀 імпульс"
-            else:
-                shape = "💤 звичайна"
-            summary.append(f"{direction} {shape} (від {round(open_, 1)} до {round(close, 1)})")
-        return "\n".join(summary)
-    except Exception as e:
-        send_message(f"❌ Candle summary error: {e}")
-        return "⚠️ Дані свічок недоступні"
+    candles = get_kline_store(symbol, interval).last(limit)
+    directions, shapes = candle_shapes(candles)
+    summary = []
+    for direction, shape, open_, close in zip(directions, shapes, candles["open"], candles["close"]):
+        summary.append(f"{direction} {shape} (від {round(open_, 1)} до {round(close, 1)})")
+    return "\n".join(summary)
 
 # 🧠 Аналіз останніх 5 свічок + кластерів + VWAP → GPT рішення
 async def analyze_candle_gpt(vwap, cluster_buy, cluster_sell):
     try:
         # 🕯️ Завантаження останніх 5 свічок
-        candles_raw = binance_client.futures_klines(symbol="BTCUSDT", interval="1m", limit=5)
-        candles = []
-        for c in candles_raw:
-            candles.append({
-                "open": c[1],
-                "high": c[2],
-                "low": c[3],
-                "close": c[4],
-                "volume": c[5]
-            })
+        candles = get_kline_store("BTCUSDT", "1m").last(5)
+        directions, shapes = candle_shapes(candles)
+        atr = get_indicators("BTCUSDT", "1m").atr
 
         summaries = []
-        for candle in candles:
-            open_, high, low, close, volume = map(float, [
-                candle["open"], candle["high"], candle["low"], candle["close"], candle["volume"]
-            ])
-            body = abs(close - open_)
-            wick = (high - low) - body
-            direction = "🟢" if close > open_ else "🔴"
-
-            if wick > body * 1.5:
-                shape = "🐍 хвіст"
-            elif body > wick * 2:
-                shape = "🚀 імпульс"
-            else:
-                shape = "💤 звичайна"
-
+        for direction, shape, open_, close, volume in zip(
+            directions, shapes, candles["open"], candles["close"], candles["volume"]
+        ):
             summaries.append(f"{direction} {shape} ({round(open_, 1)} → {round(close, 1)}) обʼєм ${round(volume):,}")
 
         candles_text = "\n".join(summaries)
@@ -560,6 +1391,7 @@ async def analyze_candle_gpt(vwap, cluster_buy, cluster_sell):
 - Buy: ${round(cluster_buy):,}
 - Sell: ${round(cluster_sell):,}
 VWAP: {round(vwap, 2) if vwap else "невідомо"}
+ATR(14, 1м): {round(atr, 1)}
 
 Оціни загальну ситуацію:
 - Чи є імпульс або хвиля?
@@ -570,412 +1402,3066 @@ SKIP — нічого не робити
 NORMAL — можливий вхід, але не дуже сильний  
 BOOSTED — потужний імпульс, сильний рух
 
-Відповідь строго у форматі: SKIP / NORMAL / BOOSTED — і коротке пояснення.
-"""
+Відповідь строго у форматі: SKIP / NORMAL / BOOSTED — і коротке пояснення.
+"""
+
+        response = await asyncio.to_thread(
+            lambda: client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": (
+                        "Ти професійний скальпер. "
+                        "Вибери тільки одне: SKIP / NORMAL / BOOSTED. Додай дуже коротке пояснення."
+                    )},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3
+            )
+        )
+
+        reply = response.choices[0].message.content.strip()
+        decision = reply.split()[0].upper()
+
+        if decision not in ["SKIP", "NORMAL", "BOOSTED"]:
+            decision = "SKIP"
+            reply = f"SKIP — невідома відповідь від GPT: {reply}"
+
+        return {
+            "decision": decision,
+            "reason": reply
+        }
+
+    except Exception as e:
+        return {
+            "decision": "SKIP",
+            "reason": f"GPT error: {e}"
+        }
+
+# 🧭 Визначення тренду за EMA (5m, 20 періодів) — значення вже пораховане рушієм індикаторів
+def get_ema_trend(symbol: str = "BTCUSDT") -> str:
+    try:
+        return get_indicators(symbol, "5m").trend()
+    except Exception as e:
+        send_message(f"❌ EMA trend error: {e}")
+        return "NONE"
+
+
+
+# 📐 Фільтри символу з exchangeInfo (завантажуються один раз)
+symbol_filters_cache: dict = {}
+
+async def get_symbol_filters(symbol: str = "BTCUSDT") -> dict:
+    """
+    Повертає tickSize / stepSize / minQty / minNotional символу. Кешується на весь час роботи.
+    """
+    if symbol in symbol_filters_cache:
+        return symbol_filters_cache[symbol]
+    info = await binance_client.futures_exchange_info()
+    for s in info["symbols"]:
+        if s["symbol"] != symbol:
+            continue
+        filters = {f["filterType"]: f for f in s["filters"]}
+        symbol_filters_cache[symbol] = {
+            "tick_size": float(filters["PRICE_FILTER"]["tickSize"]),
+            "step_size": float(filters["LOT_SIZE"]["stepSize"]),
+            "min_qty": float(filters["LOT_SIZE"]["minQty"]),
+            "min_notional": float(filters.get("MIN_NOTIONAL", {}).get("notional", 0)),
+            "price_precision": s["pricePrecision"],
+            "quantity_precision": s["quantityPrecision"],
+        }
+        return symbol_filters_cache[symbol]
+    raise ValueError(f"Символ {symbol} не знайдено в exchangeInfo")
+
+
+# 🕵️ Угоди для трекера стін: відрізняємо виконану стіну від знятої
+async def monitor_wall_trades():
+    while True:
+        trade = await wall_trade_queue.get()
+        try:
+            wall_tracker.on_trade(trade.price, trade.qty, trade.is_sell)
+        except Exception as e:
+            send_message(f"⚠️ Wall tracker error: {e}")
+
+
+# 🧱 Стіни покупців і продавців з локального стакану (без REST; недоступний стакан — виняток)
+def get_orderbook_snapshot(symbol="BTCUSDT", bps=None):
+    if local_book is None or not local_book.is_live() or get_stale_states("book"):
+        raise RuntimeError("локальний стакан не синхронізований")
+    bps = bps or CONFIG["WALL_SEARCH_BPS"]
+
+    bid_wall = local_book.nearest_wall("bid", bps)
+    ask_wall = local_book.nearest_wall("ask", bps)
+
+    text = ""
+    if ask_wall:
+        text += f"🟥 Sell wall: {ask_wall[0]} ({round(ask_wall[1], 1)} BTC)\n"
+    if bid_wall:
+        text += f"🟦 Buy wall: {bid_wall[0]} ({round(bid_wall[1], 1)} BTC)\n"
+
+    return text.strip() or "⚠️ Стін не знайдено"
+# 🧭 Паралельний збір контексту сигналу з дедлайнами на кожне джерело
+class ContextGatherer:
+    """
+    Усі джерела запускаються одночасно. Джерело, що не встигло до свого дедлайну
+    (або загального дедлайну рішення), підміняється останнім успішним значенням
+    з позначкою застарілості; сам запит не скасовується і оновить кеш, коли завершиться.
+    Поки запит джерела ще в дорозі, новий не запускається.
+    Джерело повідомляє про збій винятком (або None) — такі відповіді в кеш не потрапляють.
+    """
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.sources: dict = {}   # name → (fetch, deadline, fallback)
+        self.cache: dict = {}     # name → (value, ts)
+        self.inflight: dict = {}  # name → asyncio.Task
+        self.late_counts = defaultdict(int)
+        self.last_report = None
+
+    def register(self, name: str, fetch, deadline: float, fallback: str):
+        self.sources[name] = (fetch, deadline, fallback)
+
+    async def _fetch(self, name: str):
+        fetch = self.sources[name][0]
+        value = await fetch() if asyncio.iscoroutinefunction(fetch) else fetch()
+        if value is None:
+            raise ValueError("джерело не повернуло даних")
+        self.cache[name] = (value, time.time())
+        return value
+
+    def _task(self, name: str) -> asyncio.Task:
+        task = self.inflight.get(name)
+        if task is None or task.done():
+            task = asyncio.create_task(self._fetch(name))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # помилка вже врахована у звіті
+            self.inflight[name] = task
+        return task
+
+    def _stale(self, name: str, now: float) -> str:
+        cached = self.cache.get(name)
+        if cached is None:
+            return self.sources[name][2]
+        return f"{cached[0]}\n(⏳ застаріле: {round(now - cached[1])} с тому)"
+
+    async def gather(self, *names) -> tuple:
+        """
+        Повертає (values, report). report: late / failed — джерела, замінені кешем.
+        """
+        start = time.time()
+        tasks = {name: self._task(name) for name in names}
+        deadline_at = {name: start + min(self.sources[name][1], self.deadline) for name in names}
+        values, late, failed, errors = {}, [], [], {}
+        pending = set(names)
+
+        while pending:
+            for name in [n for n in pending if tasks[n].done()]:
+                pending.discard(name)
+                if tasks[name].cancelled() or tasks[name].exception() is not None:
+                    failed.append(name)
+                    errors[name] = "скасовано" if tasks[name].cancelled() else str(tasks[name].exception())
+                else:
+                    values[name] = tasks[name].result()
+
+            now = time.time()
+            for name in [n for n in pending if now >= deadline_at[n]]:
+                pending.discard(name)
+                late.append(name)
+            if not pending:
+                break
+            await asyncio.wait(
+                [tasks[n] for n in pending],
+                timeout=min(deadline_at[n] for n in pending) - now,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+        now = time.time()
+        for name in late + failed:
+            self.late_counts[name] += 1
+            values[name] = self._stale(name, now)
+        self.last_report = {
+            "late": late,
+            "failed": failed,
+            "errors": errors,
+            "elapsed_ms": round((now - start) * 1000, 1),
+        }
+        return values, self.last_report
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "late_counts": dict(self.late_counts),
+            "cache_age": {name: round(now - ts, 1) for name, (_, ts) in self.cache.items()},
+            "last": self.last_report,
+        }
+
+
+async def fetch_news():
+    return await asyncio.to_thread(get_latest_news)
+
+
+def report_late_context(report: dict):
+    if report["late"] or report["failed"]:
+        errors = "".join(f"\n❌ {name}: {error}" for name, error in report["errors"].items())
+        send_message(
+            f"⏱️ Контекст за {report['elapsed_ms']} мс, з кешу: "
+            f"{', '.join(report['late'] + report['failed'])}{errors}"
+        )
+
+
+# 📡 Моніторинг кластерів через WebSocket
+# 🔁 Перевірка чи пройшов cooldown
+def is_cooldown_ready():
+    now = time.time()
+    return now - last_trade_time >= CONFIG["COOLDOWN_SECONDS"]
+
+# ⏳ Оновлення cooldown таймера
+def update_cooldown():
+    global last_trade_time
+    last_trade_time = time.time()
+
+# 📈 Кількість позиції через REST (лише поки user data stream не синхронізований)
+async def fetch_position_qty(side):
+    positions = await binance_client.futures_position_information(symbol=CONFIG["SYMBOL"])
+    for p in positions:
+        amt = float(p["positionAmt"])
+        if side == "LONG" and amt > 0:
+            return amt
+        elif side == "SHORT" and amt < 0:
+            return abs(amt)
+    return 0
+
+# 📈 Отримання кількості відкритої позиції (з дзеркала рахунку)
+async def get_current_position_qty(side):
+    try:
+        if account_mirror.live:
+            return account_mirror.position_qty(side)
+        return await fetch_position_qty(side)
+    except Exception as e:
+        send_message(f"❌ Position qty error: {e}")
+        return 0
+
+# 🧹 Перевірка чи є відкрита позиція
+async def has_open_position(side):
+    try:
+        if account_mirror.live:
+            return account_mirror.position_qty(side) > 0
+        return await fetch_position_qty(side) > 0
+    except Exception as e:
+        send_message(f"❌ Position check error: {e}")
+        return False
+
+# 📥 Обмежена черга подій з явною політикою переповнення
+class BoundedEventQueue:
+    """
+    asyncio.Queue з фіксованим розміром і явною політикою при переповненні:
+    "drop_oldest" — викидаємо найстарішу подію, "drop_newest" — нову.
+    Продюсер ніколи не чекає, а кількість втрат видно в метриках.
+    """
+
+    def __init__(self, name: str, maxsize: int, policy: str = "drop_oldest"):
+        if policy not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"Невідома політика переповнення: {policy}")
+        self.name = name
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.high_watermark = 0
+        self.last_overflow_alert = 0.0
+
+    def put(self, item) -> bool:
+        if self.queue.full():
+            self.dropped += 1
+            self._alert_overflow()
+            if self.policy == "drop_newest":
+                return False
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(item)
+        size = self.queue.qsize()
+        if size > self.high_watermark:
+            self.high_watermark = size
+        return True
+
+    async def get(self):
+        return await self.queue.get()
+
+    def _alert_overflow(self):
+        now = time.time()
+        if now - self.last_overflow_alert > 60:
+            self.last_overflow_alert = now
+            send_message(f"⚠️ Черга {self.name} переповнена ({self.policy}), втрачено подій: {self.dropped}")
+
+    def stats(self) -> dict:
+        return {
+            "size": self.queue.qsize(),
+            "maxsize": self.queue.maxsize,
+            "high_watermark": self.high_watermark,
+            "dropped": self.dropped,
+            "policy": self.policy,
+        }
+
+
+# ⏱️ Затримка між часом біржі (E/T) і локальним часом отримання
+class LagStats:
+    """
+    Рахує затримку подій у мілісекундах: остання, EWMA і максимум за вікно.
+    """
+
+    def __init__(self, alpha: float = 0.05, window_seconds: float = 60):
+        self.alpha = alpha
+        self.window_seconds = window_seconds
+        self.last_ms = 0.0
+        self.ewma_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = 0
+        self.window_start = time.time()
+
+    def record(self, event_ms: float, recv_ms: float):
+        lag = recv_ms - event_ms
+        self.last_ms = lag
+        self.ewma_ms = lag if self.samples == 0 else self.ewma_ms + self.alpha * (lag - self.ewma_ms)
+        self.samples += 1
+        now = recv_ms / 1000
+        if now - self.window_start >= self.window_seconds:
+            self.window_start = now
+            self.max_ms = lag
+        elif lag > self.max_ms:
+            self.max_ms = lag
+
+    def stats(self) -> dict:
+        return {
+            "last_ms": round(self.last_ms, 1),
+            "ewma_ms": round(self.ewma_ms, 1),
+            "max_ms": round(self.max_ms, 1),
+            "samples": self.samples,
+        }
+
+
+# 🧾 Типізовані події ринкових потоків Binance Futures
+class AggTrade(NamedTuple):
+    a: int
+    f: int
+    l: int
+    price: float
+    qty: float
+    is_sell: bool
+    E: int
+    T: int
+    recv_ms: float
+
+
+class DepthUpdate(NamedTuple):
+    E: int
+    T: int
+    U: int
+    u: int
+    pu: int
+    bids: list
+    asks: list
+    recv_ms: float
+
+
+class MarkPriceUpdate(NamedTuple):
+    E: int
+    mark_price: float
+    index_price: float
+    funding_rate: float
+    next_funding_time: int
+    recv_ms: float
+
+
+class BookTickerUpdate(NamedTuple):
+    u: int
+    E: int
+    T: int
+    bid: float
+    bid_qty: float
+    ask: float
+    ask_qty: float
+    recv_ms: float
+
+
+class KlineUpdate(NamedTuple):
+    E: int
+    interval: str
+    open_time: int
+    close_time: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    quote_volume: float
+    trades: int
+    taker_buy_volume: float
+    is_closed: bool
+    recv_ms: float
+
+
+class ForceOrder(NamedTuple):
+    E: int
+    side: str
+    price: float
+    avg_price: float
+    qty: float
+    status: str
+    T: int
+    recv_ms: float
+
+
+def parse_agg_trade(d: dict, recv_ms: float) -> AggTrade:
+    return AggTrade(d["a"], d["f"], d["l"], float(d["p"]), float(d["q"]), d["m"], d["E"], d["T"], recv_ms)
+
+
+def parse_depth_update(d: dict, recv_ms: float) -> DepthUpdate:
+    return DepthUpdate(
+        d["E"], d.get("T", d["E"]), d.get("U", 0), d.get("u", 0), d.get("pu", 0),
+        [(float(p), float(q)) for p, q in d.get("b", [])],
+        [(float(p), float(q)) for p, q in d.get("a", [])],
+        recv_ms
+    )
+
+
+def parse_mark_price(d: dict, recv_ms: float) -> MarkPriceUpdate:
+    return MarkPriceUpdate(d["E"], float(d["p"]), float(d.get("i", 0)), float(d.get("r") or 0), d.get("T", 0), recv_ms)
+
+
+def parse_book_ticker(d: dict, recv_ms: float) -> BookTickerUpdate:
+    return BookTickerUpdate(
+        d["u"], d.get("E", 0), d.get("T", 0),
+        float(d["b"]), float(d["B"]), float(d["a"]), float(d["A"]),
+        recv_ms
+    )
+
+
+def parse_kline(d: dict, recv_ms: float) -> KlineUpdate:
+    k = d["k"]
+    return KlineUpdate(
+        d["E"], k["i"], k["t"], k["T"],
+        float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]),
+        float(k["v"]), float(k["q"]), k["n"], float(k["V"]), k["x"],
+        recv_ms
+    )
+
+
+def parse_force_order(d: dict, recv_ms: float) -> ForceOrder:
+    o = d["o"]
+    return ForceOrder(d["E"], o["S"], float(o["p"]), float(o["ap"]), float(o["q"]), o["X"], o["T"], recv_ms)
+
+
+# Парсер обирається за типом потоку (частина назви після "@")
+STREAM_PARSERS = {
+    "aggTrade": parse_agg_trade,
+    "depth": parse_depth_update,
+    "markPrice": parse_mark_price,
+    "bookTicker": parse_book_ticker,
+    "kline": parse_kline,
+    "forceOrder": parse_force_order,
+}
+
+
+def get_stream_kind(stream: str) -> str:
+    kind = stream.split("@", 1)[1].split("@", 1)[0].split("_", 1)[0]
+    if kind.startswith("depth"):
+        kind = "depth"
+    return kind
+
+
+def get_stream_parser(stream: str):
+    return STREAM_PARSERS.get(get_stream_kind(stream))
+
+
+# 🫀 Heartbeat-нагляд за зʼєднанням: тиша в потоці → примусове перепідключення
+class ConnectionSupervisor:
+    """
+    Відстежує час від останнього повідомлення по кожному потоку зʼєднання.
+    Якщо потік мовчить довше порогу з CONFIG["STREAM_STALE_SECONDS"], закриває сокет,
+    а цикл зʼєднання перепідключається на інший хост (див. raise_if_forced).
+    Протокольні ping/pong забезпечує websockets (WS_PING_INTERVAL / WS_PING_TIMEOUT).
+    """
+
+    def __init__(self, name: str, check_interval: float = 1.0):
+        self.name = name
+        self.check_interval = check_interval
+        self.websocket = None
+        self.connected_at: float | None = None
+        self.last_seen: dict[str, float] = {}
+        self.forced_reason: str | None = None
+        self.forced_reconnects = 0
+
+    def attach(self, websocket, streams: list[str]):
+        self.websocket = websocket
+        self.connected_at = time.time()
+        self.last_seen = {stream: self.connected_at for stream in streams}
+        self.forced_reason = None
+
+    def detach(self):
+        self.websocket = None
+
+    def watch(self, stream: str):
+        self.last_seen.setdefault(stream, time.time())
+
+    def touch(self, stream: str, now: float):
+        self.last_seen[stream] = now
+
+    @staticmethod
+    def stale_threshold(stream: str) -> float | None:
+        thresholds = CONFIG["STREAM_STALE_SECONDS"]
+        return thresholds.get(get_stream_kind(stream), thresholds["default"])
+
+    def raise_if_forced(self):
+        if self.forced_reason:
+            raise ConnectionError(self.forced_reason)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            websocket = self.websocket
+            if websocket is None:
+                continue
+            now = time.time()
+            for stream, seen in self.last_seen.items():
+                threshold = self.stale_threshold(stream)
+                if threshold is None or now - seen <= threshold:
+                    continue
+                self.forced_reason = f"потік {stream} мовчить {now - seen:.0f} с"
+                self.forced_reconnects += 1
+                send_message(f"🫀 {self.name}: {self.forced_reason} — примусове перепідключення")
+                self.websocket = None
+                try:
+                    await websocket.close()
+                except Exception:
+                    pass
+                break
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "connected": self.websocket is not None,
+            "forced_reconnects": self.forced_reconnects,
+            "silence_seconds": {stream: round(now - seen, 1) for stream, seen in self.last_seen.items()},
+        }
+
+
+# 🧊 Свіжість похідних станів (стіни, дельта, кластери) для шляху рішень
+def mark_state_fresh(name: str):
+    state_updated_at[name] = time.time()
+
+
+def get_stale_states(*names: str) -> list[str]:
+    """
+    Повертає ті стани, які не оновлювались довше CONFIG["STATE_MAX_AGE_SECONDS"] (або ще жодного разу).
+    """
+    now = time.time()
+    stale = []
+    for name in names:
+        updated = state_updated_at.get(name)
+        if updated is None or now - updated > CONFIG["STATE_MAX_AGE_SECONDS"][name]:
+            stale.append(name)
+    return stale
+
+
+def refuse_stale_inputs(*names: str) -> bool:
+    """
+    True, якщо хоч один вхід застарів — тоді рішення не приймається.
+    Повідомлення в Telegram не частіше разу на хвилину.
+    """
+    global last_stale_alert_time
+    stale = get_stale_states(*names)
+    if not stale:
+        return False
+    now = time.time()
+    if now - last_stale_alert_time > 60:
+        send_message(f"🧊 Пропуск сигналу: застарілі дані ({', '.join(stale)})")
+        last_stale_alert_time = now
+    return True
+
+
+def get_state_freshness() -> dict:
+    now = time.time()
+    return {
+        name: {"age_seconds": round(now - updated, 1), "fresh": not get_stale_states(name)}
+        for name, updated in state_updated_at.items()
+    }
+
+
+# 🧮 Контроль послідовності aggTrade і дозавантаження пропусків через REST
+class AggTradeSequencer:
+    """
+    Стежить за безперервністю id угод ("a", а також f/l всередині агрегату).
+    Якщо після перепідключення або збою id перестрибує, живі угоди тримаються в буфері,
+    пропущений діапазон сторінками дозавантажується через futures aggTrades REST,
+    і лише потім потік продовжується — споживачі бачать угоди без дір і по порядку.
+    """
+
+    def __init__(self, symbol: str, emit, page_limit: int = 1000, max_backfill: int = 20000):
+        self.symbol = symbol.upper()
+        self.emit = emit
+        self.page_limit = page_limit
+        self.max_backfill = max_backfill
+        self.last_id: int | None = None
+        self.last_trade_id: int | None = None
+        self.backfilling = False
+        self.pending: deque = deque()
+        self.gaps = 0
+        self.missing = 0
+        self.backfilled = 0
+        self.unrecovered = 0
+        self.trade_id_gaps = 0
+        self.stale = 0
+
+    def on_event(self, trade: AggTrade):
+        if self.backfilling:
+            self.pending.append(trade)
+            return
+        if self.last_id is not None:
+            if trade.a <= self.last_id:
+                self.stale += 1
+                return
+            if trade.a > self.last_id + 1:
+                self.gaps += 1
+                self.missing += trade.a - self.last_id - 1
+                self.backfilling = True
+                self.pending.append(trade)
+                asyncio.create_task(self._backfill(self.last_id + 1, trade.a - 1))
+                return
+        self._forward(trade)
+
+    def _forward(self, trade: AggTrade):
+        if self.last_trade_id is not None and trade.f != self.last_trade_id + 1:
+            self.trade_id_gaps += 1
+        self.last_id = trade.a
+        self.last_trade_id = trade.l
+        self.emit(trade)
+
+    async def _backfill(self, from_id: int, to_id: int):
+        try:
+            if to_id - from_id + 1 > self.max_backfill:
+                # Надто старі угоди вже не потрібні вікнам аналізу — беремо лише хвіст
+                skipped = to_id - from_id + 1 - self.max_backfill
+                self.unrecovered += skipped
+                from_id = to_id - self.max_backfill + 1
+                self.last_id = from_id - 1
+                self.last_trade_id = None
+
+            while from_id <= to_id:
+                rows = await binance_client.futures_aggregate_trades(
+                    symbol=self.symbol, fromId=from_id, limit=self.page_limit
+                )
+                if not rows:
+                    break
+                recv_ms = time.time() * 1000
+                for r in rows:
+                    if r["a"] > to_id:
+                        break
+                    self._forward(AggTrade(r["a"], r["f"], r["l"], float(r["p"]), float(r["q"]), r["m"], r["T"], r["T"], recv_ms))
+                    self.backfilled += 1
+                from_id = rows[-1]["a"] + 1
+
+            if self.last_id is not None and self.last_id < to_id:
+                self.unrecovered += to_id - self.last_id
+            send_message(f"🧩 aggTrade: дозавантажено пропуск до id {to_id} (усього пропусків: {self.gaps})")
+        except Exception as e:
+            self.unrecovered += max(0, to_id - (self.last_id or from_id - 1))
+            send_message(f"❌ aggTrade backfill error: {e}")
+        finally:
+            # Продовжуємо живий потік; нова дірка в буфері запустить наступне дозавантаження
+            self.backfilling = False
+            pending, self.pending = self.pending, deque()
+            for trade in pending:
+                self.on_event(trade)
+
+    def stats(self) -> dict:
+        return {
+            "last_id": self.last_id,
+            "gaps": self.gaps,
+            "missing": self.missing,
+            "backfilled": self.backfilled,
+            "unrecovered": self.unrecovered,
+            "trade_id_gaps": self.trade_id_gaps,
+            "stale": self.stale,
+            "backfilling": self.backfilling,
+            "pending": len(self.pending),
+        }
+
+
+# 🪞 Дедуплікація кількох ідентичних фідів (перший, хто приніс подію, — виграє)
+class FeedDeduplicator:
+    """
+    Пропускає кожну подію лише один раз, незалежно від того, з якого фіду вона прийшла.
+    Ключ — (потік, id): для aggTrade це "a", для стакану "u", для решти — час події "E".
+    Для кожного фіду рахує перемоги і відставання від переможця (skew) у мс.
+    Памʼять обмежена останніми `memory` ключами.
+    """
+
+    def __init__(self, feeds: int, memory: int = 50000):
+        self.memory = memory
+        self.seen: dict[tuple, float] = {}
+        self.order: deque = deque()
+        self.wins = [0] * feeds
+        self.duplicates = [0] * feeds
+        self.skew = [LagStats() for _ in range(feeds)]
+
+    @staticmethod
+    def event_key(stream: str, data: dict) -> tuple:
+        if "a" in data and "@aggTrade" in stream:
+            return stream, data["a"]
+        if "u" in data:
+            return stream, data["u"]
+        return stream, data.get("E")
+
+    def accept(self, key: tuple, recv_ms: float, feed: int) -> bool:
+        first_recv_ms = self.seen.get(key)
+        if first_recv_ms is None:
+            self.seen[key] = recv_ms
+            self.order.append(key)
+            if len(self.order) > self.memory:
+                del self.seen[self.order.popleft()]
+            self.wins[feed] += 1
+            return True
+        self.duplicates[feed] += 1
+        self.skew[feed].record(first_recv_ms, recv_ms)
+        return False
+
+    def stats(self, feed: int) -> dict:
+        return {
+            "wins": self.wins[feed],
+            "duplicates": self.duplicates[feed],
+            "skew": self.skew[feed].stats(),
+        }
+
+
+# 🔀 Одне комбіноване зʼєднання Binance з розсилкою подій споживачам
+class MarketStreamHub:
+    """
+    Тримає один сокет /stream?streams=... на всі ринкові потоки.
+    Кожне повідомлення декодується один раз, перетворюється на типізовану подію
+    і розсилається в окремі обмежені черги зареєстрованих споживачів.
+    Нові потоки (markPrice, kline, forceOrder...) додаються без нового сокета.
+
+    При feeds > 1 ті самі потоки одночасно тримаються на кількох хостах (hot-standby):
+    події зводяться через FeedDeduplicator, тож падіння одного вузла не дає розриву.
+    """
+
+    HOSTS = [
+        "wss://fstream.binance.com",
+        "wss://fstream1.binance.com",
+        "wss://fstream2.binance.com"
+    ]
+
+    def __init__(self, feeds: int = 1):
+        self.feeds = max(1, min(feeds, len(self.HOSTS)))
+        self.streams: list[str] = []
+        self.consumers: dict[str, list[BoundedEventQueue]] = defaultdict(list)
+        self.lag: dict[str, LagStats] = {}
+        self.websockets: dict[int, object] = {}
+        self.connected_uri: dict[int, str] = {}
+        self.feed_messages = [0] * self.feeds
+        self.dedup = FeedDeduplicator(self.feeds) if self.feeds > 1 else None
+        self.supervisors = [ConnectionSupervisor(f"Фід {feed + 1}") for feed in range(self.feeds)]
+        self.sequencers: dict[str, AggTradeSequencer] = {}
+        self.messages = 0
+        self._request_id = 0
+
+    def subscribe(self, stream: str, name: str, maxsize: int = 10000, policy: str = "drop_oldest") -> BoundedEventQueue:
+        """
+        Реєструє споживача потоку і повертає його власну чергу подій.
+        """
+        queue = BoundedEventQueue(f"{stream}→{name}", maxsize, policy)
+        self.consumers[stream].append(queue)
+        self._add_stream(stream)
+        return queue
+
+    def _add_stream(self, stream: str):
+        if stream in self.streams:
+            return
+        self.streams.append(stream)
+        self.lag[stream] = LagStats()
+        if get_stream_parser(stream) is parse_agg_trade:
+            symbol = stream.split("@", 1)[0]
+            self.sequencers[stream] = AggTradeSequencer(symbol, lambda event, stream=stream: self._fan_out(stream, event))
+        for supervisor in self.supervisors:
+            if supervisor.websocket is not None:
+                supervisor.watch(stream)
+        # Живі зʼєднання — дописуємо потік через SUBSCRIBE без перепідключення
+        for websocket in self.websockets.values():
+            self._request_id += 1
+            request = {"method": "SUBSCRIBE", "params": [stream], "id": self._request_id}
+            asyncio.create_task(websocket.send(json.dumps(request)))
+
+    def dispatch(self, raw: str, recv_ms: float, feed: int = 0):
+        msg = json.loads(raw)
+        stream = msg.get("stream")
+        if stream is None:
+            return  # відповідь на SUBSCRIBE
+        data = msg["data"]
+        self.feed_messages[feed] += 1
+        self.supervisors[feed].touch(stream, recv_ms / 1000)
+        if self.dedup is not None and not self.dedup.accept(FeedDeduplicator.event_key(stream, data), recv_ms, feed):
+            return
+        parser = get_stream_parser(stream)
+        event = parser(data, recv_ms) if parser else data
+        if "E" in data:
+            self.lag[stream].record(data["E"], recv_ms)
+        self.messages += 1
+        sequencer = self.sequencers.get(stream)
+        if sequencer is not None:
+            sequencer.on_event(event)
+        else:
+            self._fan_out(stream, event)
+
+    def _fan_out(self, stream: str, event):
+        for queue in self.consumers[stream]:
+            queue.put(event)
+
+    async def run(self):
+        await asyncio.gather(
+            *(self.run_feed(feed) for feed in range(self.feeds)),
+            *(supervisor.run() for supervisor in self.supervisors)
+        )
+
+    async def run_feed(self, feed: int):
+        # Кожен фід стартує зі свого хоста і при помилці перемикається на наступний
+        current_host_index = feed
+        reconnect_delay = 5
+        error_counter = 0
+        label = f"фід {feed + 1}/{self.feeds}" if self.feeds > 1 else f"{len(self.streams)} потоків"
+
+        while True:
+            try:
+                uri = f"{self.HOSTS[current_host_index]}/stream?streams={'/'.join(self.streams)}"
+                async with websockets.connect(
+                    uri,
+                    ping_interval=CONFIG["WS_PING_INTERVAL"],
+                    ping_timeout=CONFIG["WS_PING_TIMEOUT"]
+                ) as websocket:
+                    self.websockets[feed] = websocket
+                    self.connected_uri[feed] = uri
+                    self.supervisors[feed].attach(websocket, self.streams)
+                    send_message(f"✅ Підключено до WebSocket: {self.HOSTS[current_host_index]} ({label})")
+                    reconnect_delay = 5
+                    error_counter = 0
+
+                    async for msg_raw in websocket:
+                        self.dispatch(msg_raw, time.time() * 1000, feed)
+
+                    self.supervisors[feed].raise_if_forced()
+
+            except Exception as e:
+                self.websockets.pop(feed, None)
+                self.supervisors[feed].detach()
+                error_counter += 1
+                reconnect_delay = min(60, reconnect_delay * 2)
+                current_host_index = (current_host_index + 1) % len(self.HOSTS)
+
+                if error_counter > 5:
+                    send_message(f"❌ Занадто багато помилок WebSocket підряд ({error_counter}, {label}). Фід призупинено на 5 хвилин.")
+                    await asyncio.sleep(300)
+                    error_counter = 0
+                    reconnect_delay = 5
+                else:
+                    send_message(f"⚠️ WebSocket помилка ({label}): {e}. Перемикаємо сервер. Перепідключення через {reconnect_delay} сек...")
+                    await asyncio.sleep(reconnect_delay)
+            finally:
+                self.websockets.pop(feed, None)
+                self.supervisors[feed].detach()
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "feeds": {
+                feed: {
+                    "uri": self.connected_uri.get(feed),
+                    "connected": feed in self.websockets,
+                    "messages": self.feed_messages[feed],
+                    "heartbeat": self.supervisors[feed].stats(),
+                    **(self.dedup.stats(feed) if self.dedup else {}),
+                }
+                for feed in range(self.feeds)
+            },
+            "streams": {
+                stream: {
+                    "lag": self.lag[stream].stats(),
+                    **({"sequence": self.sequencers[stream].stats()} if stream in self.sequencers else {}),
+                    "consumers": {q.name: q.stats() for q in self.consumers[stream]},
+                }
+                for stream in self.streams
+            },
+        }
+
+# 🪜 Одна сторона стакану: масив по тиках ціни + дерево відрізків
+class PriceLadder:
+    """
+    Рівні ціни зберігаються у масиві, індексованому тиком ціни відносно base_tick (вікно навколо ринку).
+    Дерево відрізків тримає суму і максимум обсягу, тож краща ціна, обсяг у діапазоні
+    і найбільша стіна рахуються за O(log n), оновлення рівня — теж O(log n).
+    Рівні поза вікном лежать у словнику levels і потрапляють у масив при перецентруванні.
+    """
+
+    def __init__(self, tick_size: float, window_ticks: int = 1 << 15):
+        self.tick_size = tick_size
+        self.size = window_ticks
+        self.base_tick: int | None = None
+        self.levels: dict[int, float] = {}
+        self.sum_tree = [0.0] * (2 * self.size)
+        self.max_tree = [0.0] * (2 * self.size)
+
+    def to_tick(self, price: float) -> int:
+        return round(price / self.tick_size)
+
+    def to_price(self, tick: int) -> float:
+        return round(tick * self.tick_size, 8)
+
+    def clear(self):
+        self.levels.clear()
+        self.base_tick = None
+        self.sum_tree = [0.0] * (2 * self.size)
+        self.max_tree = [0.0] * (2 * self.size)
+
+    def set(self, price: float, qty: float):
+        tick = self.to_tick(price)
+        if qty > 0:
+            self.levels[tick] = qty
+        else:
+            self.levels.pop(tick, None)
+        if self.base_tick is None:
+            self.recenter(tick)
+            return
+        index = tick - self.base_tick
+        if 0 <= index < self.size:
+            self._update(index, qty if qty > 0 else 0.0)
+
+    def _update(self, index: int, qty: float):
+        i = index + self.size
+        self.sum_tree[i] = qty
+        self.max_tree[i] = qty
+        i >>= 1
+        while i:
+            left, right = 2 * i, 2 * i + 1
+            self.sum_tree[i] = self.sum_tree[left] + self.sum_tree[right]
+            self.max_tree[i] = max(self.max_tree[left], self.max_tree[right])
+            i >>= 1
+
+    def recenter(self, center_tick: int):
+        """
+        Перебудова вікна навколо center_tick — O(size), викликається рідко.
+        """
+        size = self.size
+        self.base_tick = center_tick - size // 2
+        sums = [0.0] * (2 * size)
+        for tick, qty in self.levels.items():
+            index = tick - self.base_tick
+            if 0 <= index < size:
+                sums[index + size] = qty
+        maxs = sums[:]
+        for i in range(size - 1, 0, -1):
+            sums[i] = sums[2 * i] + sums[2 * i + 1]
+            maxs[i] = max(maxs[2 * i], maxs[2 * i + 1])
+        self.sum_tree = sums
+        self.max_tree = maxs
+
+    def index_of(self, tick: int) -> int:
+        return tick - self.base_tick
+
+    def _clip(self, lo_tick: int, hi_tick: int) -> tuple[int, int] | None:
+        if self.base_tick is None:
+            return None
+        lo = max(0, lo_tick - self.base_tick)
+        hi = min(self.size - 1, hi_tick - self.base_tick)
+        return (lo, hi) if lo <= hi else None
+
+    def best_tick(self, highest: bool) -> int | None:
+        if self.base_tick is None or not self.levels:
+            return None
+        if self.max_tree[1] <= 0:
+            # Усі рівні поза вікном — рідкісний випадок, рахуємо напряму
+            return max(self.levels) if highest else min(self.levels)
+        i = 1
+        while i < self.size:
+            first, second = (2 * i + 1, 2 * i) if highest else (2 * i, 2 * i + 1)
+            i = first if self.max_tree[first] > 0 else second
+        return self.base_tick + i - self.size
+
+    def range_sum(self, lo_tick: int, hi_tick: int) -> float:
+        bounds = self._clip(lo_tick, hi_tick)
+        if bounds is None:
+            return 0.0
+        lo, hi = bounds[0] + self.size, bounds[1] + self.size + 1
+        total = 0.0
+        while lo < hi:
+            if lo & 1:
+                total += self.sum_tree[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                total += self.sum_tree[hi]
+            lo >>= 1
+            hi >>= 1
+        return total
+
+    def range_max(self, lo_tick: int, hi_tick: int) -> tuple[int, float] | None:
+        """
+        Найбільший рівень у діапазоні тиків: (tick, qty) або None.
+        """
+        bounds = self._clip(lo_tick, hi_tick)
+        if bounds is None:
+            return None
+        lo, hi = bounds[0] + self.size, bounds[1] + self.size + 1
+        best_node, best_qty = None, 0.0
+        while lo < hi:
+            if lo & 1:
+                if self.max_tree[lo] > best_qty:
+                    best_node, best_qty = lo, self.max_tree[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if self.max_tree[hi] > best_qty:
+                    best_node, best_qty = hi, self.max_tree[hi]
+            lo >>= 1
+            hi >>= 1
+        if best_node is None:
+            return None
+        while best_node < self.size:
+            best_node = 2 * best_node if self.max_tree[2 * best_node] >= self.max_tree[2 * best_node + 1] else 2 * best_node + 1
+        return self.base_tick + best_node - self.size, best_qty
+
+    def first_above(self, lo_tick: int, hi_tick: int, threshold: float, from_high: bool) -> tuple[int, float] | None:
+        """
+        Перший рівень з обсягом > threshold, рахуючи від hi_tick вниз (from_high) або від lo_tick вгору.
+        """
+        bounds = self._clip(lo_tick, hi_tick)
+        if bounds is None:
+            return None
+        lo, hi = bounds
+
+        def search(node: int, node_lo: int, node_hi: int) -> int | None:
+            if node_hi < lo or node_lo > hi or self.max_tree[node] <= threshold:
+                return None
+            if node >= self.size:
+                return node - self.size
+            mid = (node_lo + node_hi) // 2
+            children = ((2 * node + 1, mid + 1, node_hi), (2 * node, node_lo, mid))
+            for child in (children if from_high else children[::-1]):
+                found = search(*child)
+                if found is not None:
+                    return found
+            return None
+
+        index = search(1, 0, self.size - 1)
+        if index is None:
+            return None
+        return self.base_tick + index, self.sum_tree[index + self.size]
+
+
+# 📚 Локальний стакан: REST-знімок + diff-потік @depth@100ms з перевіркою U/u/pu
+class LocalOrderBook:
+    """
+    Синхронізація за правилами Binance Futures:
+    1) буферизуємо diff-події; 2) беремо REST-знімок (lastUpdateId);
+    3) відкидаємо події з u < lastUpdateId; 4) перша подія має U <= lastUpdateId <= u;
+    5) далі кожна подія має pu == u попередньої, інакше — повна ресинхронізація.
+    """
+
+    def __init__(self, symbol: str, tick_size: float):
+        self.symbol = symbol.upper()
+        self.bids = PriceLadder(tick_size)
+        self.asks = PriceLadder(tick_size)
+        self.state = "unsynced"  # unsynced → bridging → live
+        self.last_update_id: int | None = None
+        self.pending: deque = deque(maxlen=5000)
+        self.syncing = False
+        self.resyncs = 0
+        self.updated_at = 0.0
+        self.wall_tracker: WallTracker | None = None
+
+    def is_live(self) -> bool:
+        return self.state == "live"
+
+    def on_event(self, event: DepthUpdate):
+        if self.state == "unsynced":
+            self.pending.append(event)
+            self._start_resync()
+            return
+
+        if event.u < self.last_update_id:
+            return  # подія старіша за знімок / дублікат
+
+        if self.state == "bridging":
+            if event.U <= self.last_update_id <= event.u:
+                self._apply(event)
+                self.state = "live"
+            else:
+                self._desync(event, "знімок не перекривається з потоком")
+            return
+
+        if event.pu != self.last_update_id:
+            self._desync(event, f"pu {event.pu} ≠ u {self.last_update_id}")
+            return
+        self._apply(event)
+
+    def _desync(self, event: DepthUpdate, reason: str):
+        self.state = "unsynced"
+        self.resyncs += 1
+        self.pending.clear()
+        self.pending.append(event)
+        print(f"📚 Orderbook resync ({self.symbol}): {reason}")
+        self._start_resync()
+
+    def _start_resync(self):
+        if not self.syncing:
+            self.syncing = True
+            asyncio.create_task(self.resync())
+
+    def _apply(self, event: DepthUpdate):
+        for price, qty in event.bids:
+            self.bids.set(price, qty)
+        for price, qty in event.asks:
+            self.asks.set(price, qty)
+        if self.wall_tracker is not None:
+            now = event.E / 1000
+            mid = self.mid_price()
+            for price, qty in event.bids:
+                self.wall_tracker.on_level("bid", price, qty, now, mid)
+            for price, qty in event.asks:
+                self.wall_tracker.on_level("ask", price, qty, now, mid)
+        self.last_update_id = event.u
+        self.updated_at = time.time()
+        mark_state_fresh("book")
+        self._maybe_recenter()
+
+    def _maybe_recenter(self):
+        mid = self.mid_price()
+        if mid is None:
+            return
+        tick = self.bids.to_tick(mid)
+        for ladder in (self.bids, self.asks):
+            index = ladder.index_of(tick)
+            if index < ladder.size // 8 or index > ladder.size * 7 // 8:
+                ladder.recenter(tick)
+
+    def load_snapshot(self, snapshot: dict):
+        self.bids.clear()
+        self.asks.clear()
+        if self.wall_tracker is not None:
+            self.wall_tracker.reset()
+        for price, qty in snapshot["bids"]:
+            self.bids.set(float(price), float(qty))
+        for price, qty in snapshot["asks"]:
+            self.asks.set(float(price), float(qty))
+        mid = self.mid_price()
+        if mid is not None:
+            self.bids.recenter(self.bids.to_tick(mid))
+            self.asks.recenter(self.asks.to_tick(mid))
+        self.last_update_id = snapshot["lastUpdateId"]
+
+    async def resync(self):
+        try:
+            while self.state == "unsynced":
+                try:
+                    snapshot = await binance_client.futures_order_book(symbol=self.symbol, limit=1000)
+                except Exception as e:
+                    send_message(f"❌ Orderbook snapshot error: {e}")
+                    await asyncio.sleep(5)
+                    continue
+                self.load_snapshot(snapshot)
+                self.state = "bridging"
+                pending, self.pending = list(self.pending), deque(maxlen=self.pending.maxlen)
+                for event in pending:
+                    self.on_event(event)
+                if self.state == "unsynced":
+                    await asyncio.sleep(1)
+        finally:
+            self.syncing = False
+
+    # 🔎 Запити до стакану — без мережі
+    def best_bid(self) -> float | None:
+        tick = self.bids.best_tick(highest=True)
+        return self.bids.to_price(tick) if tick is not None else None
+
+    def best_ask(self) -> float | None:
+        tick = self.asks.best_tick(highest=False)
+        return self.asks.to_price(tick) if tick is not None else None
+
+    def mid_price(self) -> float | None:
+        bid, ask = self.best_bid(), self.best_ask()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    def _side_range(self, side: str, bps: float) -> tuple[PriceLadder, int, int] | None:
+        mid = self.mid_price()
+        if mid is None:
+            return None
+        if side == "bid":
+            ladder = self.bids
+            return ladder, ladder.to_tick(mid * (1 - bps / 10000)), ladder.to_tick(mid)
+        ladder = self.asks
+        return ladder, ladder.to_tick(mid), ladder.to_tick(mid * (1 + bps / 10000))
+
+    def depth_within_bps(self, side: str, bps: float) -> float:
+        """
+        Сумарний обсяг (BTC) на стороні "bid"/"ask" в межах bps від mid.
+        """
+        bounds = self._side_range(side, bps)
+        return bounds[0].range_sum(bounds[1], bounds[2]) if bounds else 0.0
+
+    def largest_wall(self, side: str, bps: float) -> tuple[float, float] | None:
+        """
+        Найбільший рівень (price, qty) на стороні в межах bps від mid.
+        """
+        bounds = self._side_range(side, bps)
+        if not bounds:
+            return None
+        ladder, lo, hi = bounds
+        found = ladder.range_max(lo, hi)
+        return (ladder.to_price(found[0]), found[1]) if found else None
+
+    def nearest_wall(self, side: str, bps: float, ratio: float = 0.7) -> tuple[float, float] | None:
+        """
+        Найближчий до ринку рівень з обсягом > ratio від найбільшого в межах bps.
+        """
+        bounds = self._side_range(side, bps)
+        if not bounds:
+            return None
+        ladder, lo, hi = bounds
+        largest = ladder.range_max(lo, hi)
+        if not largest:
+            return None
+        found = ladder.first_above(lo, hi, largest[1] * ratio, from_high=(side == "bid"))
+        return (ladder.to_price(found[0]), found[1]) if found else None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "last_update_id": self.last_update_id,
+            "best_bid": self.best_bid(),
+            "best_ask": self.best_ask(),
+            "bid_levels": len(self.bids.levels),
+            "ask_levels": len(self.asks.levels),
+            "resyncs": self.resyncs,
+        }
+
+
+# 🧱 Життєвий цикл окремої стіни
+class WallInfo:
+    __slots__ = (
+        "side", "price", "appeared_at", "initial_qty", "qty", "max_qty",
+        "appear_distance_bps", "distance_bps", "history", "traded", "filled_qty", "pulled_qty"
+    )
+
+    def __init__(self, side: str, price: float, qty: float, now: float, distance_bps: float):
+        self.side = side
+        self.price = price
+        self.appeared_at = now
+        self.initial_qty = qty
+        self.qty = qty
+        self.max_qty = qty
+        self.appear_distance_bps = distance_bps
+        self.distance_bps = distance_bps
+        self.history: deque = deque([(now, qty)], maxlen=50)
+        self.traded = 0.0       # виконано угодами з моменту останньої зміни рівня
+        self.filled_qty = 0.0   # зменшення стіни, покрите угодами
+        self.pulled_qty = 0.0   # зменшення стіни без угод — зняли заявку
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "side": self.side,
+            "price": self.price,
+            "age_seconds": round(now - self.appeared_at, 1),
+            "qty": self.qty,
+            "max_qty": self.max_qty,
+            "appear_distance_bps": round(self.appear_distance_bps, 1),
+            "distance_bps": round(self.distance_bps, 1),
+            "filled_qty": round(self.filled_qty, 3),
+            "pulled_qty": round(self.pulled_qty, 3),
+        }
+
+
+# 🕵️ Трекер стін по рівнях ціни для виявлення спуфінгу
+class WallTracker:
+    """
+    Індексує великі заявки (>= WALL_MIN_QTY в межах WALL_MAX_DISTANCE_BPS від mid) за ціною.
+    Оновлюється лише по змінених рівнях diff-події стакану: O(змінених рівнів).
+    Зменшення стіни ділиться на "виконано" (покрито угодами на цій ціні) і "знято".
+    Коли стіна зникає, її вага додається до експоненційно згасаючих лічильників сторони;
+    спуф-скор = знято / (знято + виконано) читається за O(1).
+    """
+
+    def __init__(self, min_qty: float, max_distance_bps: float, decay_seconds: float = 300, short_life_seconds: float = 10):
+        self.min_qty = min_qty
+        self.max_distance_bps = max_distance_bps
+        self.decay_seconds = decay_seconds
+        self.short_life_seconds = short_life_seconds
+        self.walls: dict[str, dict[float, WallInfo]] = {"bid": {}, "ask": {}}
+        self.pulled = {"bid": 0.0, "ask": 0.0}
+        self.filled = {"bid": 0.0, "ask": 0.0}
+        self.decayed_at = {"bid": time.time(), "ask": time.time()}
+        self.finished: deque = deque(maxlen=200)
+
+    def reset(self):
+        self.walls = {"bid": {}, "ask": {}}
+
+    def on_level(self, side: str, price: float, qty: float, now: float, mid: float | None):
+        walls = self.walls[side]
+        wall = walls.get(price)
+        distance_bps = abs(price - mid) / mid * 10000 if mid else 0.0
+
+        if wall is None:
+            if qty >= self.min_qty and mid and distance_bps <= self.max_distance_bps:
+                walls[price] = WallInfo(side, price, qty, now, distance_bps)
+            return
+
+        decrease = wall.qty - qty
+        if decrease > 0:
+            filled = min(decrease, wall.traded)
+            wall.traded -= filled
+            wall.filled_qty += filled
+            wall.pulled_qty += decrease - filled
+        wall.qty = qty
+        wall.distance_bps = distance_bps
+        wall.history.append((now, qty))
+        if qty > wall.max_qty:
+            wall.max_qty = qty
+
+        if qty < self.min_qty:
+            del walls[price]
+            self._finish(wall, now)
+
+    def on_trade(self, price: float, qty: float, is_sell: bool):
+        # Агресивний продавець б'є в bid-стіни, покупець — в ask-стіни
+        wall = self.walls["bid" if is_sell else "ask"].get(price)
+        if wall is not None:
+            wall.traded += qty
+
+    def _finish(self, wall: WallInfo, now: float):
+        lifetime = now - wall.appeared_at
+        outcome = "pulled" if wall.pulled_qty > wall.filled_qty else "filled"
+        side = wall.side
+        self._decay(side, now)
+        if outcome == "pulled":
+            # Коротко жива знята стіна — найпідозріліша
+            weight = 1.0 if lifetime <= self.short_life_seconds else self.short_life_seconds / lifetime
+            self.pulled[side] += wall.max_qty * weight
+        else:
+            self.filled[side] += wall.max_qty
+        self.finished.append({**wall.to_dict(now), "outcome": outcome, "lifetime_seconds": round(lifetime, 1)})
+
+    def _decay(self, side: str, now: float):
+        factor = math.exp(-max(0.0, now - self.decayed_at[side]) / self.decay_seconds)
+        self.pulled[side] *= factor
+        self.filled[side] *= factor
+        self.decayed_at[side] = now
+
+    def spoof_score(self, side: str) -> float:
+        """
+        0 — стіни на стороні виконуються, 1 — стіни систематично знімають. O(1).
+        """
+        factor = math.exp(-max(0.0, time.time() - self.decayed_at[side]) / self.decay_seconds)
+        pulled = self.pulled[side] * factor
+        filled = self.filled[side] * factor
+        # min_qty як апріорна "виконана" вага, щоб одна подія не давала скор 1.0
+        return pulled / (pulled + filled + self.min_qty)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "spoof_score": {side: round(self.spoof_score(side), 3) for side in ("bid", "ask")},
+            "active": {side: [w.to_dict(now) for w in walls.values()] for side, walls in self.walls.items()},
+            "recent": list(self.finished)[-10:],
+        }
+
+
+# 📚 Підтримка локального стакану з diff-потоку
+def refresh_walls_from_book():
+    """
+    Найбільші стіни в межах WALL_SEARCH_BPS від mid для промпту GPT (замість depth20).
+    """
+    global current_buy_wall, current_sell_wall
+    if not local_book.is_live():
+        return
+    bid_wall = local_book.largest_wall("bid", CONFIG["WALL_SEARCH_BPS"])
+    ask_wall = local_book.largest_wall("ask", CONFIG["WALL_SEARCH_BPS"])
+    current_buy_wall = bid_wall[1] if bid_wall else 0.0
+    current_sell_wall = ask_wall[1] if ask_wall else 0.0
+    mark_state_fresh("walls")
+
+
+async def maintain_local_orderbook(symbol: str = "BTCUSDT"):
+    global local_book
+    while local_book is None:
+        try:
+            filters = await get_symbol_filters(symbol)
+            local_book = LocalOrderBook(symbol, filters["tick_size"])
+            local_book.wall_tracker = wall_tracker
+        except Exception as e:
+            send_message(f"❌ Orderbook init error: {e}")
+            await asyncio.sleep(10)
+
+    while True:
+        event = await depth_diff_queue.get()
+        try:
+            local_book.on_event(event)
+            refresh_walls_from_book()
+        except Exception as e:
+            send_message(f"⚠️ Local orderbook error: {e}")
+            local_book.state = "unsynced"
+            local_book.pending.clear()
+
+
+# 📊 Ковзна кумулятивна дельта обʼєму (CVD) на кільцевих масивах
+class CVDEngine:
+    """
+    Час поділено на бакети по bucket_ms. Для кожного бакета в кільцевому масиві зберігається
+    кумулятивна сума buy/sell (у BTC і в USDT) на його кінець, тож обʼєм за будь-яке вікно —
+    це різниця двох елементів: O(1) на запит і O(1) амортизовано на угоду.
+    Памʼять фіксована (horizon_seconds / bucket_ms) і не залежить від інтенсивності угод.
+    """
+
+    FIELDS = ("buy", "sell", "buy_quote", "sell_quote")
+
+    def __init__(self, bucket_ms: int = 100, horizon_seconds: int = 600):
+        self.bucket_ms = bucket_ms
+        self.size = horizon_seconds * 1000 // bucket_ms + 1
+        self.cum = {field: array("d", bytes(8 * self.size)) for field in self.FIELDS}
+        self.totals = dict.fromkeys(self.FIELDS, 0.0)
+        self.first_bucket: int | None = None
+        self.head_bucket: int | None = None
+        self.late_trades = 0
+
+    def _advance(self, bucket: int):
+        # Пропущені бакети без угод отримують поточні кумулятивні суми
+        start = max(self.head_bucket + 1, bucket - self.size + 1)
+        for b in range(start, bucket + 1):
+            i = b % self.size
+            for field in self.FIELDS:
+                self.cum[field][i] = self.totals[field]
+        self.head_bucket = bucket
+
+    def add(self, ts_ms: int, price: float, qty: float, is_sell: bool):
+        bucket = ts_ms // self.bucket_ms
+        if self.head_bucket is None:
+            self.first_bucket = self.head_bucket = bucket
+        elif bucket > self.head_bucket:
+            self._advance(bucket)
+        elif bucket < self.head_bucket:
+            # Запізніла угода (наприклад, з дозавантаження) — зараховуємо в поточний бакет
+            self.late_trades += 1
+
+        if is_sell:
+            self.totals["sell"] += qty
+            self.totals["sell_quote"] += qty * price
+        else:
+            self.totals["buy"] += qty
+            self.totals["buy_quote"] += qty * price
+        i = self.head_bucket % self.size
+        for field in self.FIELDS:
+            self.cum[field][i] = self.totals[field]
+
+    def window(self, seconds: float, quote: bool = False) -> dict:
+        """
+        Buy/sell обʼєм, дельта і відсоток покупок за останні `seconds` (до голови). O(1).
+        """
+        buy_field, sell_field = ("buy_quote", "sell_quote") if quote else ("buy", "sell")
+        if self.head_bucket is None:
+            return {"buy": 0.0, "sell": 0.0, "delta": 0.0, "buy_ratio": 50.0}
+        k = min(int(seconds * 1000 // self.bucket_ms), self.size - 1)
+        head = self.head_bucket % self.size
+        start_bucket = self.head_bucket - k
+        if start_bucket < self.first_bucket:
+            base_buy = base_sell = 0.0
+        else:
+            base_buy = self.cum[buy_field][start_bucket % self.size]
+            base_sell = self.cum[sell_field][start_bucket % self.size]
+        buy = self.cum[buy_field][head] - base_buy
+        sell = self.cum[sell_field][head] - base_sell
+        total = buy + sell
+        return {
+            "buy": buy,
+            "sell": sell,
+            "delta": buy - sell,
+            "buy_ratio": round(buy / total * 100, 2) if total > 0 else 50.0,
+        }
+
+    def cvd(self, quote: bool = False) -> float:
+        if quote:
+            return self.totals["buy_quote"] - self.totals["sell_quote"]
+        return self.totals["buy"] - self.totals["sell"]
+
+    def stats(self) -> dict:
+        return {
+            f"{seconds}s": {k: round(v, 3) for k, v in self.window(seconds).items()}
+            for seconds in (1, 5, 30, 60, 300)
+        } | {"cvd": round(self.cvd(), 3), "late_trades": self.late_trades}
+
+
+# 🦶 Профіль обʼєму на суцільних NumPy-масивах
+class VolumeProfile:
+    """
+    Buy/sell обʼєм по цінових бакетах розміру bucket_size (ключ — round(price / bucket_size),
+    як у старому cluster_data). Масиви індексуються зсувом бакета від base і розширюються
+    за потреби. Найсильніший бакет (= POC) відстежується інкрементально, бо обʼєми лише ростуть.
+    """
+
+    def __init__(self, bucket_size: float, capacity: int = 4096):
+        self.bucket_size = bucket_size
+        self.base: int | None = None
+        self.buy = np.zeros(capacity)
+        self.sell = np.zeros(capacity)
+        self.strongest_index: int | None = None
+        self.strongest_total = 0.0
+        self.trades = 0
+
+    def add(self, price: float, qty: float, is_sell: bool):
+        key = round(price / self.bucket_size)
+        if self.base is None:
+            self.base = key - len(self.buy) // 2
+        i = key - self.base
+        if i < 0 or i >= len(self.buy):
+            i = self._grow(key)
+        if is_sell:
+            self.sell[i] += qty
+        else:
+            self.buy[i] += qty
+        self.trades += 1
+        total = self.buy[i] + self.sell[i]
+        if total > self.strongest_total:
+            self.strongest_total = total
+            self.strongest_index = i
+
+    def _grow(self, key: int) -> int:
+        capacity = len(self.buy)
+        lo = min(self.base, key - capacity // 4)
+        hi = max(self.base + capacity, key + capacity // 4)
+        new_capacity = max(capacity * 2, hi - lo)
+        offset = self.base - lo
+        for name in ("buy", "sell"):
+            grown = np.zeros(new_capacity)
+            grown[offset:offset + capacity] = getattr(self, name)
+            setattr(self, name, grown)
+        self.base = lo
+        if self.strongest_index is not None:
+            self.strongest_index += offset
+        return key - self.base
+
+    def price_of(self, index: int) -> float:
+        return (self.base + index) * self.bucket_size
+
+    def strongest(self) -> tuple[float, float, float] | None:
+        """
+        (ціна бакета, buy, sell) найбільшого за обʼємом бакета. O(1).
+        """
+        i = self.strongest_index
+        if i is None:
+            return None
+        return self.price_of(i), float(self.buy[i]), float(self.sell[i])
+
+    def value_area(self, share: float = 0.7) -> tuple[float, float] | None:
+        """
+        Межі (VAL, VAH) найменшого набору бакетів з найбільшим обʼємом, що містить `share` обʼєму.
+        """
+        total = self.buy + self.sell
+        volume = total.sum()
+        if volume <= 0:
+            return None
+        order = np.argsort(total)[::-1]
+        needed = int(np.searchsorted(np.cumsum(total[order]), volume * share)) + 1
+        included = order[:needed]
+        return self.price_of(int(included.min())), self.price_of(int(included.max()))
+
+    def levels(self) -> list[tuple[float, float, float]]:
+        indices = np.nonzero(self.buy + self.sell)[0]
+        return [(self.price_of(int(i)), float(self.buy[i]), float(self.sell[i])) for i in indices]
+
+
+# 🦶 Footprint: кілька роздільностей вікна + профіль сесії
+class FootprintEngine:
+    """
+    Замість defaultdict cluster_data: для кожного розміру бакета — свій VolumeProfile поточного вікна,
+    плюс сесійний профіль (UTC-доба) для POC / value area.
+    rotate_window() віддає профілі закритого вікна без копіювання і підставляє нові.
+    """
+
+    def __init__(self, bucket_sizes: list[float], session_bucket_size: float):
+        self.bucket_sizes = list(bucket_sizes)
+        self.window = self._new_window()
+        self.session_bucket_size = session_bucket_size
+        self.session = VolumeProfile(session_bucket_size, capacity=8192)
+        self.session_day: int | None = None
+
+    def _new_window(self) -> dict[float, VolumeProfile]:
+        return {size: VolumeProfile(size) for size in self.bucket_sizes}
+
+    def add(self, price: float, qty: float, is_sell: bool, ts_ms: int):
+        for profile in self.window.values():
+            profile.add(price, qty, is_sell)
+        day = ts_ms // 86_400_000
+        if day != self.session_day:
+            self.session_day = day
+            self.session = VolumeProfile(self.session_bucket_size, capacity=8192)
+        self.session.add(price, qty, is_sell)
+
+    def rotate_window(self) -> dict[float, VolumeProfile]:
+        closed, self.window = self.window, self._new_window()
+        return closed
+
+    def session_levels(self) -> dict:
+        poc = self.session.strongest()
+        value_area = self.session.value_area()
+        return {
+            "poc": poc[0] if poc else None,
+            "val": value_area[0] if value_area else None,
+            "vah": value_area[1] if value_area else None,
+        }
+
+
+# 💲 Кеш останньої ціни: markPrice@1s + bookTicker
+class PriceCache:
+    """
+    Останні значення з потоків. Оновлення — заміна посилання на незмінний кортеж,
+    тому читачі (і з to_thread) завжди бачать цілісний знімок без блокувань.
+    Очікувачі wait_for() отримують ціну одразу, щойно спрацює їхня умова;
+    executor (якщо заданий) переозброює готові ордери на кожному тіку,
+    tick_handler отримує кожну нову ціну (супровід позицій).
+    """
+
+    def __init__(self, max_age_seconds: float):
+        self.max_age_ms = max_age_seconds * 1000
+        self.mark = None   # MarkPriceUpdate
+        self.book = None   # BookTickerUpdate
+        self.waiters = []
+        self.executor = None
+        self.tick_handler = None
+
+    def on_mark(self, event: MarkPriceUpdate):
+        self.mark = event
+        self._notify()
+
+    def on_book(self, event: BookTickerUpdate):
+        self.book = event
+        self._notify()
+
+    def _fresh(self, event) -> bool:
+        return event is not None and time.time() * 1000 - event.recv_ms <= self.max_age_ms
+
+    def mark_price(self) -> float:
+        mark = self.mark
+        if not self._fresh(mark):
+            raise RuntimeError("Mark price застарів або ще не отриманий")
+        return mark.mark_price
+
+    def last_price(self) -> float:
+        """
+        Середина bookTicker, якщо вона свіжа; інакше mark price.
+        """
+        book = self.book
+        if self._fresh(book):
+            return (book.bid + book.ask) / 2
+        return self.mark_price()
+
+    def _notify(self):
+        if not self.waiters and self.executor is None and self.tick_handler is None:
+            return
+        try:
+            price = self.last_price()
+        except RuntimeError:
+            return
+        if self.executor is not None:
+            self.executor.arm(price, current_stake_usd)
+        if self.tick_handler is not None:
+            self.tick_handler(price)
+        for predicate, future in self.waiters:
+            if not future.done() and predicate(price):
+                future.set_result(price)
+
+    async def wait_for(self, predicate, timeout: float) -> float:
+        """
+        Чекає ціну, що задовольняє predicate; після timeout повертає останню ціну.
+        """
+        waiter = (predicate, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return self.last_price()
+        finally:
+            self.waiters.remove(waiter)
+
+    def stats(self) -> dict:
+        now_ms = time.time() * 1000
+        return {
+            "mark_price": self.mark.mark_price if self.mark else None,
+            "mark_age_ms": round(now_ms - self.mark.recv_ms) if self.mark else None,
+            "bid": self.book.bid if self.book else None,
+            "ask": self.book.ask if self.book else None,
+            "book_age_ms": round(now_ms - self.book.recv_ms) if self.book else None,
+            "waiters": len(self.waiters),
+        }
+
+
+# 💲 Споживачі потоків ціни
+async def maintain_price_cache():
+    async def consume(queue: BoundedEventQueue, handler):
+        while True:
+            try:
+                handler(await queue.get())
+            except Exception as e:
+                send_message(f"❌ Price cache error: {e}")
+                await asyncio.sleep(1)
+
+    await asyncio.gather(
+        consume(mark_price_queue, price_cache.on_mark),
+        consume(book_ticker_queue, price_cache.on_book)
+    )
+
+
+# 📈 Чи є продовження руху після кластера (подієво, без фіксованого sleep)
+async def wait_for_continuation(direction: str, threshold_pct: float, window_seconds: float) -> float:
+    """
+    Повертає зміну ціни у %, щойно вона перетнула поріг у бік direction,
+    або зміну на момент завершення вікна.
+    """
+    start = price_cache.last_price()
+    if direction == "LONG":
+        crossed = lambda price: (price - start) / start * 100 >= threshold_pct
+    else:
+        crossed = lambda price: (price - start) / start * 100 <= -threshold_pct
+    price = await price_cache.wait_for(crossed, window_seconds)
+    return (price - start) / start * 100
+
+
+# 👤 Дзеркало позицій і ордерів з user data stream (listenKey)
+class AccountMirror:
+    """
+    Позиції, відкриті ордери і виконання з подій ACCOUNT_UPDATE / ORDER_TRADE_UPDATE.
+    Після кожного (пере)підключення стан звіряється з REST; події, що прийшли під час
+    звірки, буферизуються і застосовуються після знімка. Кожен запис зберігає час
+    останньої зміни, тож старіша подія чи знімок не перетирають новіший стан.
+    Виконання (x == TRADE) передаються в журнал угод через ledger.
+    """
+
+    def __init__(self, symbol: str, fills_memory: int = 500):
+        self.symbol = symbol.upper()
+        self.positions = {}      # positionSide → {"amt", "entry_price", "unrealized", "updated_ms"}
+        self.open_orders = {}    # orderId → {"side", "position_side", "type", "status", "qty", "filled", "price", "stop_price", "updated_ms"}
+        self.fills = deque(maxlen=fills_memory)
+        self.ledger = None
+        self.live = False
+        self.syncing = False
+        self.pending = []
+        self.events = 0
+        self.reconciles = 0
+        self.last_event_ms = 0
+
+    # --- Читання ---
+    def position_qty(self, side: str) -> float:
+        for position_side, position in self.positions.items():
+            if position_side not in (side, "BOTH"):
+                continue
+            amt = position["amt"]
+            if side == "LONG" and amt > 0:
+                return amt
+            if side == "SHORT" and amt < 0:
+                return abs(amt)
+        return 0
+
+    def entry_price(self, side: str) -> float:
+        for position_side, position in self.positions.items():
+            if position_side in (side, "BOTH") and position["amt"] != 0:
+                return position["entry_price"]
+        return 0.0
+
+    def orders_for(self, position_side: str = None) -> list:
+        return [
+            {"orderId": order_id, **order}
+            for order_id, order in self.open_orders.items()
+            if position_side is None or order["position_side"] == position_side
+        ]
+
+    # --- Звірка з REST ---
+    def begin_sync(self):
+        self.syncing = True
+        self.pending = []
+
+    def apply_snapshot(self, positions: list, orders: list):
+        for p in positions:
+            self._set_position(
+                p["positionSide"], float(p["positionAmt"]), float(p["entryPrice"]),
+                float(p.get("unRealizedProfit", 0)), int(p.get("updateTime", 0))
+            )
+        snapshot_orders = {}
+        for o in orders:
+            order_id = o["orderId"]
+            known = self.open_orders.get(order_id)
+            updated_ms = int(o.get("updateTime", o.get("time", 0)))
+            if known and known["updated_ms"] > updated_ms:
+                snapshot_orders[order_id] = known
+                continue
+            snapshot_orders[order_id] = {
+                "side": o["side"],
+                "position_side": o["positionSide"],
+                "type": o["type"],
+                "status": o["status"],
+                "qty": float(o["origQty"]),
+                "filled": float(o["executedQty"]),
+                "price": float(o["price"]),
+                "stop_price": float(o.get("stopPrice", 0)),
+                "updated_ms": updated_ms,
+            }
+        self.open_orders = snapshot_orders
+
+        for msg in self.pending:
+            self._apply(msg)
+        self.pending = []
+        self.syncing = False
+        self.live = True
+        self.reconciles += 1
+
+    # --- Події ---
+    def handle(self, msg: dict):
+        self.events += 1
+        self.last_event_ms = time.time() * 1000
+        if self.syncing:
+            self.pending.append(msg)
+        else:
+            self._apply(msg)
+
+    def _apply(self, msg: dict):
+        event_type = msg.get("e")
+        if event_type == "ACCOUNT_UPDATE":
+            event_ms = msg.get("T", msg.get("E", 0))
+            for p in msg["a"].get("P", []):
+                if p["s"] == self.symbol:
+                    self._set_position(p["ps"], float(p["pa"]), float(p["ep"]), float(p.get("up", 0)), event_ms)
+        elif event_type == "ORDER_TRADE_UPDATE":
+            self._apply_order(msg["o"], msg.get("E", 0))
+
+    def _set_position(self, position_side: str, amt: float, entry_price: float, unrealized: float, updated_ms: int):
+        previous = self.positions.get(position_side)
+        if previous and previous["updated_ms"] > updated_ms:
+            return  # старіший стан, ніж уже відомий
+        self.positions[position_side] = {
+            "amt": amt, "entry_price": entry_price, "unrealized": unrealized, "updated_ms": updated_ms
+        }
+
+    def _apply_order(self, o: dict, event_ms: int):
+        if o["s"] != self.symbol:
+            return
+        updated_ms = o.get("T", event_ms)
+        order_id = o["i"]
+
+        if o["x"] == "TRADE":
+            fill = {
+                "order_id": order_id,
+                "trade_id": o.get("t"),
+                "side": o["S"],
+                "position_side": o["ps"],
+                "price": float(o["L"]),
+                "qty": float(o["l"]),
+                "commission": float(o.get("n", 0)),
+                "commission_asset": o.get("N"),
+                "realized_pnl": float(o.get("rp", 0)),
+                "time_ms": updated_ms,
+            }
+            self.fills.append(fill)
+            if self.ledger is not None:
+                self.ledger.add_fill(fill)
+
+        known = self.open_orders.get(order_id)
+        if known and known["updated_ms"] > updated_ms:
+            return
+        if o["X"] in ("NEW", "PARTIALLY_FILLED"):
+            self.open_orders[order_id] = {
+                "side": o["S"],
+                "position_side": o["ps"],
+                "type": o["o"],
+                "status": o["X"],
+                "qty": float(o["q"]),
+                "filled": float(o["z"]),
+                "price": float(o["p"]),
+                "stop_price": float(o.get("sp", 0)),
+                "updated_ms": updated_ms,
+            }
+        else:
+            self.open_orders.pop(order_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "live": self.live,
+            "syncing": self.syncing,
+            "events": self.events,
+            "reconciles": self.reconciles,
+            "last_event_age_s": round(time.time() - self.last_event_ms / 1000, 1) if self.last_event_ms else None,
+            "positions": {side: p["amt"] for side, p in self.positions.items()},
+            "open_orders": len(self.open_orders),
+            "fills": len(self.fills),
+        }
+
+
+# 📒 Журнал угод з фактичних виконань (append-only JSONL, індекс за orderId)
+class TradeLedger:
+    """
+    Кожне виконання пишеться один раз (дедуплікація за trade id) і потрапляє в індекс за orderId.
+    Виконання збираються в раунд-трипи по positionSide: коли позиція повертається в нуль,
+    раунд-трип фіксується з реалізованим PnL, комісіями і часом утримання.
+    Раунд-трипи, закриті після старту бота, кладуться в чергу round_trips; закриті під час
+    простою (з дозавантаження userTrades) — лише якщо їхній вхід ще відкритий у журналі угод.
+    В one-way режимі (BOTH) виконання, що перевертає позицію через нуль, закриває раунд-трип,
+    а залишок відкриває новий у протилежний бік.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_ms = time.time() * 1000
+        self.by_order = defaultdict(list)
+        self.trade_ids = set()
+        self.last_trade_id = 0
+        self.open_trips = {}   # positionSide → незавершений раунд-трип
+        self.completed = deque(maxlen=200)
+        self.round_trips = asyncio.Queue()
+        self.journal = None  # TradeJournal — чи чекає раунд-трип з простою на результат
+        self._load()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["kind"] == "fill":
+                        self._index_fill(record)
+                    else:
+                        self.completed.append(record)
+
+    def _append(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def add_fill(self, fill: dict):
+        """
+        fill: order_id, trade_id, side, position_side, price, qty, commission, commission_asset, realized_pnl, time_ms
+        """
+        if fill["trade_id"] in self.trade_ids:
+            return
+        record = {"kind": "fill", **fill}
+        self._append(record)
+        trip = self._index_fill(record)
+        if trip:
+            self._append(trip)
+            self.completed.append(trip)
+            if trip["closed_ms"] >= self.started_ms or self._awaits_result(trip):
+                self.round_trips.put_nowait(trip)
+
+    def _awaits_result(self, trip: dict) -> bool:
+        return self.journal is not None and any(o in self.journal.open_by_order for o in trip["order_ids"])
+
+    def _index_fill(self, fill: dict):
+        self.trade_ids.add(fill["trade_id"])
+        self.last_trade_id = max(self.last_trade_id, fill["trade_id"])
+        self.by_order[fill["order_id"]].append(fill)
+        return self._track_round_trip(fill)
+
+    def _track_round_trip(self, fill: dict):
+        position_side = fill["position_side"]
+        trip = self.open_trips.get(position_side)
+        if trip is None:
+            if position_side == "LONG" and fill["side"] == "SELL" or position_side == "SHORT" and fill["side"] == "BUY":
+                return None  # закриття позиції, відкритої до початку журналу
+            direction = position_side if position_side != "BOTH" else ("LONG" if fill["side"] == "BUY" else "SHORT")
+            trip = self.open_trips[position_side] = {
+                "side": direction, "qty": 0.0, "open_qty": 0.0, "entry_notional": 0.0,
+                "exit_qty": 0.0, "exit_notional": 0.0, "realized_pnl": 0.0, "fees": 0.0,
+                "opened_ms": fill["time_ms"], "order_ids": [],
+            }
+
+        opening = (trip["side"] == "LONG") == (fill["side"] == "BUY")
+        qty = fill["qty"] if opening else min(fill["qty"], trip["qty"])
+        excess = fill["qty"] - qty  # лише BOTH: частина, що відкриває протилежну позицію
+        if opening:
+            trip["qty"] += qty
+            trip["open_qty"] += qty
+            trip["entry_notional"] += fill["price"] * qty
+        else:
+            trip["qty"] -= qty
+            trip["exit_qty"] += qty
+            trip["exit_notional"] += fill["price"] * qty
+        trip["realized_pnl"] += fill["realized_pnl"]
+        if fill["commission_asset"] in (None, "USDT"):
+            trip["fees"] += fill["commission"] * qty / fill["qty"]
+        if fill["order_id"] not in trip["order_ids"]:
+            trip["order_ids"].append(fill["order_id"])
+
+        if trip["qty"] > 1e-9:
+            return None
+
+        del self.open_trips[position_side]
+        if excess > 1e-9:
+            self._track_round_trip({
+                **fill, "qty": excess, "realized_pnl": 0.0,
+                "commission": fill["commission"] * excess / fill["qty"],
+            })
+        net_pnl = trip["realized_pnl"] - trip["fees"]
+        return {
+            "kind": "round_trip",
+            "side": trip["side"],
+            "qty": round(trip["open_qty"], 8),
+            "entry_price": trip["entry_notional"] / trip["open_qty"],
+            "exit_price": trip["exit_notional"] / trip["exit_qty"],
+            "realized_pnl": round(trip["realized_pnl"], 4),
+            "fees": round(trip["fees"], 4),
+            "net_pnl": round(net_pnl, 4),
+            "result": "WIN" if net_pnl > 0 else "LOSS",
+            "opened_ms": trip["opened_ms"],
+            "closed_ms": fill["time_ms"],
+            "holding_seconds": round((fill["time_ms"] - trip["opened_ms"]) / 1000, 1),
+            "order_ids": trip["order_ids"],
+        }
+
+    def fills_for_order(self, order_id: int) -> list:
+        return self.by_order.get(order_id, [])
+
+    def stats(self) -> dict:
+        return {
+            "fills": len(self.trade_ids),
+            "last_trade_id": self.last_trade_id,
+            "open_round_trips": {side: round(trip["qty"], 8) for side, trip in self.open_trips.items()},
+            "last_round_trip": self.completed[-1] if self.completed else None,
+        }
+
+
+def parse_user_trade(t: dict) -> dict:
+    """
+    Рядок /fapi/v1/userTrades → формат виконання журналу.
+    """
+    return {
+        "order_id": t["orderId"],
+        "trade_id": t["id"],
+        "side": t["side"],
+        "position_side": t["positionSide"],
+        "price": float(t["price"]),
+        "qty": float(t["qty"]),
+        "commission": float(t["commission"]),
+        "commission_asset": t["commissionAsset"],
+        "realized_pnl": float(t["realizedPnl"]),
+        "time_ms": t["time"],
+    }
+
+
+async def fetch_user_trades(symbol: str, from_id: int = None) -> list:
+    """
+    Усі виконання після from_id (посторінково по 1000); без from_id — за останні LEDGER_BACKFILL_HOURS.
+    """
+    trades = []
+    if from_id is None:
+        start_ms = int((time.time() - CONFIG["LEDGER_BACKFILL_HOURS"] * 3600) * 1000)
+        page = await binance_client.futures_account_trades(symbol=symbol, startTime=start_ms, limit=1000)
+    else:
+        page = await binance_client.futures_account_trades(symbol=symbol, fromId=from_id, limit=1000)
+    while page:
+        trades.extend(page)
+        if len(page) < 1000:
+            break
+        page = await binance_client.futures_account_trades(symbol=symbol, fromId=page[-1]["id"] + 1, limit=1000)
+    return sorted(trades, key=lambda t: t["id"])
+
+
+async def fetch_account_snapshot(symbol: str) -> tuple:
+    return await asyncio.gather(
+        binance_client.futures_position_information(symbol=symbol),
+        binance_client.futures_get_open_orders(symbol=symbol)
+    )
+
+
+async def reconcile_account_mirror():
+    account_mirror.begin_sync()
+    positions, orders = await fetch_account_snapshot(account_mirror.symbol)
+    # Пропущені за час розриву виконання — до застосування буферизованих подій
+    from_id = trade_ledger.last_trade_id + 1 if trade_ledger.last_trade_id else None
+    for trade in await fetch_user_trades(account_mirror.symbol, from_id):
+        trade_ledger.add_fill(parse_user_trade(trade))
+    account_mirror.apply_snapshot(positions, orders)
+
+
+async def keepalive_listen_key(listen_key: str):
+    while True:
+        await asyncio.sleep(CONFIG["LISTEN_KEY_KEEPALIVE_SECONDS"])
+        await binance_client.futures_stream_keepalive(listenKey=listen_key)
+
+
+# 👤 Споживач user data stream: listenKey → WebSocket → дзеркало рахунку
+async def run_user_data_stream():
+    reconnect_delay = 5
+    while True:
+        keepalive_task = None
+        reconcile_task = None
+        try:
+            listen_key = await binance_client.futures_stream_get_listen_key()
+            async with websockets.connect(
+                f"wss://fstream.binance.com/ws/{listen_key}",
+                ping_interval=CONFIG["WS_PING_INTERVAL"],
+                ping_timeout=CONFIG["WS_PING_TIMEOUT"]
+            ) as websocket:
+                # Звірка стартує вже після підключення — події під час неї буферизуються
+                reconcile_task = asyncio.create_task(reconcile_account_mirror())
+                keepalive_task = asyncio.create_task(keepalive_listen_key(listen_key))
+
+                # Збій звірки чи keepalive закриває сокет одразу, не чекаючи наступної події рахунку
+                def close_on_failure(task: asyncio.Task):
+                    if not task.cancelled() and task.exception() is not None:
+                        asyncio.create_task(websocket.close())
+
+                reconcile_task.add_done_callback(close_on_failure)
+                keepalive_task.add_done_callback(close_on_failure)
+                send_message("✅ User data stream підключено")
+                reconnect_delay = 5
+
+                async for msg_raw in websocket:
+                    msg = json.loads(msg_raw)
+                    if msg.get("e") == "listenKeyExpired":
+                        raise RuntimeError("listenKey прострочений")
+                    account_mirror.handle(msg)
 
-        response = await asyncio.to_thread(
-            lambda: client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": (
-                        "Ти професійний скальпер. "
-                        "Вибери тільки одне: SKIP / NORMAL / BOOSTED. Додай дуже коротке пояснення."
-                    )},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3
-            )
-        )
+                for task in (reconcile_task, keepalive_task):
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
 
-        reply = response.choices[0].message.content.strip()
-        decision = reply.split()[0].upper()
+        except Exception as e:
+            send_message(f"⚠️ User data stream помилка: {e}. Перепідключення через {reconnect_delay} сек...")
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(60, reconnect_delay * 2)
+        finally:
+            account_mirror.live = False
+            account_mirror.syncing = False
+            for task in (keepalive_task, reconcile_task):
+                if task and not task.done():
+                    task.cancel()
 
-        if decision not in ["SKIP", "NORMAL", "BOOSTED"]:
-            decision = "SKIP"
-            reply = f"SKIP — невідома відповідь від GPT: {reply}"
 
-        return {
-            "decision": decision,
-            "reason": reply
-        }
+# 🕯️ Сховище свічок у памʼяті (стовпчикові NumPy-масиви)
+class KlineStore:
+    """
+    Свічки одного символу та інтервалу: один раз дозавантажуються через REST на старті,
+    далі оновлюються подіями @kline_<interval>. Кожне поле — окремий масив;
+    last(n) повертає зрізи-представлення без копіювання і без мережі.
+    Останній елемент — поточна (ще не закрита) свічка, як і у futures_klines.
+    """
 
-    except Exception as e:
+    INTERVAL_MS = {"1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "1h": 3_600_000}
+    FLOAT_COLUMNS = ("open", "high", "low", "close", "volume", "quote_volume", "taker_buy_volume")
+
+    def __init__(self, symbol: str, interval: str, capacity: int = 500):
+        self.symbol = symbol.upper()
+        self.interval = interval
+        self.interval_ms = self.INTERVAL_MS[interval]
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.last_closed = False
+        self.updated_at = 0.0
+        self.open_time = np.zeros(2 * capacity, dtype=np.int64)
+        self.trades = np.zeros(2 * capacity, dtype=np.int64)
+        self.columns = {name: np.zeros(2 * capacity) for name in self.FLOAT_COLUMNS}
+
+    def is_ready(self, n: int = 1) -> bool:
+        return self.count >= n
+
+    def load(self, rows: list):
+        """
+        Заповнення з відповіді futures_klines.
+        """
+        rows = rows[-self.capacity:]
+        self.start = 0
+        self.count = len(rows)
+        for i, r in enumerate(rows):
+            self.open_time[i] = r[0]
+            self.columns["open"][i] = float(r[1])
+            self.columns["high"][i] = float(r[2])
+            self.columns["low"][i] = float(r[3])
+            self.columns["close"][i] = float(r[4])
+            self.columns["volume"][i] = float(r[5])
+            self.columns["quote_volume"][i] = float(r[7])
+            self.trades[i] = r[8]
+            self.columns["taker_buy_volume"][i] = float(r[9])
+        self.last_closed = False
+        self.updated_at = time.time()
+
+    def _append_slot(self) -> int:
+        end = self.start + self.count
+        if end == len(self.open_time):
+            # Масив заповнено — переносимо останні capacity-1 свічок на початок (амортизовано O(1))
+            keep = self.capacity - 1
+            src = slice(end - keep, end)
+            self.open_time[:keep] = self.open_time[src]
+            self.trades[:keep] = self.trades[src]
+            for column in self.columns.values():
+                column[:keep] = column[src]
+            self.start, self.count, end = 0, keep, keep
+        elif self.count == self.capacity:
+            self.start += 1
+            self.count -= 1
+        self.count += 1
+        return end
+
+    def update(self, k: KlineUpdate) -> bool:
+        """
+        Застосовує подію свічки. False — якщо між свічками є розрив і треба перезавантаження.
+        """
+        if self.count:
+            last = self.start + self.count - 1
+            last_open = self.open_time[last]
+            if k.open_time < last_open:
+                return True  # застаріла подія
+            if k.open_time == last_open:
+                i = last
+            elif k.open_time == last_open + self.interval_ms:
+                i = self._append_slot()
+            else:
+                return False
+        else:
+            i = self._append_slot()
+
+        self.open_time[i] = k.open_time
+        self.columns["open"][i] = k.open
+        self.columns["high"][i] = k.high
+        self.columns["low"][i] = k.low
+        self.columns["close"][i] = k.close
+        self.columns["volume"][i] = k.volume
+        self.columns["quote_volume"][i] = k.quote_volume
+        self.trades[i] = k.trades
+        self.columns["taker_buy_volume"][i] = k.taker_buy_volume
+        self.last_closed = k.is_closed
+        self.updated_at = time.time()
+        return True
+
+    def last(self, n: int) -> dict:
+        """
+        Останні n свічок як словник стовпчиків (зрізи без копіювання).
+        """
+        if self.count < n:
+            raise RuntimeError(f"Свічки {self.symbol} {self.interval} ще не завантажені ({self.count}/{n})")
+        end = self.start + self.count
+        window = slice(end - n, end)
         return {
-            "decision": "SKIP",
-            "reason": f"GPT error: {e}"
+            "open_time": self.open_time[window],
+            "trades": self.trades[window],
+            **{name: column[window] for name, column in self.columns.items()},
         }
 
-# 📈 Розрахунок EMA за списком закриттів
-def calculate_ema(data: list[float], period: int = 20) -> float:
+
+def get_kline_store(symbol: str = "BTCUSDT", interval: str = "1m") -> KlineStore:
+    return kline_stores[(symbol.upper(), interval)]
+
+
+# 📈 Індикатори: пакетний режим (NumPy) для дозавантаження/реплею
+def ema_batch(values: np.ndarray, alpha: float, seed: float = None) -> np.ndarray:
     """
-    Розраховує EMA (Exponential Moving Average) для переданого списку закриттів.
+    EMA по всьому масиву без Python-циклу по елементах.
+    Рахується блоками по 64, щоб степені (1 - alpha) не зникали в нуль.
+    """
+    out = np.empty(len(values))
+    prev = values[0] if seed is None else seed
+    decay = 1 - alpha
+    for start in range(0, len(values), 64):
+        x = values[start:start + 64]
+        powers = decay ** np.arange(1, len(x) + 1)
+        out[start:start + len(x)] = powers * prev + alpha * powers * np.cumsum(x / powers)
+        prev = out[start + len(x) - 1]
+    return out
+
+
+def classify_candle(open_: float, high: float, low: float, close: float) -> tuple:
+    """
+    Напрямок і форма однієї свічки: хвіст / імпульс / звичайна.
+    """
+    body = abs(close - open_)
+    wick = (high - low) - body
+    direction = "🟢" if close > open_ else "🔴"
+    if wick > body * 1.5:
+        shape = "🐍 хвіст"
+    elif body > wick * 2:
+        shape = "🚀 імпульс"
+    else:
+        shape = "💤 звичайна"
+    return direction, shape
+
+
+def candle_shapes(candles: dict) -> tuple:
+    """
+    Векторизований classify_candle для стовпчиків зі KlineStore.last().
+    """
+    body = np.abs(candles["close"] - candles["open"])
+    wick = (candles["high"] - candles["low"]) - body
+    directions = np.where(candles["close"] > candles["open"], "🟢", "🔴")
+    shapes = np.where(wick > body * 1.5, "🐍 хвіст", np.where(body > wick * 2, "🚀 імпульс", "💤 звичайна"))
+    return directions, shapes
+
+
+def true_range_batch(candles: dict) -> np.ndarray:
+    high, low, close = candles["high"], candles["low"], candles["close"]
+    tr = high - low
+    prev_close = close[:-1]
+    tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(high[1:] - prev_close), np.abs(low[1:] - prev_close)))
+    return tr
+
+
+def indicator_series(candles: dict, ema_period: int, vwap_window: int, atr_period: int) -> dict:
+    """
+    EMA закриттів, ковзний VWAP (останні vwap_window свічок) і ATR (згладжування Вайлдера)
+    для кожної свічки масиву.
+    """
+    typical_price = (candles["high"] + candles["low"] + candles["close"]) / 3
+    cum_pv = np.cumsum(typical_price * candles["volume"])
+    cum_v = np.cumsum(candles["volume"])
+    cum_pv[vwap_window:] = cum_pv[vwap_window:] - cum_pv[:-vwap_window]
+    cum_v[vwap_window:] = cum_v[vwap_window:] - cum_v[:-vwap_window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vwap = np.where(cum_v > 0, cum_pv / cum_v, np.nan)
+    return {
+        "ema": ema_batch(candles["close"], 2 / (ema_period + 1)),
+        "vwap": vwap,
+        "atr": ema_batch(true_range_batch(candles), 1 / atr_period),
+    }
+
+
+# 📈 Індикатори: інкрементальний режим O(1) на кожну подію свічки
+class IndicatorEngine:
+    """
+    Стан індикаторів після останньої закритої свічки + поточна свічка, що формується.
+    Закриті свічки фіксуються в стані; часткові лише підставляються у живі значення.
     """
-    ema: float = data[0]
-    k: float = 2 / (period + 1)
-    for price in data[1:]:
-        ema = price * k + ema * (1 - k)
-    return ema
-    # 🧭 Визначення тренду за EMA (5m, 20 періодів)
-def get_ema_trend(symbol: str = "BTCUSDT", period: int = 20) -> str:
-    try:
-        klines = binance_client.futures_klines(symbol=symbol, interval="5m", limit=100)
-        closes = [float(k[4]) for k in klines]
-        ema = calculate_ema(closes[-period:])
-        current_price = closes[-1]
 
-        if current_price > ema:
+    def __init__(self, ema_period: int = 20, vwap_window: int = 20, atr_period: int = 14):
+        self.ema_period = ema_period
+        self.vwap_window = vwap_window
+        self.atr_period = atr_period
+        self.k = 2 / (ema_period + 1)
+        self.ready = False
+        self.committed_open_time = 0
+        self.ema_committed = 0.0
+        self.atr_committed = 0.0
+        self.prev_close = 0.0
+        self.vwap_parts = deque()
+        self.sum_pv = 0.0
+        self.sum_v = 0.0
+        self.current = None  # (open_time, open, high, low, close, volume)
+
+    def backfill(self, candles: dict):
+        """
+        Пакетний перерахунок по історії (останній елемент — поточна свічка).
+        """
+        n = len(candles["close"])
+        if n < 2:
+            self.ready = False
+            return
+        series = indicator_series(candles, self.ema_period, self.vwap_window, self.atr_period)
+        self.committed_open_time = int(candles["open_time"][-2])
+        self.ema_committed = float(series["ema"][-2])
+        self.atr_committed = float(series["atr"][-2])
+        self.prev_close = float(candles["close"][-2])
+
+        start = max(0, n - 1 - self.vwap_window)
+        typical_price = (candles["high"][start:-1] + candles["low"][start:-1] + candles["close"][start:-1]) / 3
+        self.vwap_parts = deque(zip((typical_price * candles["volume"][start:-1]).tolist(), candles["volume"][start:-1].tolist()))
+        self.sum_pv = sum(pv for pv, _ in self.vwap_parts)
+        self.sum_v = sum(v for _, v in self.vwap_parts)
+
+        self.current = tuple(float(candles[name][-1]) for name in ("open_time", "open", "high", "low", "close", "volume"))
+        self.ready = True
+
+    def update(self, k: KlineUpdate):
+        if not self.ready or k.open_time <= self.committed_open_time:
+            return
+        if self.current is not None and self.current[0] < k.open_time:
+            self._commit(self.current)  # подію закриття пропущено — фіксуємо останній відомий стан
+        self.current = (k.open_time, k.open, k.high, k.low, k.close, k.volume)
+        if k.is_closed:
+            self._commit(self.current)
+            self.current = None
+
+    def _true_range(self, high: float, low: float) -> float:
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def _commit(self, candle: tuple):
+        open_time, _, high, low, close, volume = candle
+        self.ema_committed += self.k * (close - self.ema_committed)
+        self.atr_committed += (self._true_range(high, low) - self.atr_committed) / self.atr_period
+        self.prev_close = close
+
+        pv = (high + low + close) / 3 * volume
+        self.vwap_parts.append((pv, volume))
+        self.sum_pv += pv
+        self.sum_v += volume
+        while len(self.vwap_parts) > self.vwap_window:
+            old_pv, old_v = self.vwap_parts.popleft()
+            self.sum_pv -= old_pv
+            self.sum_v -= old_v
+        self.committed_open_time = int(open_time)
+
+    @property
+    def close(self) -> float:
+        return self.current[4] if self.current else self.prev_close
+
+    @property
+    def ema(self) -> float:
+        if self.current is None:
+            return self.ema_committed
+        return self.ema_committed + self.k * (self.current[4] - self.ema_committed)
+
+    @property
+    def atr(self) -> float:
+        if self.current is None:
+            return self.atr_committed
+        return self.atr_committed + (self._true_range(self.current[2], self.current[3]) - self.atr_committed) / self.atr_period
+
+    @property
+    def vwap(self):
+        sum_pv, sum_v = self.sum_pv, self.sum_v
+        if self.current is not None:
+            # Поточна свічка витісняє найстарішу закриту з вікна
+            _, _, high, low, close, volume = self.current
+            sum_pv += (high + low + close) / 3 * volume
+            sum_v += volume
+            if len(self.vwap_parts) == self.vwap_window:
+                sum_pv -= self.vwap_parts[0][0]
+                sum_v -= self.vwap_parts[0][1]
+        return sum_pv / sum_v if sum_v > 0 else None
+
+    def trend(self) -> str:
+        if self.close > self.ema:
             return "LONG"
-        elif current_price < ema:
+        if self.close < self.ema:
             return "SHORT"
-        else:
-            return "NONE"
-    except Exception as e:
-        send_message(f"❌ EMA trend error: {e}")
         return "NONE"
 
+    def shape(self) -> tuple:
+        if self.current is None:
+            return None
+        return classify_candle(*self.current[1:5])
 
+    def snapshot(self) -> dict:
+        if not self.ready:
+            return {"ready": False}
+        return {
+            "ready": True,
+            "close": self.close,
+            "ema": round(self.ema, 2),
+            "vwap": round(self.vwap, 2) if self.vwap else None,
+            "atr": round(self.atr, 2),
+            "trend": self.trend(),
+        }
 
-# 🧱 Отримання snapshot order book (стіни покупців і продавців)
-def get_orderbook_snapshot(symbol="BTCUSDT", depth=50):
-    try:
-        depth_data = binance_client.futures_order_book(symbol=symbol, limit=depth)
-        bids = depth_data["bids"]
-        asks = depth_data["asks"]
 
-        max_bid = max(float(b[1]) for b in bids)
-        max_ask = max(float(a[1]) for a in asks)
+def get_indicators(symbol: str = "BTCUSDT", interval: str = "1m") -> IndicatorEngine:
+    engine = indicator_engines[(symbol.upper(), interval)]
+    if not engine.ready:
+        raise RuntimeError(f"Індикатори {symbol} {interval} ще не розраховані")
+    return engine
+
 
-        bid_wall = next((b for b in bids if float(b[1]) > max_bid * 0.7), None)
-        ask_wall = next((a for a in asks if float(a[1]) > max_ask * 0.7), None)
+# 🕯️ Підтримка сховища свічок: REST-дозавантаження + потік @kline
+async def maintain_kline_store(store: KlineStore, queue: BoundedEventQueue, indicators: IndicatorEngine):
+    while True:
+        try:
+            rows = await binance_client.futures_klines(
+                symbol=store.symbol, interval=store.interval, limit=store.capacity
+            )
+            store.load(rows)
+            indicators.backfill(store.last(store.count))
+            print(f"🕯️ Свічки {store.symbol} {store.interval} завантажено: {store.count}")
+
+            while True:
+                event = await queue.get()
+                if not store.update(event):
+                    send_message(f"⚠️ Розрив у свічках {store.symbol} {store.interval} — перезавантаження")
+                    break
+                indicators.update(event)
+        except Exception as e:
+            send_message(f"❌ Kline store error ({store.interval}): {e}")
+            await asyncio.sleep(5)
 
-        text = ""
-        if ask_wall:
-            text += f"🟥 Sell wall: {ask_wall[0]} ({round(float(ask_wall[1]), 1)} BTC)\n"
-        if bid_wall:
-            text += f"🟦 Buy wall: {bid_wall[0]} ({round(float(bid_wall[1]), 1)} BTC)\n"
 
-        return text.strip() or "⚠️ Стін не знайдено"
-    except Exception as e:
-        send_message(f"❌ Orderbook error: {e}")
-        return "⚠️ Дані про стіни недоступні"
-# 📡 Моніторинг кластерів через WebSocket
-# 🔁 Перевірка чи пройшов cooldown
-def is_cooldown_ready():
-    now = time.time()
-    return now - last_trade_time >= CONFIG["COOLDOWN_SECONDS"]
+# 🧊 Незмінний знімок закритого кластерного вікна
+class ClusterWindow(NamedTuple):
+    start: float
+    end: float
+    strongest_bucket: float
+    total_buy: float
+    total_sell: float
+    buy_volume: float
+    sell_volume: float
+    profiles: dict
+    session: dict
 
-# ⏳ Оновлення cooldown таймера
-def update_cooldown():
-    global last_trade_time
-    last_trade_time = time.time()
 
-# 📈 Отримання кількості відкритої позиції
-def get_current_position_qty(side):
-    try:
-        positions = binance_client.futures_position_information(symbol="BTCUSDT")
-        for p in positions:
-            amt = float(p["positionAmt"])
-            if side == "LONG" and amt > 0:
-                return amt
-            elif side == "SHORT" and amt < 0:
-                return abs(amt)
-        return 0
-    except Exception as e:
-        send_message(f"❌ Position qty error: {e}")
-        return 0
+def make_cluster_window(profiles: dict, start: float, end: float) -> ClusterWindow | None:
+    """
+    Формує знімок вікна: найсильніший бакет основної роздільності (CLUSTER_BUCKET_SIZE),
+    обʼєми CVD за останні 5 секунд, профілі всіх роздільностей і рівні сесії.
+    Профілі після rotate_window більше ніхто не змінює. Повертає None, якщо угод не було.
+    """
+    strongest = profiles[CONFIG["CLUSTER_BUCKET_SIZE"]].strongest()
+    if strongest is None:
+        return None
+    recent = cvd_engine.window(5)
+    return ClusterWindow(
+        start=start,
+        end=end,
+        strongest_bucket=strongest[0],
+        total_buy=strongest[1],
+        total_sell=strongest[2],
+        buy_volume=recent["buy"],
+        sell_volume=recent["sell"],
+        profiles=profiles,
+        session=footprint.session_levels()
+    )
+
+
+# 🦶 Короткий текст footprint вікна для GPT
+def describe_footprint(window: ClusterWindow) -> str:
+    lines = []
+    for size, profile in window.profiles.items():
+        strongest = profile.strongest()
+        if strongest:
+            lines.append(f"{size}$: {strongest[0]:.0f} (Buy {strongest[1]:.1f} / Sell {strongest[2]:.1f})")
+    session = window.session
+    if session["poc"] is not None:
+        lines.append(f"Сесія: POC {session['poc']:.0f}, VA {session['val']:.0f}–{session['vah']:.0f}")
+    return "\n".join(lines)
 
-# 🧹 Перевірка чи є відкрита позиція
-def has_open_position(side):
-    try:
-        positions = binance_client.futures_position_information(symbol="BTCUSDT")
-        for p in positions:
-            qty = float(p["positionAmt"])
-            if side == "LONG" and qty > 0:
-                return True
-            elif side == "SHORT" and qty < 0:
-                return True
-        return False
-    except Exception as e:
-        send_message(f"❌ Position check error: {e}")
-        return False
 
 # 📡 Основний моніторинг кластерних сигналів
 async def monitor_cluster_trades():
-    global cluster_last_reset, cluster_is_processing, last_ws_error_time, last_skip_message_time
+    """
+    Споживач кластерного аналізу: читає угоди з aggtrade_queue (див. MarketStreamHub)
+    і лише наповнює footprint. Оцінка сигналу — в evaluate_cluster_signals.
+    """
+    while True:
+        try:
+            trade = await aggtrade_queue.get()
 
-    uri_list = [
-        "wss://fstream.binance.com/ws/btcusdt@aggTrade",
-        "wss://fstream1.binance.com/ws/btcusdt@aggTrade",
-        "wss://fstream2.binance.com/ws/btcusdt@aggTrade"
-    ]
-    current_uri_index = 0
+            footprint.add(trade.price, trade.qty, trade.is_sell, trade.T)
+            mark_state_fresh("trades")
 
-    reconnect_delay = 5
-    error_counter = 0
-    last_skip_message_time = 0
+        except Exception as e:
+            send_message(f"⚠️ Cluster monitor error: {e}")
+            await asyncio.sleep(1)
+
+
+# ⏲️ Закриття кластерних вікон строго по межах CLUSTER_INTERVAL
+async def close_cluster_windows():
+    """
+    На кожній межі вікна (кратній CLUSTER_INTERVAL) атомарно підміняє профілі footprint
+    новими і публікує знімок для оцінювача. Якщо оцінювач ще зайнятий,
+    незабраний знімок замінюється свіжішим — рішення завжди приймаються по останньому вікну.
+    """
+    global cluster_last_reset, latest_cluster_window, cluster_windows_skipped
+    interval = CONFIG["CLUSTER_INTERVAL"]
 
     while True:
         try:
-            uri = uri_list[current_uri_index]
-            async with websockets.connect(uri, ping_interval=None) as websocket:
-                send_message(f"✅ Підключено до WebSocket: {uri}")
-                reconnect_delay = 5
-                error_counter = 0
+            now = time.time()
+            boundary = (now // interval + 1) * interval
+            await asyncio.sleep(boundary - now)
 
-                last_impulse = {"side": None, "volume": 0, "timestamp": 0}
-                trade_buffer = []
-                buffer_duration = 5
+            window = make_cluster_window(footprint.rotate_window(), cluster_last_reset, boundary)
+            cluster_last_reset = boundary
 
-                while True:
-                    msg_raw = await websocket.recv()
-                    msg = json.loads(msg_raw)
-                    await asyncio.sleep(0.01)
+            if window is None:
+                continue
+            if latest_cluster_window is not None:
+                cluster_windows_skipped += 1
+            latest_cluster_window = window
+            cluster_window_ready.set()
+        except Exception as e:
+            send_message(f"⚠️ Cluster window error: {e}")
+            await asyncio.sleep(1)
 
-                    price = float(msg['p'])
-                    qty = float(msg['q'])
-                    is_sell = msg['m']
-                    timestamp = time.time()
 
-                    trade_buffer.append({
-                        "price": price,
-                        "qty": qty,
-                        "is_sell": is_sell,
-                        "timestamp": timestamp
-                    })
+# 🧠 Оцінювач кластерних сигналів (окремо від приймання угод)
+async def evaluate_cluster_signals():
+    global latest_cluster_window, cluster_is_processing
+    while True:
+        await cluster_window_ready.wait()
+        cluster_window_ready.clear()
+        window = latest_cluster_window
+        latest_cluster_window = None
+        if window is None:
+            continue
+
+        cluster_is_processing = True
+        try:
+            await evaluate_cluster_window(window)
+        except Exception as e:
+            send_message(f"⚠️ Cluster evaluation error: {e}")
+        finally:
+            cluster_is_processing = False
 
-                    trade_buffer = [t for t in trade_buffer if timestamp - t["timestamp"] <= buffer_duration]
 
-                    bucket = round(price / CONFIG["CLUSTER_BUCKET_SIZE"]) * CONFIG["CLUSTER_BUCKET_SIZE"]
-                    if is_sell:
-                        cluster_data[bucket]['sell'] += qty
-                    else:
-                        cluster_data[bucket]['buy'] += qty
+async def evaluate_cluster_window(window: ClusterWindow):
+    """
+    Повний шлях рішення по одному закритому вікну: GPT-аналіз свічок, класифікація
+    сигналу, фільтри, контекст і відкриття позиції. Блокуючі виклики (новини, GPT) йдуть у потоки.
+    """
+    global last_impulse, last_skip_message_time
+
+    # 🧊 Не торгуємо на застарілих стінах/дельті/угодах
+    if refuse_stale_inputs("trades", "walls", "delta"):
+        return
+
+    now = window.end
+    strongest_bucket = window.strongest_bucket
+    total_buy = window.total_buy
+    total_sell = window.total_sell
+
+    gpt_candle_result = await analyze_candle_gpt(
+        vwap=cached_vwap,
+        cluster_buy=total_buy,
+        cluster_sell=total_sell
+    )
+
+    if gpt_candle_result["decision"] == "SKIP":
+        reason = gpt_candle_result.get("reason", "немає пояснення")
+        if now - last_skip_message_time > 300:
+            send_message(f"🚫 SKIP — {reason}")
+            last_skip_message_time = now
+        return
+
+    buy_volume = window.buy_volume
+    sell_volume = window.sell_volume
+    buy_ratio = (buy_volume / (buy_volume + sell_volume)) * 100 if (buy_volume + sell_volume) > 0 else 0
+    sell_ratio = 100 - buy_ratio
+
+    signal = None
+    if buy_ratio >= CONFIG["SUPER_BOOST_RATIO"] and total_buy >= CONFIG["SUPER_BOOST_VOLUME"]:
+        signal = "SUPER_BOOSTED_LONG"
+    elif sell_ratio >= CONFIG["SUPER_BOOST_RATIO"] and total_sell >= CONFIG["SUPER_BOOST_VOLUME"]:
+        signal = "SUPER_BOOSTED_SHORT"
+    elif total_buy >= CONFIG["BOOST_THRESHOLD"]:
+        signal = "BOOSTED_LONG"
+    elif total_sell >= CONFIG["BOOST_THRESHOLD"]:
+        signal = "BOOSTED_SHORT"
+
+    if signal is None and (total_buy > CONFIG["MIN_CLUSTER_ALERT"] or total_sell > CONFIG["MIN_CLUSTER_ALERT"]):
+        send_message(f"📊 Кластер {strongest_bucket} → Buy: {round(total_buy)}, Sell: {round(total_sell)} | Не BOOSTED")
+        if total_sell > total_buy and total_sell >= CONFIG["ALT_BOOST_THRESHOLD"]:
+            signal = "BOOSTED_SHORT"
+        elif total_buy > total_sell and total_buy >= CONFIG["ALT_BOOST_THRESHOLD"]:
+            signal = "BOOSTED_LONG"
+
+    if not signal:
+        return
+
+    if last_impulse["side"] == "BUY" and signal.startswith("SHORT") and \
+       last_impulse["volume"] >= CONFIG["IMPULSE_VOLUME_MIN"] and now - last_impulse["timestamp"] < CONFIG["RECENT_IMPULSE_TIMEOUT"]:
+        send_message("⏳ Відхилено SHORT — щойно був великий BUY")
+        signal = None
+
+    if signal and last_impulse["side"] == "SELL" and signal.startswith("LONG") and \
+       last_impulse["volume"] >= CONFIG["IMPULSE_VOLUME_MIN"] and now - last_impulse["timestamp"] < CONFIG["RECENT_IMPULSE_TIMEOUT"]:
+        send_message("⏳ Відхилено LONG — щойно був великий SELL")
+        signal = None
+
+    if not signal:
+        return
+
+    if signal in ["BOOSTED_LONG", "SUPER_BOOSTED_LONG"]:
+        last_impulse = {"side": "BUY", "volume": total_buy, "timestamp": now}
+    elif signal in ["BOOSTED_SHORT", "SUPER_BOOSTED_SHORT"]:
+        last_impulse = {"side": "SELL", "volume": total_sell, "timestamp": now}
+
+    # 🔥 Фільтрація кластерів по обʼєму
+    if total_buy < 60 and total_sell < 60:
+        send_message("⚪ Кластер має малий обʼєм — пропущено.")
+        return
+
+    # 🚫 Якщо стіни на боці сигналу систематично знімають — SKIP
+    support_side = "bid" if "LONG" in signal else "ask"
+    spoof_score = wall_tracker.spoof_score(support_side)
+    if spoof_score >= CONFIG["SPOOF_SCORE_SKIP"]:
+        send_message(f"🚫 Сигнал {signal} пропущено через фейкові {support_side}-стіни (спуф-скор {spoof_score:.2f}).")
+        return
+
+    oi = cached_oi
+    volume = cached_volume
+    # 🧭 Новини, свічки і стіни збираються, поки wait_for_continuation чекає руху ціни;
+    # при SKIP зібране лише оновлює кеш джерел для наступного сигналу
+    context_task = asyncio.create_task(context_gatherer.gather("news", "candles", "walls"))
+    # 📈 Перевірка, чи є реальний рух після кластера (до CONTINUATION_WINDOW_SECONDS)
+    try:
+        threshold = CONFIG["CONTINUATION_PCT"]
+        if "LONG" in signal:
+            price_change = await wait_for_continuation("LONG", threshold, CONFIG["CONTINUATION_WINDOW_SECONDS"])
+            if price_change < threshold:
+                send_message("⚪ LONG кластер без продовження руху — SKIP.")
+                return
 
-                    now = time.time()
+        if "SHORT" in signal:
+            price_change = await wait_for_continuation("SHORT", threshold, CONFIG["CONTINUATION_WINDOW_SECONDS"])
+            if price_change > -threshold:
+                send_message("⚪ SHORT кластер без продовження руху — SKIP.")
+                return
 
-                    if now - cluster_last_reset >= CONFIG["CLUSTER_INTERVAL"] and not cluster_is_processing:
-                        cluster_is_processing = True
+    except Exception as e:
+        send_message(f"❌ Помилка при перевірці руху після кластера: {e}")
 
-                        strongest_bucket = max(cluster_data.items(), key=lambda x: x[1]["buy"] + x[1]["sell"])
-                        total_buy = strongest_bucket[1]["buy"]
-                        total_sell = strongest_bucket[1]["sell"]
+    context, report = await context_task
+    report_late_context(report)
+    news, candles, walls = context["news"], context["candles"], context["walls"]
 
-                        gpt_candle_result = await analyze_candle_gpt(
-                            vwap=cached_vwap,
-                            cluster_buy=total_buy,
-                            cluster_sell=total_sell
-                        )
+    decision = await ask_gpt_trade_with_all_context(
+        signal,
+        f"Кластери: Buy {buy_ratio:.1f}%, Sell {sell_ratio:.1f}%\n{describe_footprint(window)}\n\nСвічки:\n{candles}\n\nСтіни:\n{walls}\n\n{news}",
+        oi, 0, volume
+    )
 
-                        if gpt_candle_result["decision"] == "SKIP":
-                            reason = gpt_candle_result.get("reason", "немає пояснення")
-                            if now - last_skip_message_time > 300:
-                                send_message(f"🚫 SKIP — {reason}")
-                                last_skip_message_time = now
-
-                            cluster_data.clear()
-                            cluster_last_reset = now
-                            cluster_is_processing = False
-                            await asyncio.sleep(1)
-                            continue
-
-                        buy_volume = sum(t["qty"] for t in trade_buffer if not t["is_sell"])
-                        sell_volume = sum(t["qty"] for t in trade_buffer if t["is_sell"])
-                        buy_ratio = (buy_volume / (buy_volume + sell_volume)) * 100 if (buy_volume + sell_volume) > 0 else 0
-                        sell_ratio = 100 - buy_ratio
-
-                        signal = None
-                        if buy_ratio >= CONFIG["SUPER_BOOST_RATIO"] and total_buy >= CONFIG["SUPER_BOOST_VOLUME"]:
-                            signal = "SUPER_BOOSTED_LONG"
-                        elif sell_ratio >= CONFIG["SUPER_BOOST_RATIO"] and total_sell >= CONFIG["SUPER_BOOST_VOLUME"]:
-                            signal = "SUPER_BOOSTED_SHORT"
-                        elif total_buy >= CONFIG["BOOST_THRESHOLD"]:
-                            signal = "BOOSTED_LONG"
-                        elif total_sell >= CONFIG["BOOST_THRESHOLD"]:
-                            signal = "BOOSTED_SHORT"
-
-                        if signal is None and (total_buy > CONFIG["MIN_CLUSTER_ALERT"] or total_sell > CONFIG["MIN_CLUSTER_ALERT"]):
-                            send_message(f"📊 Кластер {strongest_bucket[0]} → Buy: {round(total_buy)}, Sell: {round(total_sell)} | Не BOOSTED")
-                            if total_sell > total_buy and total_sell >= CONFIG["ALT_BOOST_THRESHOLD"]:
-                                signal = "BOOSTED_SHORT"
-                            elif total_buy > total_sell and total_buy >= CONFIG["ALT_BOOST_THRESHOLD"]:
-                                signal = "BOOSTED_LONG"
-
-                        if signal:
-                            if last_impulse["side"] == "BUY" and signal.startswith("SHORT") and \
-                               last_impulse["volume"] >= CONFIG["IMPULSE_VOLUME_MIN"] and now - last_impulse["timestamp"] < CONFIG["RECENT_IMPULSE_TIMEOUT"]:
-                                send_message("⏳ Відхилено SHORT — щойно був великий BUY")
-                                signal = None
-
-                            if last_impulse["side"] == "SELL" and signal.startswith("LONG") and \
-                               last_impulse["volume"] >= CONFIG["IMPULSE_VOLUME_MIN"] and now - last_impulse["timestamp"] < CONFIG["RECENT_IMPULSE_TIMEOUT"]:
-                                send_message("⏳ Відхилено LONG — щойно був великий SELL")
-                                signal = None
-
-                            if signal:
-                                if signal in ["BOOSTED_LONG", "SUPER_BOOSTED_LONG"]:
-                                    last_impulse = {"side": "BUY", "volume": total_buy, "timestamp": now}
-                                elif signal in ["BOOSTED_SHORT", "SUPER_BOOSTED_SHORT"]:
-                                    last_impulse = {"side": "SELL", "volume": total_sell, "timestamp": now}
-
-                                # 🔥 Фільтрація кластерів по обʼєму
-                                if total_buy < 60 and total_sell < 60:
-                                    send_message("⚪ Кластер має малий обʼєм — пропущено.")
-                                    cluster_data.clear()
-                                    cluster_last_reset = time.time()
-                                    cluster_is_processing = False
-                                    await asyncio.sleep(1)
-                                    continue
-                                    # 🚫 Якщо виявлено фейкову стіну — SKIP
-                                    if fake_wall_detected:
-                                        send_message("🚫 Сигнал пропущено через фейкову стіну.")
-                                        cluster_data.clear()
-                                        cluster_last_reset = time.time()
-                                        cluster_is_processing = False
-                                        fake_wall_detected = False  # скидаємо прапор
-                                        await asyncio.sleep(1)
-                                        continue
-
-
-
-                                news = get_latest_news()
-                                oi = cached_oi
-                                volume = cached_volume
-                                candles = get_candle_summary("BTCUSDT")
-                                walls = get_orderbook_snapshot("BTCUSDT")
-                                # 📈 Перевірка, чи є реальний рух після кластера
-                                try:
-                                    entry_price: float = float(binance_client.futures_mark_price(symbol="BTCUSDT")["markPrice"])
-                                    await asyncio.sleep(5)  # даємо ринку 5 сек
-                                    exit_price: float = float(binance_client.futures_mark_price(symbol="BTCUSDT")["markPrice"])
-                                    price_change: float = (exit_price - entry_price) / entry_price * 100
-                                
-                                    if signal.startswith("LONG") and price_change < 0.05:
-                                        send_message("⚪ LONG кластер без продовження руху — SKIP.")
-                                        cluster_data.clear()
-                                        cluster_last_reset = time.time()
-                                        cluster_is_processing = False
-                                        await asyncio.sleep(1)
-                                        continue
-                                
-                                    if signal.startswith("SHORT") and price_change > -0.05:
-                                        send_message("⚪ SHORT кластер без продовження руху — SKIP.")
-                                        cluster_data.clear()
-                                        cluster_last_reset = time.time()
-                                        cluster_is_processing = False
-                                        await asyncio.sleep(1)
-                                        continue
-                                
-                                except Exception as e:
-                                    send_message(f"❌ Помилка при перевірці руху після кластера: {e}")
-
-                                decision = await ask_gpt_trade_with_all_context(
-                                    signal,
-                                    f"Кластери: Buy {buy_ratio:.1f}%, Sell {sell_ratio:.1f}%\n\nСвічки:\n{candles}\n\nСтіни:\n{walls}\n\n{news}",
-                                    oi, 0, volume
-                                )
-
-                                send_message(f"💥 {signal} — кластер {strongest_bucket[0]} | Buy: {round(total_buy)}, Sell: {round(total_sell)}")
-                                send_message(f"🤖 GPT кластер: {decision}")
-
-                                if decision in ["LONG", "BOOSTED_LONG", "SUPER_BOOSTED_LONG"]:
-                                    if not has_open_position("LONG") and is_cooldown_ready():
-                                        await place_long("BTCUSDT", current_stake_usd)
-                                        update_cooldown()
-                                elif decision in ["SHORT", "BOOSTED_SHORT", "SUPER_BOOSTED_SHORT"]:
-                                    if not has_open_position("SHORT") and is_cooldown_ready():
-                                        await place_short("BTCUSDT", current_stake_usd)
-                                        update_cooldown()
-
-                        cluster_data.clear()
-                        cluster_last_reset = now
-                        cluster_is_processing = False
+    send_message(f"💥 {signal} — кластер {strongest_bucket} | Buy: {round(total_buy)}, Sell: {round(total_sell)}")
+    send_message(f"🤖 GPT кластер: {decision}")
 
-        except Exception as e:
-            error_counter += 1
-            reconnect_delay = min(60, reconnect_delay * 2)
-            current_uri_index = (current_uri_index + 1) % len(uri_list)
+    if decision in ["LONG", "BOOSTED_LONG", "SUPER_BOOSTED_LONG"]:
+        if not await has_open_position("LONG") and is_cooldown_ready():
+            await place_long("BTCUSDT", current_stake_usd)
+            update_cooldown()
+    elif decision in ["SHORT", "BOOSTED_SHORT", "SUPER_BOOSTED_SHORT"]:
+        if not await has_open_position("SHORT") and is_cooldown_ready():
+            await place_short("BTCUSDT", current_stake_usd)
+            update_cooldown()
 
-            if error_counter > 5:
-                send_message(f"❌ Занадто багато помилок WebSocket підряд ({error_counter}). Бот призупинено на 5 хвилин.")
-                await asyncio.sleep(300)
-                error_counter = 0
-                reconnect_delay = 5
-            else:
-                send_message(f"⚠️ WebSocket помилка: {e}. Перемикаємо сервер. Перепідключення через {reconnect_delay} сек...")
-                await asyncio.sleep(reconnect_delay)
 
 
+# ⚡ Виконання ордерів: вхід + TP + SL одним batchOrders, скасування пачками
+class OrderExecutor:
+    """
+    Вхід, тейк і стоп відправляються одним запитом, тож позиція не лишається без стопа
+    кілька RTT. Латентність міряється лише локальним годинником: RTT усього запиту,
+    повторних спроб ніг і скасувань (updateTime біржі з іншого годинника не порівнюється).
+    Часткова відмова: без входу — скасовуємо TP/SL; без TP або SL — одна повторна
+    спроба ноги, інакше позиція негайно закривається.
+    Payload обох сторін переозброюється на кожному тіку ціни (arm) з округленням
+    до LOT_SIZE / PRICE_FILTER, тож від рішення до відправки лишається лише підпис запиту.
+    """
 
-# 🧰 Скасування існуючого стоп-ордеру для сторони
-def cancel_existing_orders(side):
-    try:
-        orders = binance_client.futures_get_open_orders(symbol=CONFIG["SYMBOL"])
-        for o in orders:
-            if o["positionSide"] == side and o["type"] in ["STOP_MARKET", "TAKE_PROFIT_MARKET"]:
-                binance_client.futures_cancel_order(symbol=CONFIG["SYMBOL"], orderId=o["orderId"])
-    except Exception as e:
-        send_message(f"❌ Cancel order error ({side}): {e}")
+    LEGS = ("entry", "tp", "sl")
+    CANCEL_BATCH = 10  # ліміт orderIdList у DELETE /fapi/v1/batchOrders
+
+    def __init__(self, symbol: str, latency_memory: int = 100):
+        self.symbol = symbol.upper()
+        self.latency = defaultdict(lambda: deque(maxlen=latency_memory))
+        self.brackets = 0
+        self.partial_failures = 0
+        self.retried_legs = 0
+        self.flattened = 0
+        self.filters = None
+        self.armed = {"LONG": None, "SHORT": None}
+
+    async def load_filters(self):
+        self.filters = await get_symbol_filters(self.symbol)
+
+    def build_bracket(self, side: str, price: float, stake_usd: float) -> dict:
+        """
+        Готовий до відправки bracket: кількість вниз до stepSize, TP/SL до tickSize.
+        None — якщо обсяг менший за minQty / minNotional.
+        """
+        f = self.filters
+        qty = self.floor_qty(stake_usd / price)
+        if qty < f["min_qty"] or qty * price < f["min_notional"]:
+            return None
+        qty_text = self.format_qty(qty)
+        tp_text = self.format_price(price * CONFIG["TP_SL"][side]["TP"])
+        sl_text = self.format_price(price * CONFIG["TP_SL"][side]["SL"])
+
+        open_side = "BUY" if side == "LONG" else "SELL"
+        close_side = "SELL" if side == "LONG" else "BUY"
+        protective = {"symbol": self.symbol, "side": close_side, "closePosition": "true", "timeInForce": "GTC", "positionSide": side}
+        return {
+            "side": side,
+            "entry": price,
+            "qty": float(qty_text),
+            "tp": float(tp_text),
+            "sl": float(sl_text),
+            "stake_usd": stake_usd,
+            "armed_ms": time.time() * 1000,
+            "legs": [
+                {"symbol": self.symbol, "side": open_side, "type": "MARKET", "quantity": qty_text, "positionSide": side},
+                {**protective, "type": "TAKE_PROFIT_MARKET", "stopPrice": tp_text},
+                {**protective, "type": "STOP_MARKET", "stopPrice": sl_text},
+            ],
+        }
 
-# 🛡️ Спрощене супроводження трейлінг-стопів і часткових закриттів
+    def floor_qty(self, qty: float) -> float:
+        step = self.filters["step_size"]
+        return math.floor(qty / step + 1e-9) * step
 
-        # 📡 Моніторинг змін у стакані ордерів Binance
-async def monitor_orderbook(symbol: str = "BTCUSDT"):
-    """
-    Підключення до WebSocket потоку depth20@100ms для моніторингу заявок на покупку та продаж.
-    Зберігає інформацію про великі buy/sell стіни для подальшого використання в GPT аналізі.
-    """
-    global current_buy_wall, current_sell_wall, last_bid_wall, last_ask_wall, fake_wall_detected, fake_wall_counter, last_fake_wall_time
-    current_buy_wall = None  # тип: Optional[float]
-    current_sell_wall = None  # тип: Optional[float]
+    def format_qty(self, qty: float) -> str:
+        return f"{self.floor_qty(qty):.{self.filters['quantity_precision']}f}"
 
-    uri = f"wss://fstream.binance.com/ws/{symbol.lower()}@depth20@100ms"
+    def format_price(self, price: float) -> str:
+        tick = self.filters["tick_size"]
+        return f"{round(price / tick) * tick:.{self.filters['price_precision']}f}"
 
-    while True:
-        try:
-            async with websockets.connect(uri, ping_interval=None) as websocket:
-                send_message(f"✅ Підключено до Orderbook WebSocket: {symbol}")
+    def arm(self, price: float, stake_usd: float):
+        if self.filters is None:
+            return
+        self.armed = {side: self.build_bracket(side, price, stake_usd) for side in ("LONG", "SHORT")}
+
+    def get_armed(self, side: str, stake_usd: float) -> dict:
+        """
+        Заздалегідь зібраний bracket; якщо він застарів або ставка змінилась — збирається зараз.
+        """
+        armed = self.armed[side]
+        max_age_ms = CONFIG["PRICE_MAX_AGE_SECONDS"] * 1000
+        if armed is None or armed["stake_usd"] != stake_usd or time.time() * 1000 - armed["armed_ms"] > max_age_ms:
+            if self.filters is None:
+                raise RuntimeError("Фільтри символу ще не завантажені")
+            armed = self.build_bracket(side, price_cache.last_price(), stake_usd)
+        return armed
+
+    async def open_bracket(self, armed: dict, decision_ms: float = None) -> dict:
+        """
+        Повертає звіт з ok, orders, errors, rtt_ms, decision_to_wire_ms.
+        decision_to_wire — від рішення (після всіх перевірок) до підписаного запиту перед записом
+        у сокет; rtt — від цього моменту до відповіді.
+        """
+        side, qty = armed["side"], armed["qty"]
+        legs = dict(zip(self.LEGS, armed["legs"]))
+        timing = {}
+        responses = await binance_client.futures_place_batch_order(batchOrders=list(legs.values()), timing=timing)
+        wire_ms = timing.get("wire_ms", time.time() * 1000)
+        rtt_ms = time.time() * 1000 - wire_ms
+        self.latency["batch_rtt"].append(rtt_ms)
+        if decision_ms is not None:
+            self.latency["decision_to_wire"].append(wire_ms - decision_ms)
+        self.brackets += 1
+
+        orders, errors = {}, {}
+        for name, response in zip(self.LEGS, responses):
+            if "orderId" in response:
+                orders[name] = response
+            else:
+                errors[name] = response.get("msg", str(response))
 
-                while True:
-                    try:
-                        msg = await websocket.recv()
-                        data = json.loads(msg)
+        report = {
+            "ok": not errors, "orders": orders, "errors": errors, "rtt_ms": round(rtt_ms, 1),
+            "decision_to_wire_ms": round(wire_ms - decision_ms, 2) if decision_ms is not None else None,
+        }
+        if not errors:
+            return report
+        self.partial_failures += 1
 
-                        bids = data.get("b", [])  # список [price, quantity]
-                        asks = data.get("a", [])
+        if "entry" in errors:
+            # Позиції немає — захисні ордери не потрібні
+            await self.cancel_orders([order["orderId"] for order in orders.values()])
+            report["ok"] = False
+            return report
 
-                        # Знаходимо найбільшу заявку на купівлю
-                        max_bid_qty = max([float(qty) for price, qty in bids if float(qty) > 0], default=0)
-                        # Знаходимо найбільшу заявку на продаж
-                        max_ask_qty = max([float(qty) for price, qty in asks if float(qty) > 0], default=0)
+        for name in list(errors):
+            try:
+                retry_ms = time.time() * 1000
+                orders[name] = await binance_client.futures_create_order(**legs[name])
+                self.latency[f"{name}_retry_rtt"].append(time.time() * 1000 - retry_ms)
+                del errors[name]
+                self.retried_legs += 1
+            except Exception as e:
+                errors[name] = f"{errors[name]}; повтор: {e}"
 
-                        # Оновлюємо глобальні змінні
-                        current_buy_wall = max_bid_qty
-                        current_sell_wall = max_ask_qty
+        if errors:
+            # Позиція без TP/SL — закриваємо одразу; захисні ноги, що лишились, скасовуються за будь-якого результату
+            try:
+                await self.flatten(side, qty)
+                report["flattened"] = True
+            except Exception as e:
+                report["flattened"] = False
+                errors["flatten"] = str(e)
+                send_message(f"🚨 {side}: не вдалося закрити позицію без TP/SL ({qty}): {e}. Потрібне ручне втручання!")
+            finally:
+                leftover = [order["orderId"] for name, order in orders.items() if name != "entry"]
+                try:
+                    await self.cancel_orders(leftover)
+                except Exception as e:
+                    errors["cancel"] = str(e)
+                    send_message(f"🚨 {side}: не вдалося скасувати захисні ордери {leftover}: {e}")
+        report["ok"] = not errors
+        report["errors"] = errors
+        return report
+
+    async def flatten(self, side: str, qty: float):
+        await binance_client.futures_create_order(
+            symbol=self.symbol,
+            side="SELL" if side == "LONG" else "BUY",
+            type="MARKET",
+            quantity=qty,
+            positionSide=side
+        )
+        self.flattened += 1
+
+    async def cancel_orders(self, order_ids: list) -> int:
+        """
+        Скасування пачками по 10; повертає кількість успішно скасованих.
+        """
+        cancelled = 0
+        for start in range(0, len(order_ids), self.CANCEL_BATCH):
+            chunk = order_ids[start:start + self.CANCEL_BATCH]
+            sent_ms = time.time() * 1000
+            responses = await binance_client.futures_cancel_orders(symbol=self.symbol, orderIdList=chunk)
+            self.latency["cancel_rtt"].append(time.time() * 1000 - sent_ms)
+            cancelled += sum(1 for response in responses if "orderId" in response)
+        return cancelled
+
+    def stats(self) -> dict:
+        return {
+            "brackets": self.brackets,
+            "partial_failures": self.partial_failures,
+            "retried_legs": self.retried_legs,
+            "flattened": self.flattened,
+            "latency_ms": {
+                name: {
+                    "avg": round(sum(values) / len(values), 1),
+                    "max": round(max(values), 1),
+                    "last": round(values[-1], 1),
+                }
+                for name, values in self.latency.items() if values
+            },
+        }
 
-                       # 🔍 Перевірка на повторне зникнення стіни
-                        if last_bid_wall > 0 and current_buy_wall < last_bid_wall * 0.3:
-                            fake_wall_counter += 1
-                            if fake_wall_counter >= 3 and time.time() - last_fake_wall_time > 30:
-                                fake_wall_detected = True
-                                last_fake_wall_time = time.time()
-                                fake_wall_counter = 0  # скидаємо
-                        else:
-                            fake_wall_counter = 0  # якщо відновилась — скидуємо
 
+# 📐 Фільтри символу для OrderExecutor: повтор, поки exchangeInfo не відповість
+async def load_executor_filters():
+    while order_executor.filters is None:
+        try:
+            await order_executor.load_filters()
+        except Exception as e:
+            send_message(f"❌ Executor filters error: {e}")
+            await asyncio.sleep(10)
 
 
-                        # 🔁 Оновлення для наступної перевірки
-                        last_bid_wall = current_buy_wall
-                        last_ask_wall = current_sell_wall
+# 🧰 Скасування існуючого стоп-ордеру для сторони
+async def cancel_existing_orders(side):
+    try:
+        if account_mirror.live:
+            orders = account_mirror.orders_for(side)
+        else:
+            orders = [
+                {**o, "position_side": o["positionSide"]}
+                for o in await binance_client.futures_get_open_orders(symbol=CONFIG["SYMBOL"])
+            ]
+        await order_executor.cancel_orders([
+            o["orderId"] for o in orders
+            if o["position_side"] == side and o["type"] in ["STOP_MARKET", "TAKE_PROFIT_MARKET"]
+        ])
+    except Exception as e:
+        send_message(f"❌ Cancel order error ({side}): {e}")
 
-                    except Exception as inner_error:
-                        send_message(f"⚠️ Orderbook inside error: {inner_error}")
-                        await asyncio.sleep(1)
-                        break  # Перезапуск WebSocket
+# 🛡️ Спрощене супроводження трейлінг-стопів і часткових закриттів
+# Рівні TRAILING_LEVELS: ключ — прибуток у %, значення — куди ставимо стоп відносно входу (частка).
+# Після часткового закриття на PARTIAL_CLOSE_AT % стоп не нижче входу + BREAKEVEN_SL_OFFSET.
+def new_trailing_state(side: str, entry: float) -> dict:
+    stop_orders = [o for o in account_mirror.orders_for(side) if o["type"] == "STOP_MARKET"]
+    return {
+        "entry": entry,
+        "sl": stop_orders[0]["stop_price"] if stop_orders else entry * CONFIG["TP_SL"][side]["SL"],
+        "stop_qty": None,  # None — стоп із closePosition з bracket
+        "level": None,
+        "partial_done": False,
+        "busy": False,
+    }
+
+
+def plan_trailing_action(side: str, state: dict, qty: float, price: float):
+    """
+    Що зробити на цьому тіку: ("partial", qty), ("stop", нова_ціна, рівень) або None.
+    """
+    entry = state["entry"]
+    direction = 1 if side == "LONG" else -1
+    profit_pct = (price - entry) / entry * 100 * direction
+
+    if not state["partial_done"] and profit_pct >= CONFIG["PARTIAL_CLOSE_AT"]:
+        return ("partial", qty * CONFIG["PARTIAL_CLOSE_SIZE"])
+
+    offset, level = None, state["level"]
+    for level_pct, level_offset in sorted(CONFIG["TRAILING_LEVELS"].items(), key=lambda item: float(item[0])):
+        if profit_pct >= float(level_pct):
+            offset, level = level_offset, level_pct
+    if state["partial_done"]:
+        offset = max(offset if offset is not None else -1.0, CONFIG["BREAKEVEN_SL_OFFSET"])
+        level = level or "breakeven"
+    if offset is None:
+        return None
 
-        except Exception as outer_error:
-            send_message(f"❌ Orderbook connection error: {outer_error}")
-            await asyncio.sleep(5)
+    new_sl = entry * (1 + offset * direction)
+    if (new_sl - state["sl"]) * direction > 0:
+        return ("stop", new_sl, level)
+    if state["stop_qty"] is not None and abs(state["stop_qty"] - qty) > 1e-9:
+        return ("stop", state["sl"], state["level"])  # обсяг позиції змінився — оновлюємо кількість стопа
+    return None
+
+
+def supervise_positions(price: float):
+    """
+    Викликається на кожному тіку ціни; дії з біржею виконуються окремою задачею.
+    """
+    if not account_mirror.live:
+        return
+    for side in ("LONG", "SHORT"):
+        qty = account_mirror.position_qty(side)
+        if qty == 0:
+            trailing_stops[side] = None
+            continue
+        entry = account_mirror.entry_price(side)
+        state = trailing_stops[side]
+        if state is None or state["entry"] != entry:
+            state = trailing_stops[side] = new_trailing_state(side, entry)
+        if state["busy"]:
+            continue
+        action = plan_trailing_action(side, state, qty, price)
+        if action:
+            state["busy"] = True
+            asyncio.get_running_loop().create_task(run_trailing_action(side, state, action, qty))
+
+
+async def replace_stop_order(side: str, stop_price: float, qty: float) -> dict:
+    """
+    Новий STOP_MARKET ставиться до скасування старого — позиція ні миті без стопа.
+    """
+    order = await binance_client.futures_create_order(
+        symbol=CONFIG["SYMBOL"],
+        side="SELL" if side == "LONG" else "BUY",
+        type="STOP_MARKET",
+        stopPrice=order_executor.format_price(stop_price),
+        quantity=order_executor.format_qty(qty),
+        positionSide=side
+    )
+    await order_executor.cancel_orders([
+        o["orderId"] for o in account_mirror.orders_for(side)
+        if o["type"] == "STOP_MARKET" and o["orderId"] != order["orderId"]
+    ])
+    return order
+
+
+async def run_trailing_action(side: str, state: dict, action: tuple, qty: float):
+    try:
+        if action[0] == "partial":
+            close_qty = order_executor.floor_qty(action[1])
+            if close_qty >= order_executor.filters["min_qty"]:
+                await binance_client.futures_create_order(
+                    symbol=CONFIG["SYMBOL"],
+                    side="SELL" if side == "LONG" else "BUY",
+                    type="MARKET",
+                    quantity=order_executor.format_qty(close_qty),
+                    positionSide=side
+                )
+                send_message(f"✂️ {side}: часткове закриття {close_qty} на +{CONFIG['PARTIAL_CLOSE_AT']}%")
+            state["partial_done"] = True
+        else:
+            _, new_sl, level = action
+            await replace_stop_order(side, new_sl, qty)
+            if level != state["level"] or new_sl != state["sl"]:
+                send_message(f"🛡️ {side}: стоп → {order_executor.format_price(new_sl)} (рівень {level})")
+            state["sl"], state["level"], state["stop_qty"] = new_sl, level, qty
+    except Exception as e:
+        send_message(f"❌ Trailing error ({side}): {e}")
+    finally:
+        state["busy"] = False
 
 
 # 📈 Відкриття LONG угоди (з перевіркою і безпечною взаємодією)
@@ -985,65 +4471,46 @@ async def place_long(symbol: str, usd: float):
     """
     async with open_position_lock:
         # Спочатку закриваємо SHORT, якщо відкритий
-        if has_open_position("SHORT"):
+        if await has_open_position("SHORT"):
             await safe_close_position("SHORT")
 
         # Перевірка: якщо SHORT ще відкритий — не відкривати LONG
-        if has_open_position("SHORT"):
+        if await has_open_position("SHORT"):
             send_message("❗ SHORT ще відкритий — НЕ відкриваємо LONG!")
             return
 
         # Перевірка: якщо вже відкритий LONG — не відкривати ще один
-        if has_open_position("LONG"):
+        if await has_open_position("LONG"):
             send_message("⚠️ Уже відкрита LONG позиція")
             return
 
         try:
-            # Отримуємо поточну ціну для розрахунку кількості
-            entry: float = float(binance_client.futures_mark_price(symbol=symbol)["markPrice"])
-            qty: float = round(usd / entry, 3)
-            if not qty:
-                send_message("❌ Не вдалося розрахувати кількість для LONG")
-                return
+            # Перед відкриттям нової позиції очищаємо старі ордери
+            await cancel_existing_orders("LONG")
 
-            tp: float = round(entry * CONFIG["TP_SL"]["LONG"]["TP"], 2)
-            sl: float = round(entry * CONFIG["TP_SL"]["LONG"]["SL"], 2)
+            # ⏱️ Перевірки завершено — звідси міряємо шлях до відправки
+            decision_ms = time.time() * 1000
 
-            # Перед відкриттям нової позиції очищаємо старі ордери
-            cancel_existing_orders("LONG")
+            # Готовий payload з останнього тіку (округлений за фільтрами символу)
+            armed = order_executor.get_armed("LONG", usd)
+            if armed is None:
+                send_message("❌ Не вдалося розрахувати кількість для LONG")
+                return
+            entry, qty, tp, sl = armed["entry"], armed["qty"], armed["tp"], armed["sl"]
 
             if DRY_RUN:
                 send_message(f"🤖 [DRY_RUN] LONG\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}")
             else:
-                # Відкриття LONG через MARKET
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='BUY',
-                    type='MARKET',
-                    quantity=qty,
-                    positionSide='LONG'
-                )
-                # Створення тейк-профіту
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='SELL',
-                    type='TAKE_PROFIT_MARKET',
-                    stopPrice=tp,
-                    closePosition=True,
-                    timeInForce="GTC",
-                    positionSide='LONG'
+                # Вхід MARKET + тейк-профіт + стоп-лос одним batchOrders
+                report = await order_executor.open_bracket(armed, decision_ms)
+                if not report["ok"]:
+                    flattened = {True: " Позицію закрито.", False: " ⚠️ Позицію НЕ закрито!"}.get(report.get("flattened"), "")
+                    send_message(f"❌ LONG batch помилка: {report['errors']}.{flattened}")
+                    return
+                send_message(
+                    f"🟢 LONG OPEN\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}\n"
+                    f"⚡ Рішення → відправка: {report['decision_to_wire_ms']} мс, RTT: {report['rtt_ms']} мс"
                 )
-                # Створення стоп-лоссу
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='SELL',
-                    type='STOP_MARKET',
-                    stopPrice=sl,
-                    closePosition=True,
-                    timeInForce="GTC",
-                    positionSide='LONG'
-                )
-                send_message(f"🟢 LONG OPEN\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}")
                 log_to_sheet(
                     type_="LONG",
                     entry=entry,
@@ -1051,7 +4518,8 @@ async def place_long(symbol: str, usd: float):
                     sl=sl,
                     qty=qty,
                     result=None,
-                    comment="GPT сигнал"
+                    comment="GPT сигнал",
+                    order_id=report["orders"]["entry"]["orderId"]
                 )
 
 
@@ -1066,65 +4534,46 @@ async def place_short(symbol: str, usd: float):
     """
     async with open_position_lock:
         # Спочатку закриваємо LONG, якщо відкритий
-        if has_open_position("LONG"):
+        if await has_open_position("LONG"):
             await safe_close_position("LONG")
 
         # Перевірка: якщо LONG ще відкритий — не відкривати SHORT
-        if has_open_position("LONG"):
+        if await has_open_position("LONG"):
             send_message("❗ LONG ще відкритий — НЕ відкриваємо SHORT!")
             return
 
         # Перевірка: якщо вже відкритий SHORT — не відкривати ще один
-        if has_open_position("SHORT"):
+        if await has_open_position("SHORT"):
             send_message("⚠️ Уже відкрита SHORT позиція")
             return
 
         try:
-            # Отримуємо поточну ціну для розрахунку кількості
-            entry: float = float(binance_client.futures_mark_price(symbol=symbol)["markPrice"])
-            qty: float = round(usd / entry, 3)
-            if not qty:
-                send_message("❌ Не вдалося розрахувати кількість для SHORT")
-                return
+            # Перед відкриттям нової позиції очищаємо старі ордери
+            await cancel_existing_orders("SHORT")
 
-            tp: float = round(entry * CONFIG["TP_SL"]["SHORT"]["TP"], 2)
-            sl: float = round(entry * CONFIG["TP_SL"]["SHORT"]["SL"], 2)
+            # ⏱️ Перевірки завершено — звідси міряємо шлях до відправки
+            decision_ms = time.time() * 1000
 
-            # Перед відкриттям нової позиції очищаємо старі ордери
-            cancel_existing_orders("SHORT")
+            # Готовий payload з останнього тіку (округлений за фільтрами символу)
+            armed = order_executor.get_armed("SHORT", usd)
+            if armed is None:
+                send_message("❌ Не вдалося розрахувати кількість для SHORT")
+                return
+            entry, qty, tp, sl = armed["entry"], armed["qty"], armed["tp"], armed["sl"]
 
             if DRY_RUN:
                 send_message(f"🤖 [DRY_RUN] SHORT\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}")
             else:
-                # Відкриття SHORT через MARKET
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='SELL',
-                    type='MARKET',
-                    quantity=qty,
-                    positionSide='SHORT'
+                # Вхід MARKET + тейк-профіт + стоп-лос одним batchOrders
+                report = await order_executor.open_bracket(armed, decision_ms)
+                if not report["ok"]:
+                    flattened = {True: " Позицію закрито.", False: " ⚠️ Позицію НЕ закрито!"}.get(report.get("flattened"), "")
+                    send_message(f"❌ SHORT batch помилка: {report['errors']}.{flattened}")
+                    return
+                send_message(
+                    f"🔴 SHORT OPEN\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}\n"
+                    f"⚡ Рішення → відправка: {report['decision_to_wire_ms']} мс, RTT: {report['rtt_ms']} мс"
                 )
-                # Створення тейк-профіту
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='BUY',
-                    type='TAKE_PROFIT_MARKET',
-                    stopPrice=tp,
-                    closePosition=True,
-                    timeInForce="GTC",
-                    positionSide='SHORT'
-                )
-                # Створення стоп-лоссу
-                binance_client.futures_create_order(
-                    symbol=symbol,
-                    side='BUY',
-                    type='STOP_MARKET',
-                    stopPrice=sl,
-                    closePosition=True,
-                    timeInForce="GTC",
-                    positionSide='SHORT'
-                )
-                send_message(f"🔴 SHORT OPEN\n📍 Entry: {entry}\n📦 Qty: {qty}\n🎯 TP: {tp}\n🛡️ SL: {sl}")
                 log_to_sheet(
                     type_="SHORT",
                     entry=entry,
@@ -1132,7 +4581,8 @@ async def place_short(symbol: str, usd: float):
                     sl=sl,
                     qty=qty,
                     result=None,
-                    comment="GPT сигнал"
+                    comment="GPT сигнал",
+                    order_id=report["orders"]["entry"]["orderId"]
                 )
 
 
@@ -1141,9 +4591,11 @@ async def place_short(symbol: str, usd: float):
 
 
             
-# 📒 Підключення до Google Sheets
+# 📒 Підключення до Google Sheets: один авторизований клієнт і таблиця на весь процес
+gspread_cache: dict = {}
+
 def get_gspread_client():
-    try:
+    if "client" not in gspread_cache:
         scope = [
             "https://spreadsheets.google.com/feeds",
             "https://www.googleapis.com/auth/drive"
@@ -1151,10 +4603,21 @@ def get_gspread_client():
         creds = ServiceAccountCredentials.from_json_keyfile_name(
             "/etc/secrets/credentials.json", scope
         )
-        return gspread.authorize(creds)
-    except Exception as e:
-        send_message(f"❌ GSpread auth error: {e}")
-        return None
+        gspread_cache["client"] = gspread.authorize(creds)
+    return gspread_cache["client"]
+
+
+def get_spreadsheet():
+    if "spreadsheet" not in gspread_cache:
+        gspread_cache["spreadsheet"] = get_gspread_client().open_by_key(GOOGLE_SHEET_ID)
+    return gspread_cache["spreadsheet"]
+
+
+def reset_spreadsheet():
+    """
+    Після помилки — повторна авторизація при наступному зверненні.
+    """
+    gspread_cache.clear()
      # 🛡️ Безпечне закриття відкритої позиції через MARKET
 async def safe_close_position(side: str):
     """
@@ -1162,10 +4625,10 @@ async def safe_close_position(side: str):
     Якщо помилка через reduceOnly — повторна спроба без reduceOnly.
     """
     try:
-        qty_to_close: float = get_current_position_qty(side)
+        qty_to_close: float = await get_current_position_qty(side)
         if qty_to_close > 0:
             try:
-                binance_client.futures_create_order(
+                await binance_client.futures_create_order(
                     symbol=CONFIG["SYMBOL"],
                     side='SELL' if side == "LONG" else 'BUY',
                     type='MARKET',
@@ -1181,7 +4644,7 @@ async def safe_close_position(side: str):
                 if "reduceonly" in error_text.lower():
                     send_message(f"⛔ Пробую закрити {side} через чистий MARKET без reduceOnly...")
                     try:
-                        binance_client.futures_create_order(
+                        await binance_client.futures_create_order(
                             symbol=CONFIG["SYMBOL"],
                             side='SELL' if side == "LONG" else 'BUY',
                             type='MARKET',
@@ -1203,9 +4666,9 @@ async def handle_signal(signal: str):
     """
     try:
         side_now: str = None
-        if has_open_position("LONG"):
+        if await has_open_position("LONG"):
             side_now = "LONG"
-        elif has_open_position("SHORT"):
+        elif await has_open_position("SHORT"):
             side_now = "SHORT"
 
         # Визначаємо напрямок і тип сигналу
@@ -1264,13 +4727,13 @@ async def close_all_positions_and_orders():
     а також скасовує всі відкриті стопи і тейки.
     """
     try:
-        qty_long: float = get_current_position_qty("LONG")
-        qty_short: float = get_current_position_qty("SHORT")
+        qty_long: float = await get_current_position_qty("LONG")
+        qty_short: float = await get_current_position_qty("SHORT")
 
         # Закриваємо LONG
         if qty_long > 0:
             try:
-                binance_client.futures_create_order(
+                await binance_client.futures_create_order(
                     symbol=CONFIG["SYMBOL"],
                     side='SELL',
                     type='MARKET',
@@ -1286,7 +4749,7 @@ async def close_all_positions_and_orders():
         # Закриваємо SHORT
         if qty_short > 0:
             try:
-                binance_client.futures_create_order(
+                await binance_client.futures_create_order(
                     symbol=CONFIG["SYMBOL"],
                     side='BUY',
                     type='MARKET',
@@ -1306,12 +4769,11 @@ async def close_all_positions_and_orders():
 
         # Після закриття всіх позицій — прибираємо всі відкриті ордери
         try:
-            open_orders: list = binance_client.futures_get_open_orders(symbol=CONFIG["SYMBOL"])
-            for order in open_orders:
-                binance_client.futures_cancel_order(
-                    symbol=CONFIG["SYMBOL"],
-                    orderId=order["orderId"]
-                )
+            if account_mirror.live:
+                open_orders: list = account_mirror.orders_for()
+            else:
+                open_orders: list = await binance_client.futures_get_open_orders(symbol=CONFIG["SYMBOL"])
+            await order_executor.cancel_orders([order["orderId"] for order in open_orders])
             send_message("🧹 Видалено всі відкриті стопи та тейки.")
         except Exception as e:
             send_message(f"❌ Помилка скасування ордерів: {e}")
@@ -1320,72 +4782,50 @@ async def close_all_positions_and_orders():
         send_message(f"❌ Close all positions error: {e}")
 
 # 🧠 Моніторинг закриття позицій + запис результатів у Google Sheets
-closed_positions_handled = set()
-
 async def monitor_closures():
+    """
+    Завершені раунд-трипи з журналу угод: точний PnL після комісій з фактичних виконань.
+    """
+    global current_stake_usd, win_streak
     while True:
+        trip = await trade_ledger.round_trips.get()
         try:
-            for side in ["LONG", "SHORT"]:
-                positions = binance_client.futures_position_information(symbol="BTCUSDT")
-                pos = next((p for p in positions if
-                            float(p["positionAmt"]) == 0 and
-                            ((side == "LONG" and float(p["entryPrice"]) > 0) or
-                             (side == "SHORT" and float(p["entryPrice"]) > 0))), None)
-
-                if pos:
-                    pos_id = f"{side}-{pos['updateTime']}"
-                    if pos_id in closed_positions_handled:
-                        continue
-                    closed_positions_handled.add(pos_id)
-
-                    entry = float(pos["entryPrice"])
-                    mark = float(binance_client.futures_mark_price(symbol="BTCUSDT")["markPrice"])
-
-                    if entry == 0:
-                        continue  # захист від ділення на 0
-
-                    pnl = round((mark - entry) * 1000, 2) if side == "LONG" else round((entry - mark) * 1000, 2)
-                    result = "WIN" if pnl > 0 else "LOSS"
-
-                    update_result_in_sheet(side, result, f"{pnl:+.2f}")
-
-                    # 🧠 Логування помилки у GPT памʼять при LOSS
-                    if result == "LOSS":
-                        reason = explain_trade_outcome(side, result, pnl)
-                        update_stats_sheet()
-                        log_learning_entry(side, result, reason, pnl)
-                        send_message(f"🧠 GPT пояснення збитку:\n{reason}")
-                    
-                    else:
-                        update_stats_sheet()
-
+            side = trip["side"]
+            pnl = trip["net_pnl"]
+            result = trip["result"]
+            send_message(
+                f"📒 {side} закрито: {pnl:+.2f} USDT (комісії {trip['fees']:.2f}), "
+                f"{trip['entry_price']:.1f} → {trip['exit_price']:.1f}, {trip['holding_seconds']:.0f} сек"
+            )
 
-                    
-                    global current_stake_usd, win_streak
+            update_result_in_sheet(side, result, f"{pnl:+.2f}", trip["order_ids"])
 
-                    if result == "WIN":
-                        win_streak += 1
-                        if win_streak >= 5:
-                            send_message(f"🏁 Досягнуто 5 перемог! Скидаємо ставку.")
-                            current_stake_usd = CONFIG["TRADE_AMOUNT_USD"]
-                            win_streak = 0
-                        else:
-                            current_stake_usd *= 2
-                            send_message(f"✅ WIN. Ставка тепер {current_stake_usd}$ (стрик {win_streak})")
-                    else:
-                        current_stake_usd = CONFIG["TRADE_AMOUNT_USD"]
-                        win_streak = 0
-                        send_message(f"❌ LOSS. Скидаємо ставку на {current_stake_usd}$")
+            # 🧠 Логування помилки у GPT памʼять при LOSS
+            if result == "LOSS":
+                reason = await asyncio.to_thread(explain_trade_outcome, side, result, pnl)
+                update_stats_sheet()
+                log_learning_entry(side, result, reason, pnl)
+                send_message(f"🧠 GPT пояснення збитку:\n{reason}")
 
+            else:
+                update_stats_sheet()
 
-                    # 🧹 Обмеження розміру закритих позицій
-                    if len(closed_positions_handled) > 100:
-                        closed_positions_handled.clear()
+            if result == "WIN":
+                win_streak += 1
+                if win_streak >= 5:
+                    send_message(f"🏁 Досягнуто 5 перемог! Скидаємо ставку.")
+                    current_stake_usd = CONFIG["TRADE_AMOUNT_USD"]
+                    win_streak = 0
+                else:
+                    current_stake_usd *= 2
+                    send_message(f"✅ WIN. Ставка тепер {current_stake_usd}$ (стрик {win_streak})")
+            else:
+                current_stake_usd = CONFIG["TRADE_AMOUNT_USD"]
+                win_streak = 0
+                send_message(f"❌ LOSS. Скидаємо ставку на {current_stake_usd}$")
 
         except Exception as e:
             send_message(f"⚠️ Closure check error: {e}")
-
-        await asyncio.sleep(60)
 # 🧠 Пояснення результату угоди через GPT (чому WIN або чому LOSS)
 def explain_trade_outcome(trade_type, result, pnl):
     try:
@@ -1412,40 +4852,39 @@ PnL: {pnl}
         send_message(f"❌ GPT (explain_trade) error: {e}")
         return "Не вдалося отримати пояснення від GPT."
 
-# 📚 Логування результату та пояснення у "Learning Log" Google Sheets
+# 📚 Логування результату та пояснення у "Learning Log" (журнал → Sheets у фоні)
 def log_learning_entry(trade_type, result, reason, pnl=None):
     try:
-        gclient = get_gspread_client()
-        if not gclient:
-            return
-
-        sh = gclient.open_by_key(GOOGLE_SHEET_ID)
-
-        try:
-            sheet = sh.worksheet("Learning Log")
-        except Exception:
-            sheet = sh.add_worksheet(title="Learning Log", rows="1000", cols="10")
-            sheet.append_row(["Time", "Type", "Result", "PnL", "GPT Analysis"])
-
-        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        row = [now, trade_type, result, pnl or "", reason]
-        sheet.append_row(row)
+        trade_journal.log_learning(trade_type, result, reason, pnl)
     except Exception as e:
         send_message(f"❌ Learning Log error: {e}")
 # 🚀 Запуск усіх моніторів при старті FastAPI
 @app.on_event("startup")
 
 async def start_all_monitors():
+    notifier.start()           # 📬 Фоновий воркер Telegram-повідомлень
     try:
         check_env_variables()  # 🔐 Перевірка наявності важливих ENV
         init_runtime_state()   # ♻️ Скидання кешу і стану при перезапуску
+        await binance_client.start()         # 🌐 Спільна REST-сесія + воркери черги
+        await seed_journal_from_sheets()     # 🗃️ Перший запуск: історія з Sheets у журнал
 
+        asyncio.create_task(load_executor_filters())       # 📐 exchangeInfo для готових ордерів (з повтором)
         asyncio.create_task(monitor_market_cache())        # 📡 Кешування OI/Volume/VWAP
-        asyncio.create_task(monitor_cluster_trades())      # 🧠 Кластерний моніторинг та GPT-аналіз
+        asyncio.create_task(market_hub.run())              # 🔀 Єдиний сокет ринкових потоків
+        asyncio.create_task(monitor_cluster_trades())      # 🧠 Наповнення кластерів з черги угод
+        asyncio.create_task(close_cluster_windows())       # ⏲️ Знімки вікон по межах інтервалу
+        asyncio.create_task(evaluate_cluster_signals())    # 🧠 Оцінка кластерів та GPT-аналіз
+        asyncio.create_task(run_user_data_stream())        # 👤 Позиції/ордери з user data stream
         asyncio.create_task(monitor_closures())            # 📈 Моніторинг закриття угод і логування
-        asyncio.create_task(monitor_orderbook(CONFIG["SYMBOL"]))
+        asyncio.create_task(maintain_local_orderbook(CONFIG["SYMBOL"]))  # 📚 Локальний стакан з diff-потоку
+        asyncio.create_task(monitor_wall_trades())         # 🕵️ Угоди для трекера стін
+        asyncio.create_task(maintain_price_cache())        # 💲 markPrice@1s + bookTicker
+        for key, store in kline_stores.items():            # 🕯️ Свічки 1m/5m у памʼяті
+            asyncio.create_task(maintain_kline_store(store, kline_queues[key], indicator_engines[key]))
         asyncio.create_task(monitor_delta_volume(CONFIG["SYMBOL"]))
         asyncio.create_task(periodic_stats_update())  # 🕒 Автооновлення статистики кожні 5 хв
+        asyncio.create_task(replicate_journal())      # 🔁 Журнал → Google Sheets пачками
 
 
 
@@ -1456,8 +4895,8 @@ async def start_all_monitors():
 # 📊 Моніторинг дельти обʼєму та підрахунок Buy/Sell Ratio у реальному часі
 async def monitor_delta_volume(symbol: str = "BTCUSDT"):
     """
-    Підключення до WebSocket потоку aggTrade для підрахунку Buy Volume, Sell Volume, Delta і Buy/Sell Ratio.
-    Оновлення кожні 3 секунди.
+    Споживач потоку aggTrade з MarketStreamHub: наповнює спільний cvd_engine і
+    оновлює Buy Volume, Sell Volume та Buy/Sell Ratio за ковзне вікно DELTA_WINDOW_SECONDS.
     """
     global current_buy_volume, current_sell_volume, current_buy_ratio, current_sell_ratio
 
@@ -1467,65 +4906,34 @@ async def monitor_delta_volume(symbol: str = "BTCUSDT"):
     current_buy_ratio = 50.0  # Стартові значення в центрі
     current_sell_ratio = 50.0
 
-
-    uri: str = f"wss://fstream.binance.com/ws/{symbol.lower()}@aggTrade"
+    last_update_time: float = time.time()
+    last_print_time: float = time.time()
 
     while True:
         try:
-            async with websockets.connect(uri, ping_interval=None) as websocket:
-                send_message(f"✅ Підключено до Delta Volume WebSocket: {symbol}")
-
-                buy_volume_batch: float = 0.0
-                sell_volume_batch: float = 0.0
-                last_update_time: float = time.time()
-
-                while True:
-                    try:
-                        msg_raw = await websocket.recv()
-                        msg = json.loads(msg_raw)
-
-                        price: float = float(msg['p'])
-                        qty: float = float(msg['q'])
-                        is_sell: bool = msg['m']
-
-                        if is_sell:
-                            sell_volume_batch += price * qty
-                        else:
-                            buy_volume_batch += price * qty
-
-                        now: float = time.time()
-
-                        # Оновлюємо дані кожні 3 секунди
-                        if now - last_update_time >= 3:
-                            total_volume: float = buy_volume_batch + sell_volume_batch
-
-                            if total_volume > 0:
-                                current_buy_ratio = round((buy_volume_batch / total_volume) * 100, 2)
-                                current_sell_ratio = 100.0 - current_buy_ratio
-                            else:
-                                current_buy_ratio = 50.0
-                                current_sell_ratio = 50.0
-
-                            # Зберігаємо фактичні об'єми
-                            current_buy_volume = buy_volume_batch
-                            current_sell_volume = sell_volume_batch
-
-                            # Лог в консоль для дебагу
-                            print(f"📈 Delta Update: Buy {current_buy_ratio}% | Sell {current_sell_ratio}% | BuyVolume ${round(buy_volume_batch)} | SellVolume ${round(sell_volume_batch)}")
-
-                            # Скидаємо батч для наступної порції
-                            buy_volume_batch = 0.0
-                            sell_volume_batch = 0.0
-                            last_update_time = now
-
-                    except Exception as inner_error:
-                        send_message(f"⚠️ Delta volume internal error: {inner_error}")
-                        await asyncio.sleep(1)
-                        break  # Перезапуск WebSocket
-
-        except Exception as outer_error:
-            send_message(f"❌ Delta volume connection error: {outer_error}")
-            await asyncio.sleep(5)  # Перезапуск WebSocket
+            trade = await delta_trade_queue.get()
+            cvd_engine.add(trade.T, trade.price, trade.qty, trade.is_sell)
+
+            now: float = time.time()
+
+            # Ковзне вікно оновлюємо не частіше разу на 100 мс — запит O(1)
+            if now - last_update_time >= 0.1:
+                window = cvd_engine.window(CONFIG["DELTA_WINDOW_SECONDS"], quote=True)
+                current_buy_ratio = window["buy_ratio"]
+                current_sell_ratio = round(100.0 - current_buy_ratio, 2)
+                current_buy_volume = window["buy"]
+                current_sell_volume = window["sell"]
+                mark_state_fresh("delta")
+                last_update_time = now
+
+            # Лог в консоль для дебагу
+            if now - last_print_time >= 3:
+                print(f"📈 Delta Update: Buy {current_buy_ratio}% | Sell {current_sell_ratio}% | BuyVolume ${round(current_buy_volume)} | SellVolume ${round(current_sell_volume)}")
+                last_print_time = now
+
+        except Exception as inner_error:
+            send_message(f"⚠️ Delta volume internal error: {inner_error}")
+            await asyncio.sleep(1)
 
 # 📬 Webhook приймає сигнали з TradingView або Postman
 @app.post("/webhook")
@@ -1543,12 +4951,10 @@ async def webhook(req: Request):
         oi = cached_oi
         volume = cached_volume
 
-        # 🔥 Безпечне отримання новин
-        try:
-            news = get_latest_news()
-        except Exception as news_error:
-            send_message(f"❌ News fallback error: {news_error}")
-            news = "⚠️ Новини тимчасово недоступні."
+        # 🔥 Новини з дедлайном; при запізненні — останні з кешу
+        context, report = await context_gatherer.gather("news")
+        report_late_context(report)
+        news = context["news"]
 
         if oi is None or volume is None:
             send_message("⚠️ Дані кешу ще не прогріті — пропущено webhook.")
@@ -1571,6 +4977,29 @@ async def webhook(req: Request):
         send_message(f"❌ Webhook error: {e}")
         return {"error": str(e)}
 
+@app.get("/ingest-stats")
+async def ingest_stats():
+    """
+    Метрики приймання ринкових потоків: затримка подій і черги споживачів.
+    """
+    return {
+        **market_hub.stats(),
+        "state": get_state_freshness(),
+        "orderbook": local_book.stats() if local_book else None,
+        "walls": wall_tracker.stats(),
+        "cvd": cvd_engine.stats(),
+        "price": price_cache.stats(),
+        "account": account_mirror.stats(),
+        "ledger": trade_ledger.stats(),
+        "execution": order_executor.stats(),
+        "rest": binance_client.stats(),
+        "journal": trade_journal.stats(),
+        "trade_stats": trade_stats.stats(),
+        "gpt_context": gpt_context.stats(),
+        "context_sources": context_gatherer.stats(),
+        "indicators": {interval: engine.snapshot() for (_, interval), engine in indicator_engines.items()},
+    }
+
 @app.get("/update-stats")
 async def manual_update_stats():
     """
@@ -1578,7 +5007,7 @@ async def manual_update_stats():
     """
     try:
         update_stats_sheet()
-        return {"status": "✅ Stats оновлено вручну"}
+        return {"status": "✅ Stats заплановано до оновлення", "stats": trade_stats.stats()}
     except Exception as e:
         return {"error": f"❌ Помилка при оновленні: {e}"}
 